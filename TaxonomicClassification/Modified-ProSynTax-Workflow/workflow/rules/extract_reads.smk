@@ -1,46 +1,51 @@
 rule kaiju_name_extract:
     """
-    Extract names of reads classified as Pro/Syn and obtain their full taxonomic classification. 
+    Single pass over names.out (bin_headers.py) that obtains:
+        - names of reads classified as Pro/Syn 
+        - their classification (genus, clade) as a pickled table, used by normalize_reads 
+        - names of reads of each Pro/Syn clade, one file per clade 
     """
     input:
-        kaiju_name = scratch_dict["kaiju_names"] / "{sample}_names.out",
+        kaiju_out = scratch_dict["kaiju_names"] / "{sample}_names.out",
     output:
         read_name_file = temp(scratch_dict["prosyn_reads"]["read_name"] / "{sample}.txt"), 
-        read_name_taxa_file = temp(scratch_dict["prosyn_reads"]["read_name_classification"] / "{sample}_classification.txt"), 
-    shell:
-        """
-        # obtain name of reads whose classification contains Pro/Syn 
-        grep -E "Prochlorococcus|Synechococcus" {input.kaiju_name} | cut -f2 > {output.read_name_file}
+        read_name_taxa_file = temp(scratch_dict["prosyn_reads"]["read_name_classification"] / "{sample}_classification.pkl"), 
+        binned_header_dir = directory(scratch_dict["prosyn_reads"]["binned_headers"] / "{sample}"), 
+    conda:
+        "../envs/python.yaml"
+    script:
+        "../scripts/bin_headers.py"
 
-        # obtain name and full taxonomic classification of reads whose classification contains Pro/Syn 
-        grep -E "Prochlorococcus|Synechococcus" {input.kaiju_name} | cut -f2,4 > {output.read_name_taxa_file}
-        """
+
+# mates (R2) of Pro/Syn reads are only extracted if set in config (EXTRACT_MATE, see Snakefile); 
+# no rule uses them, so they are written to results rather than as temp files 
+MATE_INPUT = {"r2": scratch_dict["thermus_removed_reads"] / "{sample}_2_trimmed_no_thermus.fastq.gz"} if EXTRACT_MATE else {}
+MATE_OUTPUT = {"rev_prosyn_reads": results_dict["prosyn_mate_reads"] / "{sample}_rev.fasta"} if EXTRACT_MATE else {}
 
 
-rule extract_fastq_reads:
+rule extract_prosyn_reads:
     """
-    Extract fastq of reads classified as Pro/Syn.
+    Extract fasta of reads classified as Pro/Syn (and of their mates, if extract_reads: write_mate in config). 
+    
+    The thermus-removed fastq is streamed once and fasta is written directly (no seqtk subseq + seq -A). 
+    No read name --> offset index is written (--index-dir): the thermus-removed fastq is temporary, 
+    so an index of it would never be reused. 
     """
     input: 
-        # r1 = scratch_dict["trimmed_reads"] / "{sample}_1_trimmed.fastq.gz",  # use the thermus-removed file instead 
-        r1 = scratch_dict["thermus_removed_reads"] / "{sample}_1_trimmed_no_thermus.fastq", 
+        r1 = scratch_dict["thermus_removed_reads"] / "{sample}_1_trimmed_no_thermus.fastq.gz", 
         prosyn_read_name = scratch_dict["prosyn_reads"]["read_name"] / "{sample}.txt", 
+        **MATE_INPUT, 
     output:
-        fwd_prosyn_reads = temp(scratch_dict["prosyn_reads"]["extracted_reads"] / "{sample}_fwd.fastq"), 
+        fwd_prosyn_reads = temp(scratch_dict["prosyn_reads"]["extracted_reads"] / "{sample}_fwd.fasta"), 
+        **MATE_OUTPUT, 
+    params:
+        script = Path(workflow.basedir) / "scripts" / "extract_reads.py", 
+        mate = lambda wildcards, input, output: f"--r2 {input.r2} --out2 {output.rev_prosyn_reads}" if EXTRACT_MATE else "", 
     conda:
-        "../envs/seqtk.yaml"
+        "../envs/python.yaml"
     shell:
         """
-        seqtk subseq {input.r1} {input.prosyn_read_name} > {output.fwd_prosyn_reads}
+        python {params.script} \
+            --names {input.prosyn_read_name} \
+            --r1 {input.r1} --out1 {output.fwd_prosyn_reads} {params.mate}
         """
-
-
-rule extracted_fastq_to_fasta: 
-    """
-    Convert Pro/Syn fastq to fasta. 
-    """
-    input: scratch_dict["prosyn_reads"]["extracted_reads"] / "{sample}_fwd.fastq", 
-    output: temp(scratch_dict["prosyn_reads"]["extracted_reads"] / "{sample}_fwd.fasta"), 
-    conda: "../envs/seqtk.yaml"
-    shell: "seqtk seq -A {input} > {output}"
-
@@ -4,8 +4,8 @@ rule kaiju_run:
     """
     input:
         # thermus-removed read files 
-        r1 = scratch_dict["thermus_removed_reads"] / "{sample}_1_trimmed_no_thermus.fastq", 
-        r2 = scratch_dict["thermus_removed_reads"] / "{sample}_2_trimmed_no_thermus.fastq", 
+        r1 = scratch_dict["thermus_removed_reads"] / "{sample}_1_trimmed_no_thermus.fastq.gz", 
+        r2 = scratch_dict["thermus_removed_reads"] / "{sample}_2_trimmed_no_thermus.fastq.gz", 
         # kaiju files 
         nodes = Path(config["input"]["nodes_file"]),
         fmi = Path(config["input"]["fmi_file"]), 
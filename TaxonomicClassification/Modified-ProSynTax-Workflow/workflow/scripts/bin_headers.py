@@ -1,104 +1,179 @@
 """
-Purpose: to extract read names of each clade into its own file. 
-    - i.e. [sname]_names.out --> [sname]_[genus]_[rank]_[clade]_reads.txt
+Purpose: single pass over a kaiju [sname]_names.out file that writes
+    - names of reads classified as Pro/Syn (as grep -E "Prochlorococcus|Synechococcus" | cut -f2)
+    - read name --> genus, clade table of those reads (pickled DataFrame with categorical
+      genus/clade, read by normalize_all_cycog.py instead of re-parsing the taxa)
+    - read names of each clade into its own file:
+        - i.e. [sname]_names.out --> [sname]_[genus]_[rank]_[clade]_reads.txt
         - rank: either subclade (for Pro) or subsubclade (for Syn)
         - e.g. test1_Prochlorococcus_subclade_AMZ-III_reads.txt
 
+The names.out file is streamed line by line (never loaded whole): lines that do not
+mention Pro/Syn are skipped before splitting, and each read name is written straight
+to its clade file through a buffered writer kept open until the end.
+
 09/16/24
 Authors: J.Mullet, N.N.Vo
 """
 import pandas as pd
 from pathlib import Path
+from contextlib import ExitStack
+
+# genus to bin reads of --> rank (field of kaiju taxa path) to bin them by
+GENUS_RANKS = {
+    'Prochlorococcus': 'subclade',
+    'Synechococcus': 'subsubclade',
+}
+# index of each rank in the ';' separated kaiju taxa path (kaiju-addTaxonNames -p)
+RANK_INDEX = {'genus': 8, 'clade': 9, 'subclade': 10, 'subsubclade': 11}
+
+READ_BUFFER = 1 << 24  # bytes buffered when reading names.out
+WRITE_BUFFER = 1 << 20  # bytes buffered by each clade file writer
+
+def classify_taxa(taxa):
+    """
+    Returns list of (genus, rank, rank_value) of a kaiju taxa path, one per genus in GENUS_RANKS
+    the read's genus matches (case-insensitive, as str.contains(case=False)); empty if none.
+        - Reads of phage & viral "genera" are removed (case-sensitive, as before).
+        - Missing or empty rank_value is "unclassified".
+    """
+    fields = taxa.split(';')
+    if len(fields) <= RANK_INDEX['genus']:
+        return []
+    genus = fields[RANK_INDEX['genus']].strip()
+    if 'phage' in genus or 'virus' in genus:
+        return []
 
-def process_genus_df(df, rank, sample_name, output_dir):
+    matches = []
+    for genus_name, rank in GENUS_RANKS.items():
+        if genus_name.lower() in genus.lower():
+            index = RANK_INDEX[rank]
+            rank_value = fields[index].strip() if len(fields) > index else ''
+            matches.append((genus, rank, rank_value or 'unclassified'))
+    return matches
+
+def classification_name(genus, rank, rank_value):
     """
-    For each classification of a specified rank (e.g. "Prochlorococcus subclade HLI" if rank=='subclade'): 
-        - Save names of reads (fastq sequence headers) of reads with that classification 
-        - e.g. save all reads in the current sample classified as "Prochlorococcus subclade HLI" into a file 
+    Classification used in file names: kaiju classification + string edit.
+        - "unclassified" reads are named the same way as classified reads: [genus]_[rank]_unclassified
     """
-    print(f'df.head() before binning:\n{df.head()}\n')
-    # remove phage & viral rows
-    df = df[~df['genus'].str.contains('phage')]
-    df = df[~df['genus'].str.contains('virus')]
-
-    # filter for cols needed 
-    df = df[[rank, 'genus', 'read']]
-
-    # fill NAs in cols with "unclassified" 
-    df = df.fillna(value={rank: 'unclassified'})
-    df[rank] = df[rank].replace('', 'unclassified')
-
-    # group by the specified rank (subclade or subsubclade)
-    rank_groups = df.groupby([rank])
-
-    # for each rank_classification (e.g. AMZ-I)
-    for index, rdf in rank_groups:
-        # genus of classification (Pro or Syn)
-        genus = rdf.iloc[0]['genus']        
-        
-        # obtain classification: kaiju classification + string edit
-        rank_value = rdf.iloc[0][rank]  # rank ("subclade" or "subsubclade") of subset-df
-        classification = rank_value.strip().replace(" ", "_").replace("/", "_")  
-        
-        # format "unclassified" rows to be the same as classified rows
-        if classification == 'unclassified':
-            classification = f'{genus}_{rank}_unclassified'  
-        
-        print(f"\ndf.head() of {classification}:")
-        print(rdf.head())
-
-        # output_path = Path(output_dir)
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        rdf[['read']].to_csv(f"{output_dir}/{sample_name}_{classification}_reads.txt", sep='\t', index=False, header=None)
-
-def process_kaiju_names(fpath, output_dir):
+    classification = rank_value.strip().replace(" ", "_").replace("/", "_")
+    if classification == 'unclassified':
+        classification = f'{genus}_{rank}_unclassified'
+    return classification
+
+class ReadBinWriters:
     """
-    Prepares input names.out file from kaiju for data parsing. 
-    Parses DataFrame from names.out file to save as csv files containing reads for each classification.
+    Buffered writers of [sample_name]_[classification]_reads.txt files, opened on the first
+    read of each (rank, rank_value) and kept open until close().
+        - The genus in names of "unclassified" files is that of the first read of the bin
+          (as taken from the first row of each group before).
     """
-    # Obtain name of sample from file path 
-    sample_name = fpath.name.replace('_names.out', '') 
+    def __init__(self, sample_name, output_dir):
+        self.sample_name = sample_name
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._files = ExitStack()
+        self._writers = {}  # (rank, rank_value) --> output path
+        self._paths = {}  # output path --> open file (rank values may share a classification)
+        self.counts = {}  # output path --> number of reads written
+
+    def write(self, read, genus, rank, rank_value):
+        key = (rank, rank_value)
+        if key not in self._writers:
+            classification = classification_name(genus, rank, rank_value)
+            path = self.output_dir / f"{self.sample_name}_{classification}_reads.txt"
+            if path not in self._paths:
+                self._paths[path] = self._files.enter_context(open(path, 'w', buffering=WRITE_BUFFER))
+                self.counts[path] = 0
+            self._writers[key] = path
+        path = self._writers[key]
+        self._paths[path].write(f'{read}\n')
+        self.counts[path] += 1
+
+    def close(self):
+        self._files.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def process_kaiju_names(fpath, output_dir, read_name_fpath=None, classification_fpath=None):
+    """
+    Parses names.out file from kaiju in a single streaming pass and saves:
+        - names of reads of each classification (e.g. "Prochlorococcus subclade HLI") into its own file
+        - read_name_fpath: names of reads whose line mentions Pro/Syn (case-sensitive, as grep)
+        - classification_fpath: DataFrame [read_name, genus, clade] of those reads, with
+          phage & viral reads removed; reads of a genus are only kept if the sample has reads of
+          exactly that genus (as normalize_all_cycog.import_read_classification)
+    cols of names.out: [classification_status, read_name, taxonid, full_taxa]
+    """
+    # Obtain name of sample from file path
+    sample_name = fpath.name.replace('_names.out', '')
     print(f"Processing sample: {sample_name}")
     print(f"Sample path: {fpath}")
-    
-    # Import and process names.out kaiju file 
-    df = pd.read_table(
-        fpath, 
-        names=['status', 'read', 'taxon_id', 'taxa'], 
-        dtype={'read': str, 'taxa': str}, 
-        encoding='utf-8'
-    )[['read', 'taxa']]
-
-    df['sample_name'] = sample_name
-    print(f"Imported df:\n{df.head()}")
-
-    # Obtain data for each rank of classification + remove whitespace 
-    df['taxa'] = df['taxa'].str.split(';')  # split column containing full classification 
-    df['genus'] = df['taxa'].str.get(8).str.strip()
-    df['clade'] = df['taxa'].str.get(9).str.strip()
-    df['subclade'] = df['taxa'].str.get(10).str.strip()
-    df['subsubclade'] = df['taxa'].str.get(11).str.strip()
-
-    # Subset to obtain dfs of reads classified as pro and syn
-    df['genus'] = df['genus'].astype(str)  # convert to str type for 2 lines below
-    pro_df = df[df['genus'].str.contains('Prochlorococcus', case=False, na=False)].copy()
-    syn_df = df[df['genus'].str.contains('Synechococcus', case=False, na=False)].copy()
-
-    # Process each genus df and save read files 
-    print("\nProcessing Prochlorococcus reads... ")
-    process_genus_df(pro_df, 'subclade', sample_name, output_dir)  
-    
-    print("\nProcessing Synechococcus reads... ")
-    process_genus_df(syn_df, 'subsubclade', sample_name, output_dir)
+
+    keys = [genus.lower() for genus in GENUS_RANKS]
+    reads, genera, ranks, clades = [], [], [], []  # classification table of listed reads
+    genus_names = set()  # genus values of listed reads
+
+    with ExitStack() as stack:
+        f = stack.enter_context(open(fpath, encoding='utf-8', buffering=READ_BUFFER))
+        writers = stack.enter_context(ReadBinWriters(sample_name, output_dir))
+        name_file = None
+        if read_name_fpath is not None:
+            name_file = stack.enter_context(open(read_name_fpath, 'w', buffering=WRITE_BUFFER))
+
+        for line in f:
+            # line would be listed by grep -E "Prochlorococcus|Synechococcus"
+            listed = any(genus in line for genus in GENUS_RANKS)
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 4:
+                continue
+            if not listed and not any(key in fields[3].lower() for key in keys):
+                continue
+
+            matches = classify_taxa(fields[3])
+            for genus, rank, rank_value in matches:
+                writers.write(fields[1], genus, rank, rank_value)
+
+            if listed:
+                if name_file is not None:
+                    name_file.write(f'{fields[1]}\n')
+                for genus, rank, rank_value in matches:
+                    reads.append(fields[1].strip())
+                    genera.append(genus)
+                    ranks.append(rank)
+                    clades.append(rank_value)
+                    genus_names.add(genus)
+
+    for path, count in writers.counts.items():
+        print(f"{path.name}: {count} reads")
+
+    if classification_fpath is not None:
+        df = pd.DataFrame({
+            'read_name': reads,
+            'genus': pd.Categorical(genera),
+            'clade': pd.Categorical(clades),
+        })
+        kept_ranks = [rank for genus_name, rank in GENUS_RANKS.items() if genus_name in genus_names]
+        df = df[pd.Series(ranks, dtype=str).isin(kept_ranks).to_numpy()].reset_index(drop=True)
+        print(f"{len(df)} classified Pro/Syn reads")
+        df.to_pickle(classification_fpath)
 
 def main():
-    # input path to kaiju name file 
+    # input path to kaiju name file
     fpath = Path(snakemake.input['kaiju_out'])
-    # output path to directory for .csv file 
+    # output path to directory for per-clade read name files
     output_dir = snakemake.output['binned_header_dir']
-    
+    # output paths to read name list and read name --> classification table (optional)
+    read_name_fpath = snakemake.output.get('read_name_file')
+    classification_fpath = snakemake.output.get('read_name_taxa_file')
+
     # process the input [sample_name]_names.out file from kaiju
-    process_kaiju_names(fpath, output_dir)
+    process_kaiju_names(fpath, output_dir, read_name_fpath, classification_fpath)
 
 if __name__ == "__main__":
     main()
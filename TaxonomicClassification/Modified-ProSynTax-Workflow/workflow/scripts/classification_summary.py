@@ -3,77 +3,78 @@ Purpose: to summarize read counts from kaiju_summary files.
 
 09/20/24 - J.Mullet, N.N.Vo
 """
+import numpy as np
 import pandas as pd 
 from pathlib import Path 
+from multiprocessing import Pool
+
+OTHER_GENUS = 'other_genus'  # row of summed read counts of taxons not in genus_list
 
 def process_kaiju_summary(fpath, genus_list):
     """
-    Returns a df from kaiju_summary file from fpath:
-        - cols: ['taxon_name', 'reads', 'percent']
+    Returns (sample_name, read counts) from kaiju_summary file from fpath:
+        - read counts: array of len(genus_list) + 1, reads of each genus in genus_list
+          (NaN if not in file), then reads of "other_genus"
     Steps: 
-        - Sum read counts from "cannot be assigned to a (non-viral) genus" and "unclassified"
-        - For rows whose 'taxon_name' values are not in given genus_list: 
-            - Sum read count ['reads']
-        - Obtain percentage 
+        - Sum read counts of rows with the same taxon_name (i.e. "unclassified")
+        - Sum read counts ['reads'] of rows whose 'taxon_name' values are not in given genus_list
 
     genus_list: list of row values (genus) to keep from kaiju_summary. 
         - The remaining will be summed into 1 single "other_genus" group. 
     """
-    df = pd.read_table(fpath)[['taxon_name', 'reads']]
-    df['taxon_name'] = df['taxon_name'].str.strip()  # remove whitespace, if any 
-
-    # convert "cannot be assigned to a (non-viral) genus" into "unclassified"
-    # df['taxon_name'] = df['taxon_name'].str.replace("cannot be assigned to a (non-viral) genus", "unclassified")
-
-    # sum rows that are duplicates (i.e. "unclassified")
-    df = df.groupby('taxon_name', as_index=False).sum()
+    # sample name (from file name)
+    sname = Path(fpath).stem.replace('_kaiju_summary', '')
 
-    # filter to obtain rows to sum (rows NOT IN genus_list)
-    other_df = df[~df['taxon_name'].isin(genus_list)]
+    df = pd.read_table(fpath, usecols=['taxon_name', 'reads'])
+    taxon_name = df['taxon_name'].str.strip()  # remove whitespace, if any 
+    reads = df['reads'].to_numpy(dtype=np.float64)
 
-    # sum values for "other_genus" row
-    other_read_sum = other_df['reads'].sum()
-
-    # create new row with sum values
-    other_row = pd.DataFrame({
-        "taxon_name": ["other_genus"], 
-        "reads": [other_read_sum], 
-    })
+    # convert "cannot be assigned to a (non-viral) genus" into "unclassified"
+    # taxon_name = taxon_name.str.replace("cannot be assigned to a (non-viral) genus", "unclassified")
 
-    # create final df
-    dfs = [
-        df[df['taxon_name'].isin(genus_list)],
-        other_row
-    ]
+    # position of each taxon in genus_list (-1: other genus)
+    genus_index = pd.Index(genus_list).get_indexer(taxon_name)
+    in_list = genus_index >= 0
 
-    df = pd.concat(dfs, ignore_index=True)
+    counts = np.full(len(genus_list) + 1, np.nan)
+    present = np.zeros(len(genus_list), dtype=bool)
+    present[genus_index[in_list]] = True
+    counts[:-1][present] = 0
+    np.add.at(counts, genus_index[in_list], reads[in_list])
+    counts[-1] = reads[~in_list].sum()
 
-    # create percentage col 
-    sum_read_count = df['reads'].sum()
-    df['percent'] = (df['reads'] / sum_read_count) * 100
+    return sname, counts
 
-    return df
-
-def reformat_df(df):
+def summarize(kaiju_summary_list, genus_list, processes=None):
     """
-    Returns a df with cols: [sample_name, summary_type, each value in genus_list]
-        - summary_type: 'percent' or 'reads'
+    Returns df with cols: [sample_name, summary_type, each value in genus_list + other_genus]
+        - summary_type: 'percent' or 'reads'; 'percent' rows first, samples sorted by name
+        - cols of genus_list values absent from all samples are left out (sorted taxon cols, as pivot)
+    Kaiju summaries are reduced in a worker pool into a samples x genus matrix of read counts.
     """
-    # convert cols ['reads', 'percent'] into row values in new col 'summary_type'
-    df = pd.melt(
-        df, 
-        id_vars = ['taxon_name', 'sample_name'], 
-        value_vars = ['reads', 'percent'], 
-        var_name = 'summary_type', 
-        value_name = 'value'
-    )
-
-    # long to wide
-    df = df.pivot(index=['sample_name', 'summary_type'], columns='taxon_name', values='value').reset_index()
-    df.columns.name = None  # remove index name 
-
-    # sort before saving (to group 'percent'/'reads' rows together)
-    df = df.sort_values(by=['summary_type'])
+    genus_list = list(dict.fromkeys(genus_list))  # unique, in order
+    taxa = genus_list + [OTHER_GENUS]
+
+    snames = []
+    reads = np.empty((len(kaiju_summary_list), len(taxa)))
+    with Pool(processes) as pool:
+        args = [(str(fpath), genus_list) for fpath in kaiju_summary_list]
+        for i, (sname, counts) in enumerate(pool.starmap(process_kaiju_summary, args, chunksize=16)):
+            snames.append(sname)
+            reads[i] = counts
+
+    # percentage of all reads of each sample
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percent = reads / np.nansum(reads, axis=1, keepdims=True) * 100
+
+    # keep taxa present in any sample; sort samples and taxa by name
+    sample_order = np.argsort(np.array(snames, dtype=object), kind='stable')
+    taxa_order = [i for i in np.argsort(np.array(taxa, dtype=object), kind='stable') if not np.isnan(reads[:, i]).all()]
+
+    values = np.concatenate([percent[sample_order][:, taxa_order], reads[sample_order][:, taxa_order]])
+    df = pd.DataFrame(values, columns=[taxa[i] for i in taxa_order])
+    df.insert(0, 'summary_type', np.repeat(['percent', 'reads'], len(snames)))
+    df.insert(0, 'sample_name', np.tile(np.array(snames, dtype=object)[sample_order], 2))
 
     return df
 
@@ -84,31 +85,16 @@ def main():
     # obtain input from snakemake  
     kaiju_summary_list = snakemake.input['kaiju_summary']  # list of fpath to [sample]_kaiju_summary.tsv files
     genus_list = snakemake.params['genus_list']  # list of genus to keep info 
+    processes = getattr(snakemake.resources, 'cpus_per_task', 1)  # number of worker processes
     
     # fpath for output file 
     final_summary_outpath = snakemake.output['summary_oufpath']
 
-    # list for storing summary df
-    dfs = []
-
-    for fpath in [Path(p) for p in kaiju_summary_list]:
-        # sample name (from file name)
-        sname = fpath.stem.replace('_kaiju_summary', '')
-
-        # import and process kaiju summary df 
-        df = process_kaiju_summary(fpath, genus_list)
-        
-        df['sample_name'] = sname
-
-        dfs.append(df)
-
-    df = pd.concat(dfs)
-
-    # reformat df so that taxons in genus_list are column headers
-    # (long to wide)
-    df = reformat_df(df)
+    # obtain counts and percentage of taxons in genus_list of all samples (taxons as column headers)
+    df = summarize(kaiju_summary_list, genus_list, processes)
 
     # save file
     df.to_csv(final_summary_outpath, sep='\t', index=False)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Purpose: to extract reads classified as Pro/Syn from (Thermus-removed) fastq files as fasta.
+    - Input: read name file (1 name per line), [sample]_1 (and optionally _2) fastq(.gz) files
+    - Output: fasta of the listed reads (and of their mates), in fastq order
+        - replaces seqtk subseq + seqtk seq -A (fastq streamed once, fasta written directly)
+
+Read name --> offset index (opt-in, for fastq files that are kept between runs):
+    - With --index-dir, the offset of every record of each fastq is saved to
+      [index_dir]/[fastq file name].readidx.npz while streaming it, keyed by the fastq's size and mtime.
+    - Later runs against the same fastq (e.g. with another read name list) read only the listed
+      records (seek to their offsets) instead of parsing the whole file.
+    - Without --index-dir, no index is read or written (and read names are not hashed).
+    - Names are stored as 64-bit hashes; each record read through the index is checked against
+      the read name list, so hash collisions cannot add reads.
+
+Names are matched on the read ID (up to first whitespace, without /1 or /2 mate suffix, ignoring case).
+
+Usage:
+    python extract_reads.py --names [sample].txt --r1 [r1] --out1 [sample]_fwd.fasta \
+        [--r2 [r2] --out2 [sample]_rev.fasta] [--index-dir [dir]]
+"""
+import os
+import sys
+import hashlib
+import argparse
+from array import array
+from pathlib import Path
+import numpy as np
+
+from remove_thermus_reads import read_id, open_fastq, iter_fastq
+
+INDEX_SUFFIX = '.readidx.npz'
+BUFFER = 1 << 20  # bytes buffered by fasta writers
+
+def name_hash(name):
+    """
+    64-bit hash of read ID (stable across processes, unlike hash()).
+    """
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), 'little')
+
+def read_names(fpath):
+    """
+    Set of read IDs of read name file.
+    """
+    with open(fpath, 'rb') as f:
+        return {read_id(line) for line in f if line.strip()}
+
+def fasta_record(record):
+    """
+    Fasta lines of a fastq record (header with comment kept, as seqtk seq -A).
+    """
+    return b'>' + record[0][1:], record[1]
+
+def index_path(fastq, index_dir):
+    return Path(index_dir) / f'{Path(fastq).name}{INDEX_SUFFIX}'
+
+def read_index(fastq, index_dir):
+    """
+    Returns (hashes, offsets) of index of fastq, or None if missing or older than the fastq.
+    """
+    try:
+        with np.load(index_path(fastq, index_dir)) as index:
+            stat = os.stat(fastq)
+            if int(index['source_size']) != stat.st_size or int(index['source_mtime_ns']) != stat.st_mtime_ns:
+                return None
+            return index['hash'], index['offset']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_index(fastq, index_dir, hashes, offsets):
+    """
+    Saves index of fastq (sorted by hash) under a temporary name and renames it.
+    """
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    hashes = np.frombuffer(hashes, dtype=np.uint64) if len(hashes) else np.zeros(0, dtype=np.uint64)
+    offsets = np.frombuffer(offsets, dtype=np.uint64) if len(offsets) else np.zeros(0, dtype=np.uint64)
+    order = np.argsort(hashes, kind='stable')
+    stat = os.stat(fastq)
+
+    path = index_path(fastq, index_dir)
+    tmp_path = path.with_name(path.name + f'.{os.getpid()}.tmp.npz')
+    np.savez(tmp_path, hash=hashes[order], offset=offsets[order],
+             source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+    os.replace(tmp_path, path)
+
+def indexed_records(fastq, index, names):
+    """
+    Yields fastq records of names, in file order, by seeking to their offsets in the index.
+    """
+    hashes, offsets = index
+    wanted = np.fromiter((name_hash(name) for name in names), dtype=np.uint64, count=len(names))
+    with open_fastq(fastq) as f:
+        # forward seeks only (gzip files are decompressed, not parsed, up to each record)
+        for offset in np.unique(offsets[np.isin(hashes, wanted)]):
+            f.seek(int(offset))
+            record = f.readline(), f.readline(), f.readline(), f.readline()
+            if read_id(record[0][1:]) in names:
+                yield record
+
+def stream_records(fastq, names, index_dir=None):
+    """
+    Yields fastq records of names, parsing the whole fastq; the index is saved if index_dir is given.
+    """
+    hashes = array('Q')
+    offsets = array('Q')
+    offset = 0
+    with open_fastq(fastq) as f:
+        for record in iter_fastq(f):
+            name = read_id(record[0][1:])
+            if index_dir is not None:
+                hashes.append(name_hash(name))
+                offsets.append(offset)
+                offset += sum(len(line) for line in record)
+            if name in names:
+                yield record
+    if index_dir is not None:
+        write_index(fastq, index_dir, hashes, offsets)
+
+def extract_reads(fastq, out_fasta, names, index_dir=None):
+    """
+    Writes the records of names in fastq to out_fasta; returns number of reads written.
+    """
+    index = read_index(fastq, index_dir) if index_dir is not None else None
+    records = indexed_records(fastq, index, names) if index is not None else stream_records(fastq, names, index_dir)
+    print(f'{fastq}: {"index" if index is not None else "streaming"}', file=sys.stderr)
+
+    count = 0
+    with open(out_fasta, 'wb', buffering=BUFFER) as out:
+        for record in records:
+            out.writelines(fasta_record(record))
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--names', required=True, help='file of read names to extract (1 per line)')
+    parser.add_argument('--r1', required=True, help='forward reads (fastq or fastq.gz)')
+    parser.add_argument('--out1', required=True, help='output fasta of forward reads')
+    parser.add_argument('--r2', default=None, help='reverse reads (fastq or fastq.gz), to also extract mates')
+    parser.add_argument('--out2', default=None, help='output fasta of reverse reads (mates)')
+    parser.add_argument('--index-dir', default=None, help='directory of read name --> offset indexes (opt-in; only useful for fastq files kept between runs)')
+    args = parser.parse_args()
+
+    if (args.r2 is None) != (args.out2 is None):
+        parser.error('--r2 and --out2 must be given together')
+
+    names = read_names(args.names)
+    print(f'{len(names)} read names to extract', file=sys.stderr)
+
+    count = extract_reads(args.r1, args.out1, names, args.index_dir)
+    print(f'{count} reads written to {args.out1}', file=sys.stderr)
+    if args.r2 is not None:
+        count = extract_reads(args.r2, args.out2, names, args.index_dir)
+        print(f'{count} mates written to {args.out2}', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
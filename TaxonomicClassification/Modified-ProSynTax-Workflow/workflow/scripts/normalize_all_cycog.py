@@ -9,7 +9,7 @@ Purpose: Normalization of classified read count using 424 CyCOG.
             
 Steps:
     - Obtain unique hit per read
-        - Sort by alignment length and keep highest alignment length per read
+        - Keep hit with highest pident per read (groupby-idxmax, no full sort)
     - Filter for hits to 424 cycog list 
     - Sum up alignment length 
     - Divide alignment length by 359404.6391
@@ -18,19 +18,34 @@ Steps:
 James Mullet & Nhi N. Vo 
 10/16/24 
 """
+import numpy as np
 import pandas as pd 
 from pathlib import Path 
 
+# diamond blast output cols (string from blast_reads rule)
+DIAMOND_COLS = "qseqid sseqid pident nident length qstart qend sstart send evalue bitscore".split(" ")
+
+# index of each rank in the ';' separated kaiju taxa path
+RANK_INDEX = {'genus': 8, 'clade': 9, 'subclade': 10, 'subsubclade': 11}
+
+# genus of classified reads --> rank used as clade 
+GENUS_RANKS = {'Prochlorococcus': 'subclade', 'Synechococcus': 'subsubclade'}
+
+TOTAL_CYCOG_LEN = 359404.6391  # sum of 424 CyCOG mean length
+
 def import_diamond_output(diamond_fpath):
     """
-    Returns df of alignment length of all reads. 
+    Returns df of best hit (highest pident) of each read, cols: [read_name, cycog_iid, alignment_length]
+        - Only needed cols are read; read and subject names are categorical. 
+        - cycog id is parsed once per distinct sseqid (categories), not per hit. 
+        - Best hit per read by groupby-idxmax (first hit among ties) instead of sorting all hits. 
     """
-    # obtain headers for df (string from blast_reads rule)
-    cols = [elem for elem in "qseqid sseqid pident nident length qstart qend sstart send evalue bitscore".split(" ")]
     df = pd.read_table(
         diamond_fpath, 
         header = None, 
-        names = cols, 
+        names = DIAMOND_COLS, 
+        usecols = ['qseqid', 'sseqid', 'pident', 'length'], 
+        dtype = {'qseqid': 'category', 'sseqid': 'category', 'pident': np.float32, 'length': np.int64}, 
     )
 
     # rename cols
@@ -41,117 +56,91 @@ def import_diamond_output(diamond_fpath):
     })
 
     # obtain cycog id from diamond blast sseqid (cycog_name)
-    df['cycog_iid'] = df['cycog_name'].str.split('|').str[1]
+    categories = df['cycog_name'].cat.categories
+    df['cycog_iid'] = df['cycog_name'].map(dict(zip(categories, categories.str.split('|').str[1])))
 
-    # sort and remove duplicate to obtain best match 
-    df = df.sort_values(by=['pident'], ascending=[False])
-    df = df.drop_duplicates(subset='read_name', keep='first')  # keep hit with highest pident
+    # keep hit with highest pident of each read
+    best = df.groupby('read_name', observed=True, sort=False)['pident'].idxmax()
+    df = df.loc[best.to_numpy()]
 
     # filter for cols 
-    df = df[['read_name', 'cycog_iid', 'alignment_length']]
+    df = df[['read_name', 'cycog_iid', 'alignment_length']].reset_index(drop=True)
+    df['read_name'] = df['read_name'].astype(str)
 
     return df 
 
-def process_genus_df(df, rank):
-    """
-    Returns df with cols [rank, genus, read_name]: 
-        - rank: subclade or subsubclade values
-        - genus: genus of classified read (pro or syn)
-        - read_name: name of read classified as pro/syn 
-    """
-    # remove phage & viral rows
-    df = df[~df['genus'].str.contains('phage')]
-    df = df[~df['genus'].str.contains('virus')]
-
-    # filter for cols needed 
-    df = df[[rank, 'genus', 'read_name']]
-
-    # fill NAs in cols with "unclassified" 
-    df = df.fillna(value={rank: 'unclassified'})
-    df[rank] = df[rank].replace('', 'unclassified')
-
-    # rename col 
-    df = df.rename(columns={rank: 'clade'})
-
-    return df
-
 def import_read_classification(fpath):
     """
+    Returns df with cols [read_name, genus, clade] of reads classified as Pro/Syn: 
+        - clade: subclade (Pro) or subsubclade (Syn) values, "unclassified" if missing
+        - phage & viral rows removed
+    The taxa path is split once into fixed columns; genus and clade are categorical. 
+        - .pkl: table already written by bin_headers.py (kaiju_name_extract rule), loaded as is
+        - otherwise: tab-delimited [read_name, full_taxa] file (cut -f2,4 of names.out)
     """
-    df = pd.read_table(fpath, names=['read_name', 'classification'])
+    if Path(fpath).suffix == '.pkl':
+        df = pd.read_pickle(fpath)
+        if len(df) == 0:
+            print('No reads classified as Pro or Syn in sample.')
+        return df
+
+    df = pd.read_table(fpath, names=['read_name', 'classification'], dtype=str)
 
     if len(df) == 0:
         print('No reads classified as Pro or Syn in sample.')
         # return empty df 
-        df = pd.DataFrame({
-            'read_name': [], 'genus': [], 'classification': []
-        })
+        return pd.DataFrame(columns=['read_name', 'genus', 'clade'], dtype=str)
 
-        return df
+    # Obtain data for each rank of classification (split once) + remove whitespace
+    taxa = df['classification'].str.split(';', n=max(RANK_INDEX.values()) + 1, expand=True)
+    ranks = pd.DataFrame({'read_name': df['read_name'].str.strip()})
+    for rank, index in RANK_INDEX.items():
+        ranks[rank] = taxa[index].str.strip() if index in taxa.columns else None
+    del df, taxa
 
-    # Obtain data for each rank of classification
-    df['classification'] = df['classification'].str.split(';')  # split column containing full classification 
-    df['genus'] = df['classification'].str.get(8) 
-    df['clade'] = df['classification'].str.get(9)
-    df['subclade'] = df['classification'].str.get(10)
-    df['subsubclade'] = df['classification'].str.get(11)
+    genus = ranks['genus'].astype(str)  # convert to str type (missing genus matches nothing)
+    not_viral = ~(genus.str.contains('phage', regex=False) | genus.str.contains('virus', regex=False))
+    genus_values = set(genus.unique())
 
-    # Remove leading and trailing whitespace 
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-    df['genus'] = df['genus'].astype(str)  # convert to str type for lines below
-
-    # subset to obtain dfs of reads classified as pro and syn
+    # subset reads classified as pro and syn; clade is the genus' rank
     dfs = []
-    if 'Prochlorococcus' in df['genus'].unique():
-        print(f"\nProcessing Prochlorococcus reads in sample... ")
-        pro_df = df[df['genus'].str.contains('Prochlorococcus', case=False, na=False)].copy()
-        pro_df = process_genus_df(pro_df, 'subclade') 
-        dfs.append(pro_df)
-    else: 
-        print(f'Sample does not have any Prochlorococcus reads.')
-
-    if 'Synechococcus' in df['genus'].unique():
-        print(f"\nProcessing Synechococcus reads in sample... ")
-        syn_df = df[df['genus'].str.contains('Synechococcus', case=False, na=False)].copy()
-        syn_df = process_genus_df(syn_df, 'subsubclade')
-        dfs.append(syn_df)
-    else: 
-        print(f'Sample does not have any Synechococcus reads')
-
-    df = pd.concat(dfs)
+    for genus_name, rank in GENUS_RANKS.items():
+        if genus_name not in genus_values:
+            print(f'Sample does not have any {genus_name} reads.')
+            continue
+        print(f"\nProcessing {genus_name} reads in sample... ")
+        mask = genus.str.contains(genus_name, case=False, regex=False) & not_viral
+        clade = ranks.loc[mask, rank].fillna('unclassified').replace('', 'unclassified')
+        dfs.append(pd.DataFrame({
+            'clade': clade, 
+            'genus': genus[mask], 
+            'read_name': ranks.loc[mask, 'read_name'], 
+        }))
+
+    if not dfs:
+        return pd.DataFrame(columns=['read_name', 'genus', 'clade'], dtype=str)
+
+    df = pd.concat(dfs, ignore_index=True)
+    df['genus'] = df['genus'].astype('category')
+    df['clade'] = df['clade'].astype('category')
 
     return df
 
 def cycog_normalize(df, cycog_list):
     """
+    Returns df with cols [genus, clade, alignment_length, genome_equivalents]: 
+    sum of alignment length of hits to cycogs in list, per (genus, clade), in a single groupby. 
     """
     # filter df for cycogs in list
     df = df[df['cycog_iid'].isin(cycog_list)]
 
     # group by classification and normalize each group
-    classification_groups = df.groupby(['genus', 'clade'])
-
-    normalized_data = {
-        'genus': [], 
-        'clade': [], 
-        'alignment_length': [], 
-        'genome_equivalents': [], 
-    }
-
-    for (genus, classification), cdf in classification_groups:
-        # sum alignment length 
-        sum_alnm_len = cdf['alignment_length'].sum()
-
-        # obtain_genome_equivalence
-        total_cycog_len = 359404.6391
-        genome_equivalents = sum_alnm_len / total_cycog_len
-
-        normalized_data['genus'].append(genus)
-        normalized_data['clade'].append(classification)
-        normalized_data['alignment_length'].append(sum_alnm_len)
-        normalized_data['genome_equivalents'].append(genome_equivalents)
+    df = df.groupby(['genus', 'clade'], observed=True, sort=True, as_index=False)['alignment_length'].sum()
+    df['genus'] = df['genus'].astype(str)
+    df['clade'] = df['clade'].astype(str)
 
-    df = pd.DataFrame(normalized_data)
+    # obtain_genome_equivalence
+    df['genome_equivalents'] = df['alignment_length'] / TOTAL_CYCOG_LEN
 
     return df
 
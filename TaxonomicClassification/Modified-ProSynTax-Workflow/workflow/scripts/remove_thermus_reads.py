@@ -0,0 +1,109 @@
+"""
+Purpose: to remove read pairs mapped to the Thermus genome from paired fastq files.
+    - Input: SAM output of bowtie2 on stdin, paired [sample]_1/_2 trimmed fastq.gz files
+    - Output: paired fastq.gz files without the reads mapped to Thermus
+
+Steps:
+    - Stream SAM from stdin and collect names of mapped reads (flag 4 not set) in a set
+        - replaces writing SAM/BAM and samtools view | cut | sort | uniq
+    - Read R1 and R2 together, record by record, and write pairs whose read name is not in the set
+        - replaces one seqkit grep -v -i per read file; names are matched ignoring case,
+          on the read ID (up to first whitespace, without /1 or /2 mate suffix)
+
+Usage:
+    bowtie2 -x [index] -1 [r1] -2 [r2] --no-unal | \
+        python remove_thermus_reads.py --r1 [r1] --r2 [r2] --o1 [o1] --o2 [o2]
+"""
+import io
+import sys
+import gzip
+import argparse
+
+GZIP_LEVEL = 1  # compression level of output fastq.gz (fast; files are temporary)
+BUFFER = 1 << 20  # bytes buffered by readers and writers
+
+def read_id(header):
+    """
+    Lower-cased read ID of a fastq header or SAM read name (bytes), without /1 or /2 mate suffix.
+    """
+    name = header.split(maxsplit=1)[0].lower()
+    if name[-2:] in (b'/1', b'/2'):
+        name = name[:-2]
+    return name
+
+def mapped_read_names(sam):
+    """
+    Returns set of IDs of reads with at least one mapped alignment in SAM (binary stream).
+    """
+    names = set()
+    for line in sam:
+        if line.startswith(b'@'):
+            continue
+        qname, flag, _ = line.split(b'\t', 2)
+        if not int(flag) & 4:
+            names.add(read_id(qname))
+    return names
+
+def open_fastq(fpath, mode='rb'):
+    """
+    Buffered binary handle of (gzip or plain) fastq file; output files ending in .gz are compressed.
+    """
+    if str(fpath).endswith('.gz'):
+        if 'w' in mode:
+            return io.BufferedWriter(gzip.open(fpath, mode, compresslevel=GZIP_LEVEL), BUFFER)
+        return io.BufferedReader(gzip.open(fpath, mode), BUFFER)
+    return open(fpath, mode, buffering=BUFFER)
+
+def iter_fastq(f):
+    """
+    Yields 4-line fastq records (bytes, including newlines).
+    """
+    while True:
+        header = f.readline()
+        if not header:
+            return
+        yield header, f.readline(), f.readline(), f.readline()
+
+def filter_pairs(r1, r2, o1, o2, names):
+    """
+    Writes read pairs of r1/r2 whose read is not in names to o1/o2; returns (pairs kept, pairs removed).
+    """
+    kept = removed = 0
+    with open_fastq(r1) as f1, open_fastq(r2) as f2, \
+            open_fastq(o1, 'wb') as out1, open_fastq(o2, 'wb') as out2:
+        records2 = iter_fastq(f2)
+        for record1 in iter_fastq(f1):
+            record2 = next(records2, None)
+            if record2 is None:
+                raise ValueError(f'{r2} has fewer reads than {r1}')
+            if read_id(record1[0][1:]) in names or read_id(record2[0][1:]) in names:
+                removed += 1
+                continue
+            out1.writelines(record1)
+            out2.writelines(record2)
+            kept += 1
+        if next(records2, None) is not None:
+            raise ValueError(f'{r2} has more reads than {r1}')
+    return kept, removed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--r1', required=True, help='forward reads (fastq or fastq.gz)')
+    parser.add_argument('--r2', required=True, help='reverse reads (fastq or fastq.gz)')
+    parser.add_argument('--o1', required=True, help='output forward reads (gzipped if ending in .gz)')
+    parser.add_argument('--o2', required=True, help='output reverse reads (gzipped if ending in .gz)')
+    parser.add_argument('--sam', default='-', help='SAM file of reads mapped to Thermus (default: stdin)')
+    args = parser.parse_args()
+
+    if args.sam == '-':
+        names = mapped_read_names(sys.stdin.buffer)
+    else:
+        with open(args.sam, 'rb') as sam:
+            names = mapped_read_names(sam)
+    print(f'{len(names)} reads mapped to Thermus', file=sys.stderr)
+
+    kept, removed = filter_pairs(args.r1, args.r2, args.o1, args.o2, names)
+    print(f'{kept} read pairs kept, {removed} read pairs removed', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of scaffold name -> offset lookup cost vs number of contigs.
+
+Compares the per-line lookup previously used by the pileup/vcf parsers,
+chr_starts[np.where(chromo==scaf_names)], with gus_helper_functions.ContigIndex.
+
+Usage:
+    python scripts/benchmark_contig_index.py -k 1,10,100,1000,10000 -n 100000
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gus_helper_functions as ghf
+
+#%%
+def time_lookups(lookup, names, position_on_chr):
+    '''Seconds per lookup of lookup(name)+position_on_chr over names'''
+    t0=time.perf_counter()
+    for chromo in names:
+        position=lookup(chromo)+int(position_on_chr)
+    return (time.perf_counter()-t0)/len(names)
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-k', dest='contigs', type=str, help='Comma-separated contig counts', default='1,10,100,1000,10000')
+    parser.add_argument('-n', dest='lookups', type=int, help='Number of lookups (lines) per contig count', default=100000)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    rng=np.random.default_rng(args.seed)
+    print("contigs\tnp.where (us/line)\tContigIndex (us/line)")
+    for num_contigs in [int(k) for k in args.contigs.split(',')]:
+        scaf_names=np.asarray([f"NODE_{i+1}_length_{1000+i}" for i in range(num_contigs)],dtype=object)
+        chr_starts=np.cumsum(np.r_[0,1000+np.arange(num_contigs-1)]).astype(int)
+        contig_index=ghf.ContigIndex(scaf_names,chr_starts)
+        names=list(scaf_names[rng.integers(0,num_contigs,size=args.lookups)])
+
+        scan_sec=time_lookups(lambda chromo: int(chr_starts[np.where(chromo==scaf_names)][0]),names,'500')
+        index_sec=time_lookups(lambda chromo: contig_index[chromo],names,'500')
+        print(f"{num_contigs}\t{scan_sec*1e6:.2f}\t{index_sec*1e6:.3f}")
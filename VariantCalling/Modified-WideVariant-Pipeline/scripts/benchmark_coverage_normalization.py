@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark and check of the out-of-core coverage normalization of build_candidate_mutation_table.
+
+Builds a random GenomeLength x numSamples coverage matrix (with uncovered
+positions and an uncovered sample, whose normalization divides by 0), checks
+that double_normalize_chunked gives exactly the same matrix as the in-memory
+double_normalize for several chunk sizes, then times both.
+
+Usage:
+    python scripts/benchmark_coverage_normalization.py -l 1000000 -s 50 -r 1,1000,100000
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import build_candidate_mutation_table as bcmt
+
+#%%
+def random_coverage(genome_length, num_samples, rng):
+    '''Random coverage matrix with uncovered positions and one uncovered sample'''
+    coverage=rng.poisson(rng.uniform(1,100,size=num_samples),size=(genome_length,num_samples)).astype('uint')
+    coverage[rng.random(genome_length)<0.05]=0
+    coverage[:,-1]=0
+    return coverage
+
+def check_chunked(coverage, expected, chunk_rows, tmpdir):
+    '''Raises AssertionError if the chunked normalization of memory-mapped coverage differs from expected'''
+    cov_path=os.path.join(tmpdir,'all_coverage_per_bp.npy')
+    np.save(cov_path,coverage)
+    all_coverage_per_bp=np.load(cov_path,mmap_mode='r')
+    array_cov_norm_scaled=np.lib.format.open_memmap(os.path.join(tmpdir,'array_cov_norm_scaled.npy'),mode='w+',
+                                                    dtype='int64',shape=coverage.shape)
+    bcmt.double_normalize_chunked(all_coverage_per_bp,array_cov_norm_scaled,chunk_rows)
+    assert np.array_equal(array_cov_norm_scaled,expected), f'chunked normalization differs ({chunk_rows} rows per chunk)'
+
+def check_column_sum(rng):
+    '''Raises AssertionError if column_sum over chunks differs from np.sum(axis=0) of the whole matrix'''
+    matrix=rng.normal(size=(1001,7))
+    for chunk_rows in (1,10,1000,2000):
+        col_sum=None
+        for start in range(0,len(matrix),chunk_rows):
+            col_sum=bcmt.column_sum(matrix[start:start+chunk_rows].copy(),col_sum)
+        assert np.array_equal(col_sum,np.sum(matrix,axis=0)), f'column_sum differs ({chunk_rows} rows per chunk)'
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-l', dest='genome_length', type=int, help='Number of positions (rows)', default=1000000)
+    parser.add_argument('-s', dest='samples', type=int, help='Number of samples (columns)', default=50)
+    parser.add_argument('-r', dest='chunk_rows', type=str, help='Comma-separated positions per chunk', default='1,1000,100000')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    rng=np.random.default_rng(args.seed)
+    check_column_sum(rng)
+
+    small=random_coverage(2003,args.samples,rng)
+    small_expected=bcmt.double_normalize(small)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for chunk_rows in (1,7,1000,2003,5000):
+            check_chunked(small,small_expected,chunk_rows,tmpdir)
+
+    coverage=random_coverage(args.genome_length,args.samples,rng)
+    t0=time.perf_counter()
+    expected=bcmt.double_normalize(coverage)
+    print(f"in memory\t{(time.perf_counter()-t0)*1e3:.1f} ms")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for chunk_rows in [int(r) for r in args.chunk_rows.split(',')]:
+            if chunk_rows < args.genome_length//10000:
+                print(f"{chunk_rows} rows per chunk\tskipped (too many chunks)")
+                continue
+            t0=time.perf_counter()
+            check_chunked(coverage,expected,chunk_rows,tmpdir)
+            print(f"{chunk_rows} rows per chunk\t{(time.perf_counter()-t0)*1e3:.1f} ms (incl. writing input, check)")
+    print("OK")
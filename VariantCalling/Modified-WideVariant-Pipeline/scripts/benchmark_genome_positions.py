@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark and check of genome position <-> contig position conversions.
+
+Compares the previous p2chrpos of gus_helper_functions (one pass over all
+positions per contig) with genome_positions.p2chrpos, checks that both give
+the same result, and checks that chrpos2index, names2p and the interval
+conversions invert them.
+
+Usage:
+    python scripts/benchmark_genome_positions.py -k 1,10,100,1000 -n 10000000
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gus_helper_functions as ghf
+import genome_positions
+
+#%%
+def p2chrpos_loop(p, ChrStarts):
+    '''Previous gus_helper_functions.p2chrpos, O(positions x contigs)'''
+    chromo = np.ones(len(p),dtype=int)
+    if len(ChrStarts) > 1:
+        for i in ChrStarts[1:]:
+            chromo = chromo + (p > i)
+        positions = p - ChrStarts[chromo-1]
+        chrpos = np.column_stack((chromo,positions))
+    else:
+        chrpos = np.column_stack((chromo,p))
+    return chrpos
+
+def check_conversions(p, chr_starts, genome_length, scaf_names, rng):
+    '''Raises AssertionError if conversions disagree with the previous implementation or do not round trip'''
+    chrpos=genome_positions.p2chrpos(p,chr_starts)
+    assert np.array_equal(chrpos,p2chrpos_loop(p,chr_starts))
+    assert np.array_equal(genome_positions.chrpos2index(chrpos,chr_starts),p)
+
+    names,positions=genome_positions.p2names(p,chr_starts,scaf_names)
+    contig_index=ghf.ContigIndex(scaf_names,chr_starts)
+    assert np.array_equal(genome_positions.names2p(names.astype(str),positions,contig_index),p)
+
+    starts=rng.integers(0,genome_length,size=1000)
+    ends=np.minimum(starts+rng.integers(0,5000,size=1000),genome_length)
+    interval,contig,contig_starts,contig_ends=genome_positions.intervals2chrintervals(starts,ends,chr_starts,genome_length)
+    genome_starts,genome_ends=genome_positions.chrintervals2intervals(contig,contig_starts,contig_ends,chr_starts)
+    assert np.all(contig_ends>contig_starts)
+    covered=np.zeros(len(starts),dtype=np.int64)
+    np.add.at(covered,interval,genome_ends-genome_starts)
+    assert np.array_equal(covered,ends-starts)
+    assert np.array_equal(genome_positions.p2contig(genome_starts+1,chr_starts),contig)
+
+def time_call(function, *args):
+    '''Seconds for one call of function(*args)'''
+    t0=time.perf_counter()
+    function(*args)
+    return time.perf_counter()-t0
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-k', dest='contigs', type=str, help='Comma-separated contig counts', default='1,10,100,1000')
+    parser.add_argument('-n', dest='positions', type=int, help='Number of positions converted per contig count', default=10000000)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    rng=np.random.default_rng(args.seed)
+    print("contigs\tloop p2chrpos (ms)\tsearchsorted p2chrpos (ms)\tchrpos2index (ms)")
+    for num_contigs in [int(k) for k in args.contigs.split(',')]:
+        lengths=rng.integers(1000,100000,size=num_contigs)
+        chr_starts=(np.cumsum(lengths)-lengths).astype(int)
+        genome_length=int(lengths.sum())
+        scaf_names=np.asarray([f"NODE_{i+1}_length_{lengths[i]}" for i in range(num_contigs)],dtype=object)
+        p=np.sort(rng.integers(1,genome_length+1,size=args.positions))
+
+        check_conversions(p[::max(len(p)//100000,1)],chr_starts,genome_length,scaf_names,rng)
+
+        chrpos=genome_positions.p2chrpos(p,chr_starts)
+        loop_sec=time_call(p2chrpos_loop,p,chr_starts)
+        search_sec=time_call(genome_positions.p2chrpos,p,chr_starts)
+        index_sec=time_call(genome_positions.chrpos2index,chrpos,chr_starts)
+        print(f"{num_contigs}\t{loop_sec*1e3:.1f}\t{search_sec*1e3:.1f}\t{index_sec*1e3:.1f}")
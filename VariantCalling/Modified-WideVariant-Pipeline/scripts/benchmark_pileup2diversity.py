@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark for the pileup2diversity engines on a synthetic pileup.
+
+Writes a random reference genome and an mpileup-formatted file (same columns
+as samtools mpileup -s -O) with read starts/ends, reference matches,
+insertions, deletions and depth 0 lines, then times the line engine against
+the block engine and checks that both produce identical diversity arrays,
+also when the pileup is piped to pileup2diversity.py on stdin or parsed by
+several processes (2, or each process count of -t, to measure how the block
+engine scales with the number of processes).
+Also compares size and load time of the compact (.npz) diversity format
+with the float64 pickle.
+
+Usage:
+    python scripts/benchmark_pileup2diversity.py -n 200000 -d 50
+    python scripts/benchmark_pileup2diversity.py -n 2000000 -t 1,2,4,8,16 --skip-line-engine
+"""
+import os
+import sys
+import gzip
+import time
+import pickle
+import tempfile
+import argparse
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pileup2diversity as p2d
+import gus_helper_functions as ghf
+
+#%%
+def write_synthetic_genome(ref_dir, contig_lengths, rng):
+    '''Writes ref_dir/genome.fasta with random contigs, returns list of (name, seq)'''
+    contigs=[]
+    with open(f"{ref_dir}/genome.fasta",'w') as f:
+        for i,length in enumerate(contig_lengths):
+            seq=''.join(rng.choice(list('ATCG'),size=length))
+            if i == 0:
+                seq='N'+seq[1:] # one ambiguous reference base
+            name=f"contig_{i+1}"
+            f.write(f">{name}\n")
+            for j in range(0,length,80):
+                f.write(seq[j:j+80]+'\n')
+            contigs.append((name,seq))
+    return contigs
+
+def synthetic_pileup_line(name, pos, ref, depth, rng):
+    '''One mpileup line with depth reads'''
+    if depth == 0: # all bases failed -Q: '*' in calls and qual fields
+        return f"{name}\t{pos}\t{ref}\t0\t*\t*\t*\t*\n"
+    calls=[]; bq=[]; mq=[]; td=[]
+    for _ in range(depth):
+        call=''
+        if rng.random() < 0.02: # start of read + mapping quality
+            call+='^'+chr(33+int(rng.integers(30,43)))
+        if ref == 'N' or rng.random() < 0.1:
+            call+=rng.choice(list('ATCGatcg*'))
+        else:
+            call+=rng.choice(['.',','])
+        indel=rng.random()
+        if indel < 0.01: # insertion
+            size=int(rng.integers(1,15))
+            call+='+'+str(size)+''.join(rng.choice(list('ACGTN'),size=size))
+        elif indel < 0.02: # deletion
+            size=int(rng.integers(1,15))
+            call+='-'+str(size)+''.join(rng.choice(list('acgtn'),size=size))
+        if rng.random() < 0.02: # end of read
+            call+='$'
+        calls.append(call)
+        bq.append(chr(33+int(rng.integers(2,42))))
+        mq.append(chr(33+int(rng.integers(30,43))))
+        td.append(str(int(rng.integers(1,151))))
+    return f"{name}\t{pos}\t{ref}\t{depth}\t{''.join(calls)}\t{''.join(bq)}\t{''.join(mq)}\t{','.join(td)}\n"
+
+def write_synthetic_pileup(path, contigs, num_positions, depth, rng):
+    '''Writes num_positions pileup lines spread over the contigs (first and last positions always included)
+
+    About 2% of lines have depth 0, as samtools mpileup writes when all bases of a position fail -Q.
+    '''
+    genome_length=sum(len(seq) for _,seq in contigs)
+    num_positions=min(num_positions,genome_length)
+    lines_written=0
+    with open(path,'w') as f:
+        for name,seq in contigs:
+            n=max(2,round(num_positions*len(seq)/genome_length))
+            positions=np.unique(np.concatenate(([1,len(seq)],rng.choice(np.arange(1,len(seq)+1),size=min(n,len(seq)),replace=False))))
+            for pos in positions:
+                line_depth=0 if rng.random() < 0.02 else int(rng.integers(1,2*depth))
+                f.write(synthetic_pileup_line(name,pos,seq[pos-1],line_depth,rng))
+                lines_written+=1
+    return lines_written
+
+def run_stdin(pileup, ref_dir, out_dir):
+    '''Runs pileup2diversity.py with the pileup piped to stdin (-i -, as in stream mode); returns diversity array'''
+    script=os.path.join(os.path.dirname(os.path.abspath(__file__)),'pileup2diversity.py')
+    output=f"{out_dir}/stdin_diversity.npz"
+    with open(pileup,'rb') as f:
+        subprocess.run([sys.executable,script,'-i','-','-r',ref_dir,'-o',output,'-c',f"{out_dir}/stdin_coverage.pickle.gz"],
+                       stdin=f,stdout=subprocess.DEVNULL,check=True)
+    return ghf.load_diversity(output)
+
+def time_load(path):
+    '''Returns (loaded array, seconds) for ghf.load_diversity'''
+    t0=time.perf_counter()
+    data=ghf.load_diversity(path)
+    return data, time.perf_counter()-t0
+
+def time_engine(engine, *args, **kwargs):
+    '''Returns (diversity array, seconds)'''
+    t0=time.perf_counter()
+    data,_=engine(*args,**kwargs)
+    return data, time.perf_counter()-t0
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-n', dest='positions', type=int, help='Number of pileup lines', default=100000)
+    parser.add_argument('-d', dest='depth', type=int, help='Mean depth per position', default=50)
+    parser.add_argument('-l', dest='genome_length', type=int, help='Total genome length', default=1600000)
+    parser.add_argument('-k', dest='contigs', type=int, help='Number of contigs', default=3)
+    parser.add_argument('-b', dest='block_bytes', type=int, help='Block size of block engine (bytes)', default=p2d.BLOCK_BYTES)
+    parser.add_argument('-t', dest='threads', type=str, help='Comma-separated process counts to time the block engine with, e.g. 1,2,4,8,16 (default 2)', default='')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--skip-line-engine', dest='skip_line', action='store_true', help='Only time the block engine')
+
+    args = parser.parse_args()
+
+    rng=np.random.default_rng(args.seed)
+    contig_lengths=np.diff(np.linspace(0,args.genome_length,args.contigs+1).astype(int))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print("Writing synthetic reference genome and pileup...")
+        contigs=write_synthetic_genome(tmp,contig_lengths,rng)
+        pileup=f"{tmp}/synthetic.pileup"
+        num_lines=write_synthetic_pileup(pileup,contigs,args.positions,args.depth,rng)
+        megabytes=os.path.getsize(pileup)/1e6
+        print(f"{num_lines} lines, {megabytes:.1f} MB, {args.contigs} contigs")
+
+        block_data,block_sec=time_engine(p2d.pileup2diversity_blocks,pileup,tmp,block_bytes=args.block_bytes)
+        print(f"block engine: {block_sec:.2f} s, {num_lines/block_sec:,.0f} lines/s, {megabytes/block_sec:.1f} MB/s")
+
+        if not np.array_equal(ghf.compact_to_diversity(run_stdin(pileup,tmp,tmp)),ghf.compact_to_diversity(block_data)):
+            raise ValueError('Block engine output from stdin differs from output from file')
+        print("stdin output identical")
+
+        full_data=ghf.compact_to_diversity(block_data)
+        print(f"in memory: float64 {full_data.nbytes/1e6:.1f} MB, compact {block_data.nbytes/1e6:.1f} MB")
+        with gzip.open(f"{tmp}/diversity.pickle.gz",'wb') as f:
+            pickle.dump(full_data,f)
+        ghf.save_diversity(f"{tmp}/diversity.npz",block_data)
+        for path in (f"{tmp}/diversity.pickle.gz",f"{tmp}/diversity.npz"):
+            loaded,load_sec=time_load(path)
+            print(f"{os.path.basename(path)}: {os.path.getsize(path)/1e6:.1f} MB on disk, loaded in {load_sec:.2f} s")
+            if not np.array_equal(ghf.compact_to_diversity(loaded),full_data):
+                raise ValueError(f'{path} does not load back to the same statistics')
+        del full_data
+
+        # parallel output is always checked (2 processes unless -t is given)
+        for threads in [int(t) for t in args.threads.split(',') if t] or [2]:
+            threads_data,threads_sec=time_engine(p2d.pileup2diversity_blocks,pileup,tmp,block_bytes=args.block_bytes,threads=threads)
+            print(f"block engine, {threads} processes: {threads_sec:.2f} s, {megabytes/threads_sec:.1f} MB/s, speedup vs serial {block_sec/threads_sec:.2f}x")
+            if not np.array_equal(ghf.compact_to_diversity(threads_data),ghf.compact_to_diversity(block_data)):
+                raise ValueError(f'Block engine output with {threads} processes differs from serial output')
+
+        if not args.skip_line:
+            line_data,line_sec=time_engine(p2d.pileup2diversity,pileup,tmp)
+            print(f"line engine:  {line_sec:.2f} s, {num_lines/line_sec:,.0f} lines/s, {megabytes/line_sec:.1f} MB/s")
+            print(f"speedup: {line_sec/block_sec:.1f}x")
+            if not np.array_equal(line_data,ghf.compact_to_diversity(block_data)):
+                raise ValueError('Block engine output differs from line engine output')
+            print("Outputs identical")
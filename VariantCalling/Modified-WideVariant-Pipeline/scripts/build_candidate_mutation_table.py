@@ -37,6 +37,12 @@ Output:
         Changed coverage matrices to numpy arrays instead of scipy sparse matrices (because the matrices shouldn't be sparse)
   #   Arolyn, 2022.10.23:
         Fixed bug where indices of indel statistics were not correct (line 173): 8:10 -> 38:40
+  #   2026.10.18: Diversity files are read with gus_helper_functions.load_diversity (compact .npz or pickle.gz)
+  #   2026.10.18: Diversity and quals .npy files are memory-mapped; only candidate rows are read unless coverage matrices are built
+  #   2026.10.18: Quals and counts gathered in a single pass over samples, optionally in parallel (-j);
+        incremental mode (--previous-cmt/--previous-cov) reuses samples and positions of a previous table
+        (-u: previous table is the output itself; outside Snakemake only, as Snakemake removes outputs before a run)
+  #   2026.10.18: Optional out-of-core coverage matrices (-m): memory-mapped on disk, double normalized in chunks
 """
 
 # %%Testing
@@ -58,8 +64,12 @@ import pickle
 import scipy.io as sio
 import os
 import sys, argparse
-import gzip
+import tempfile
+import zipfile
 from scipy import sparse
+from multiprocessing import Pool
+from contextlib import nullcontext
+import gus_helper_functions as ghf
 
 ''' positional and optional argument parser'''
 
@@ -85,15 +95,205 @@ parser.add_argument("-n", dest="cov_mat_norm",
                     help="Output double normalized coverage matrix as sparse csr gzip numpy object (*.npz)",
                     action='store', default='none')
 parser.add_argument("-t", dest="dim", help="Specify the number of statistics (default 8)", type=int, default=8)
-args = parser.parse_args()
+parser.add_argument("-j", dest="threads", help="Number of samples to load in parallel (default 1)", type=int, default=1)
+parser.add_argument("--previous-cmt", dest="previous_cmt",
+                    help="Previous candidate mutation table (*.npz): reuse samples (and positions) it already has whose input files are older than it",
+                    action='store', default=None)
+parser.add_argument("--previous-cov", dest="previous_cov",
+                    help="Raw coverage matrix of the previous table (*.npz); required to reuse samples when building coverage matrices",
+                    action='store', default=None)
+parser.add_argument("-u", dest="incremental",
+                    help="Update existing output table in place: same as --previous-cmt OUTPUT --previous-cov COV_RAW. "
+                         "Only works outside Snakemake, which removes outputs before running a job (use --previous-cmt/--previous-cov there)",
+                    action="store_true", default=False)
+parser.add_argument("-m", dest="memory_budget",
+                    help="Build coverage matrices out of core (on disk next to the output), using about this much memory (MB) for normalization",
+                    type=int, default=None)
 
 # %%
 '''Functions'''
 
 
+def load_sample(path_to_quals, path_to_diversity, positions, dim, get_coverage):
+    """Quals, counts and indel counts of one sample at positions (1-indexed)
+
+    Returns:
+        quals_p (arr): Quals at positions.
+        counts_p (arr): dim x len(positions) counts.
+        indels_p (arr): 2 x len(positions) reads supporting insertions, deletions.
+        coverage (arr): Sum of counts at each position of the genome, or None if not get_coverage.
+    """
+    quals = ghf.load_quals(path_to_quals)
+    quals_p = np.array(quals[positions - 1])  # -1 convert position to index
+    del quals
+
+    data = ghf.load_diversity(path_to_diversity)  # compact format, see ghf.DIVERSITY_DTYPE (memory-mapped if .npy)
+    data_p = ghf.compact_to_diversity(data[positions - 1])  # 40 statistics at positions
+    coverage = None
+    if get_coverage:
+        if dim <= 8:
+            coverage = np.sum(data['counts'][:, 0:dim], axis=1, dtype='uint')
+        else:
+            coverage = np.sum(ghf.compact_to_diversity(data)[:, 0:dim], axis=1).astype('uint')
+    return quals_p, data_p[:, 0:dim].T, data_p[:, 38:40].T, coverage
+
+
+def load_sample_star(args):
+    return load_sample(*args)
+
+
+def load_previous_table(path_to_candidate_mutation_table, path_to_cov_mat_raw, need_coverage, dim, tmpdir=None):
+    """Previous candidate mutation table (and raw coverage matrix if needed) for incremental updates
+
+    If tmpdir is given, the raw coverage matrix is extracted there and memory-mapped instead of loaded.
+    Returns None if there is no usable previous table.
+    """
+    if path_to_candidate_mutation_table is None or not os.path.isfile(path_to_candidate_mutation_table):
+        print('No previous candidate mutation table found; building from scratch')
+        return None
+    with np.load(path_to_candidate_mutation_table) as f:
+        previous = {key: f[key] for key in f.keys()}
+    if previous['counts'].shape[2] != dim:
+        print('Previous candidate mutation table has a different number of statistics; building from scratch')
+        return None
+    previous['mtime'] = os.path.getmtime(path_to_candidate_mutation_table)
+    previous['sample_index'] = {name: j for j, name in enumerate(previous['sample_names'])}
+    if need_coverage:
+        # coverage can only be reused if the raw coverage matrix of the previous table exists
+        if path_to_cov_mat_raw is None or not os.path.isfile(path_to_cov_mat_raw):
+            print('No previous raw coverage matrix found; building from scratch')
+            return None
+        if tmpdir is None:
+            with np.load(path_to_cov_mat_raw) as f:
+                previous['all_coverage_per_bp'] = f['all_coverage_per_bp']
+        else:
+            with zipfile.ZipFile(path_to_cov_mat_raw) as f:  # each array in a .npz is a .npy file
+                path_to_npy = f.extract('all_coverage_per_bp.npy', tmpdir + '/previous')
+            previous['all_coverage_per_bp'] = np.load(path_to_npy, mmap_mode='r')
+        if len(previous['all_coverage_per_bp']) != len(previous['sample_names']):
+            print('Previous raw coverage matrix does not match previous table; building from scratch')
+            return None
+    return previous
+
+
+def reusable_sample(previous, sample_name, paths):
+    """Index of sample in previous table, or None if it is not there or its input files changed since"""
+    if previous is None or sample_name not in previous['sample_index']:
+        return None
+    if any(os.path.getmtime(path) > previous['mtime'] for path in paths):
+        return None
+    return previous['sample_index'][sample_name]
+
+
+def match_positions(p, p_previous):
+    """Which of positions p are in (sorted) p_previous, and their indices there"""
+    idx = np.minimum(np.searchsorted(p_previous, p), max(len(p_previous) - 1, 0))
+    found = (p_previous[idx] == p) if len(p_previous) else np.zeros(len(p), dtype=bool)
+    return found, idx
+
+
+def new_coverage_matrix(genome_length, num_samples, tmpdir=None):
+    """GenomeLength x numSamples coverage matrix; memory-mapped file in tmpdir if given"""
+    if tmpdir is None:
+        return np.zeros((genome_length, num_samples), dtype='uint')
+    return np.lib.format.open_memmap(tmpdir + '/all_coverage_per_bp.npy', mode='w+', dtype='uint',
+                                     shape=(genome_length, num_samples))
+
+
+def normalize_coverage_chunk(chunk):
+    """1st normalization (by position, across samples) of rows of the coverage matrix"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chunk_norm = (chunk - np.mean(chunk, axis=1, keepdims=True)) / np.std(chunk, axis=1, keepdims=True)
+    chunk_norm[~np.isfinite(chunk_norm)] = 0
+    return chunk_norm
+
+
+def double_normalize(all_coverage_per_bp):
+    """Double normalized, scaled coverage matrix (whole matrix in memory)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1st normalization
+        array_cov_norm = (all_coverage_per_bp - np.mean(all_coverage_per_bp, axis=1, keepdims=True)) / np.std(
+            all_coverage_per_bp, axis=1,
+            keepdims=True)  # ,keepdims=True maintains 2D array (second dim == 1), necessary for braodcasting
+        array_cov_norm[~np.isfinite(array_cov_norm)] = 0
+
+        # 2nd normalization
+        array_cov_norm = (array_cov_norm - np.mean(array_cov_norm, axis=0, keepdims=True)) / np.std(array_cov_norm,
+                                                                                                    axis=0,
+                                                                                                    keepdims=True)  # ,keepdims=True maintains 2D array (second dim == 1), necessary for braodcasting
+        array_cov_norm[~np.isfinite(array_cov_norm)] = 0
+
+    # Scale and convert to int to save space
+    return (np.round(array_cov_norm, 3) * 1000).astype('int64')
+
+
+def column_sum(chunk, previous_sum):
+    """Sum over rows of chunk added to previous_sum (sums of earlier chunks); overwrites chunk
+
+    Rows are added one after the other, as np.sum(axis=0) does for the whole matrix, so the result
+    is the same as if all rows were summed at once.
+    """
+    if previous_sum is not None and len(chunk):
+        chunk[0] += previous_sum
+    elif previous_sum is not None:
+        return previous_sum
+    return np.sum(chunk, axis=0)
+
+
+def double_normalize_chunked(all_coverage_per_bp, array_cov_norm_scaled, chunk_rows):
+    """Double normalized, scaled coverage matrix, chunk_rows positions at a time
+
+    Same result as double_normalize(), but only chunk_rows rows of the matrix
+    are in memory at once. Takes three passes: column (sample) means and standard deviations of the
+    1st normalization are computed in streaming passes, then the 2nd normalization is written
+    chunk by chunk into array_cov_norm_scaled.
+
+    Args:
+        all_coverage_per_bp (arr): GenomeLength x numSamples raw coverage (e.g. memory-mapped).
+        array_cov_norm_scaled (arr): GenomeLength x numSamples int64 output (e.g. memory-mapped).
+        chunk_rows (int): Number of positions per chunk.
+    """
+    genome_length = len(all_coverage_per_bp)
+    chunks = [slice(start, start + chunk_rows) for start in range(0, genome_length, chunk_rows)]
+    # column means of 1st normalization
+    col_sum = None
+    for chunk in chunks:
+        col_sum = column_sum(normalize_coverage_chunk(all_coverage_per_bp[chunk]), col_sum)
+    col_mean = col_sum / genome_length
+    # column standard deviations of 1st normalization
+    col_sum = None
+    for chunk in chunks:
+        deviation = normalize_coverage_chunk(all_coverage_per_bp[chunk]) - col_mean
+        col_sum = column_sum(np.multiply(deviation, deviation, out=deviation), col_sum)
+    col_std = np.sqrt(col_sum / genome_length)
+    # 2nd normalization, scale and convert to int to save space
+    for chunk in chunks:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk_norm = (normalize_coverage_chunk(all_coverage_per_bp[chunk]) - col_mean) / col_std
+        chunk_norm[~np.isfinite(chunk_norm)] = 0
+        array_cov_norm_scaled[chunk] = (np.round(chunk_norm, 3) * 1000).astype('int64')
+    return array_cov_norm_scaled
+
+
 def main(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_file, path_to_list_of_quals_files,
          path_to_list_of_diversity_files, path_to_candidate_mutation_table, path_to_cov_mat_raw, path_to_cov_mat_norm,
-         flag_cov_raw, flag_cov_norm, dim):
+         flag_cov_raw, flag_cov_norm, dim, threads=1, path_to_previous_cmt=None, path_to_previous_cov=None,
+         memory_budget=None):
+    # Out of core: coverage matrices are memory-mapped files in a temporary directory next to the output
+    outdir = os.path.dirname(path_to_candidate_mutation_table)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    out_of_core = memory_budget is not None and (flag_cov_raw or flag_cov_norm)
+    tmp = tempfile.TemporaryDirectory(dir=outdir) if out_of_core else nullcontext()
+    with tmp as tmpdir:
+        run(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_file, path_to_list_of_quals_files,
+            path_to_list_of_diversity_files, path_to_candidate_mutation_table, path_to_cov_mat_raw, path_to_cov_mat_norm,
+            flag_cov_raw, flag_cov_norm, dim, threads, path_to_previous_cmt, path_to_previous_cov, memory_budget, tmpdir)
+
+
+def run(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_file, path_to_list_of_quals_files,
+        path_to_list_of_diversity_files, path_to_candidate_mutation_table, path_to_cov_mat_raw, path_to_cov_mat_norm,
+        flag_cov_raw, flag_cov_norm, dim, threads, path_to_previous_cmt, path_to_previous_cov, memory_budget, tmpdir):
     pwd = os.getcwd()
 
     # p: positions on genome that are candidate SNPs
@@ -119,74 +319,76 @@ def main(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_fil
     
     in_outgroup = np.asarray([s == '1' for s in in_outgroup_str], dtype=bool).reshape(1, len(in_outgroup_str))
 
-    ## Quals: quality score (relating to sample purity) at each position for all samples
-    print('Gathering quality scores at each candidate position...')
-    # Import list of directories for where to quals for each sample
+    # Import list of directories for where to quals and diversity files for each sample
     fname = pwd + '/' + path_to_list_of_quals_files
     with open(fname, 'r') as f:
         paths_to_quals_files = f.read().splitlines()
-    # Make Quals
-    Quals = np.zeros((len(p), numSamples), dtype='int')  # initialize
-    for i in range(numSamples):
-        print('Loading quals matrix for sample: ' + str(i))
-        print('Filename: ' + paths_to_quals_files[i])
-        with gzip.open(paths_to_quals_files[i], "rb") as f:
-            quals_temp = pickle.load(f)
-        quals = quals_temp.flatten()
-        Quals[:, i] = quals[p - 1]  # -1 convert position to index
-
-    ## counts: counts for each base from forward and reverse reads at each candidate position for all samples
-    print('Gathering counts data at each candidate position...\n')
-
-    # Import list of directories for where to diversity file for each sample
     fname = pwd + '/' + path_to_list_of_diversity_files
     with open(fname, 'r') as f:
         paths_to_diversity_files = f.read().splitlines()
-    # Load in first diversity to get some stats
-    with gzip.open(paths_to_diversity_files[1], 'rb') as f:
-        data = np.array(pickle.load(f))
-    size = np.shape(data)
-    GenomeLength = size[0]
-
-    # Make counts and coverage at the same time
-    counts = np.zeros((dim, len(p), numSamples), dtype='uint')  # initialize
-    all_coverage_per_bp = np.zeros((GenomeLength, numSamples), dtype='uint')
-    indel_counter = np.zeros((2, len(p), numSamples), dtype='uint')
-
 
+    ## Quals: quality score (relating to sample purity) at each position for all samples
+    ## counts: counts for each base from forward and reverse reads at each candidate position for all samples
+    Quals = np.zeros((len(p), numSamples), dtype='int')  # initialize
+    counts = np.zeros((dim, len(p), numSamples), dtype='uint')
+    indel_counter = np.zeros((2, len(p), numSamples), dtype='uint')
+    all_coverage_per_bp = None  # GenomeLength x numSamples; allocated once genome length is known
+
+    # Reuse samples and positions already in previous candidate mutation table
+    tasks = []  # (sample index, positions to load, whether to collect coverage)
+    previous = None
+    if path_to_previous_cmt is not None:
+        previous = load_previous_table(path_to_previous_cmt, path_to_previous_cov, flag_cov_raw or flag_cov_norm,
+                                       dim, tmpdir)
     for i in range(numSamples):
-        print('Loading counts matrix for sample: ' + str(i))
-        print('Filename: ' + paths_to_diversity_files[i])
-        with gzip.open(paths_to_diversity_files[i], 'rb') as f:
-            data = np.array(pickle.load(f))
-        counts[:, :, i] = data[p - 1, 0:dim].T  # -1 convert position to index
-
-        if flag_cov_raw:
-            np.sum(data[:, 0:dim], axis=1, out=all_coverage_per_bp[:, i])
-
-        indel_counter[:, :, i] = data[p - 1, 38:40].T  # Num reads supporting indels and reads supporting deletions
-        # -1 convert position to index
+        j = reusable_sample(previous, SampleNames[i], [paths_to_quals_files[i], paths_to_diversity_files[i]])
+        if j is None:
+            tasks.append((i, p, flag_cov_raw or flag_cov_norm))
+            continue
+        # copy positions already in previous table; load only new positions
+        found, idx = match_positions(p, previous['p'])
+        Quals[found, i] = previous['quals'][j, idx[found]]
+        counts[:, found, i] = previous['counts'][j, idx[found], :].T
+        indel_counter[:, found, i] = previous['indel_counter'][j, idx[found], :].T
+        if 'all_coverage_per_bp' in previous:
+            if all_coverage_per_bp is None:
+                all_coverage_per_bp = new_coverage_matrix(previous['all_coverage_per_bp'].shape[1], numSamples, tmpdir)
+            all_coverage_per_bp[:, i] = previous['all_coverage_per_bp'][j, :]
+        if not np.all(found):
+            tasks.append((i, p[~found], False))
+        print(f'Reusing sample {SampleNames[i]} from previous table ({np.sum(~found)} new positions to load)')
+
+    # Load quals and diversity of remaining samples/positions, threads samples at a time
+    print(f'Gathering quals and counts data for {len(tasks)} samples...\n')
+    jobs = [(paths_to_quals_files[i], paths_to_diversity_files[i], positions, dim, get_coverage)
+            for i, positions, get_coverage in tasks]
+    with Pool(threads) if threads > 1 else nullcontext() as pool:
+        results = pool.imap(load_sample_star, jobs) if pool else map(load_sample_star, jobs)
+        for (i, positions, get_coverage), (quals_p, counts_p, indels_p, coverage) in zip(tasks, results):
+            print('Loaded sample: ' + str(i))
+            print('Filenames: ' + paths_to_quals_files[i] + ', ' + paths_to_diversity_files[i])
+            cols = np.searchsorted(p, positions) if len(positions) != len(p) else slice(None)
+            Quals[cols, i] = quals_p
+            counts[:, cols, i] = counts_p
+            indel_counter[:, cols, i] = indels_p
+            if get_coverage:
+                if all_coverage_per_bp is None:
+                    all_coverage_per_bp = new_coverage_matrix(len(coverage), numSamples, tmpdir)
+                all_coverage_per_bp[:, i] = coverage
 
 
     # Normalize coverage by sample and then position; ignore /0 ; turn resulting inf to 0
 
-    if flag_cov_norm:
-        with np.errstate(divide='ignore', invalid='ignore'):
-            # 1st normalization
-            array_cov_norm = (all_coverage_per_bp - np.mean(all_coverage_per_bp, axis=1, keepdims=True)) / np.std(
-                all_coverage_per_bp, axis=1,
-                keepdims=True)  # ,keepdims=True maintains 2D array (second dim == 1), necessary for braodcasting
-            array_cov_norm[~np.isfinite(array_cov_norm)] = 0
-
-            # 2nd normalization
-            array_cov_norm = (array_cov_norm - np.mean(array_cov_norm, axis=0, keepdims=True)) / np.std(array_cov_norm,
-                                                                                                        axis=0,
-                                                                                                        keepdims=True)  # ,keepdims=True maintains 2D array (second dim == 1), necessary for braodcasting
-            array_cov_norm[~np.isfinite(array_cov_norm)] = 0
-
-            # Scale and convert to int to save space
-            array_cov_norm_scaled = (np.round(array_cov_norm, 3) * 1000).astype('int64')
-            print(array_cov_norm_scaled.dtype)
+    if flag_cov_norm and tmpdir is not None:
+        # ~6 float64 temporaries per row of a chunk
+        chunk_rows = max(1, memory_budget * 1024**2 // (numSamples * 8 * 6))
+        print(f'Normalizing coverage out of core, {chunk_rows} positions at a time')
+        array_cov_norm_scaled = np.lib.format.open_memmap(tmpdir + '/array_cov_norm_scaled.npy', mode='w+',
+                                                          dtype='int64', shape=all_coverage_per_bp.shape)
+        double_normalize_chunked(all_coverage_per_bp, array_cov_norm_scaled, chunk_rows)
+    elif flag_cov_norm:
+        array_cov_norm_scaled = double_normalize(all_coverage_per_bp)
+        print(array_cov_norm_scaled.dtype)
 
     # Reshape & save matrices
 
@@ -198,10 +400,7 @@ def main(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_fil
     indel_counter = indel_counter.swapaxes(0,2) #indel_counter: num_samples x num_pos x 2
 
 
-    outdir = os.path.dirname(path_to_candidate_mutation_table)
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
-
+    # np.savez_compressed writes memory-mapped matrices in buffered chunks
     if flag_cov_raw:
         print("Saving " + path_to_cov_mat_raw)
         all_coverage_per_bp = all_coverage_per_bp.transpose() #all_coverage_per_bp: num_samples x num_pos
@@ -231,6 +430,7 @@ def main(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_fil
 
 # %%
 if __name__ == "__main__":
+    args = parser.parse_args()
     path_to_p_file = args.allpositions
     path_to_sample_names_file = args.sampleNames
     path_to_outgroup_boolean_file = args.outgroupBool
@@ -240,6 +440,14 @@ if __name__ == "__main__":
     path_to_cov_mat_raw = args.cov_mat_raw
     path_to_cov_mat_norm = args.cov_mat_norm
     dim=args.dim
+    threads=args.threads
+    path_to_previous_cmt=args.previous_cmt
+    path_to_previous_cov=args.previous_cov
+    if args.incremental:
+        # previous table is the output itself
+        path_to_previous_cmt=path_to_candidate_mutation_table
+        path_to_previous_cov=None if path_to_cov_mat_raw == 'none' else path_to_cov_mat_raw
+    memory_budget=args.memory_budget
     if path_to_cov_mat_raw == 'none':
         flag_cov_raw = False
     else:
@@ -250,4 +458,4 @@ if __name__ == "__main__":
         flag_cov_norm = True
     main(path_to_p_file, path_to_sample_names_file, path_to_outgroup_boolean_file, path_to_list_of_quals_files,
          path_to_list_of_diversity_files, path_to_candidate_mutation_table, path_to_cov_mat_raw, path_to_cov_mat_norm,
-         flag_cov_raw, flag_cov_norm,dim)
+         flag_cov_raw, flag_cov_norm,dim,threads,path_to_previous_cmt,path_to_previous_cov,memory_budget)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks of the genome position <-> contig position conversions of genome_positions.
+
+Round trips p2chrpos/chrpos2index, p2names/names2p and the interval
+conversions on random genomes, and checks edge cases: first and last base
+of each contig, a genome of a single contig, and empty input.
+Raises AssertionError on the first failing check, prints OK otherwise.
+
+Usage:
+    python scripts/check_genome_positions.py
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gus_helper_functions as ghf
+import genome_positions
+from benchmark_genome_positions import p2chrpos_loop, check_conversions
+
+#%%
+def genome(lengths):
+    '''chr_starts, genome_length and scaf_names of contigs of lengths'''
+    lengths=np.asarray(lengths,dtype=int)
+    chr_starts=(np.cumsum(lengths)-lengths).astype(int)
+    scaf_names=np.asarray([f"NODE_{i+1}_length_{lengths[i]}" for i in range(len(lengths))],dtype=object)
+    return chr_starts,int(lengths.sum()),scaf_names
+
+def check_contig_ends(lengths):
+    '''First and last base of each contig map to that contig, at position 1 and its length'''
+    chr_starts,genome_length,scaf_names=genome(lengths)
+    contigs=np.arange(1,len(lengths)+1)
+    for p,positions in ((chr_starts+1,np.ones(len(lengths),dtype=int)),(chr_starts+np.asarray(lengths),np.asarray(lengths))):
+        assert np.array_equal(genome_positions.p2contig(p,chr_starts),contigs)
+        chrpos=genome_positions.p2chrpos(p,chr_starts)
+        assert np.array_equal(chrpos,np.column_stack((contigs,positions)))
+        assert np.array_equal(chrpos,p2chrpos_loop(p,chr_starts))
+        assert np.array_equal(genome_positions.chrpos2index(chrpos,chr_starts),p)
+        names,on_contig=genome_positions.p2names(p,chr_starts,scaf_names)
+        assert np.array_equal(names,scaf_names) and np.array_equal(on_contig,positions)
+        contig_index=ghf.ContigIndex(scaf_names,chr_starts)
+        assert np.array_equal(genome_positions.names2p(names.astype(str),on_contig,contig_index),p)
+        assert np.array_equal(genome_positions.names2p([name.encode() for name in names],on_contig,contig_index),p)
+
+    # whole genome as one interval: one piece per contig, each covering the whole contig
+    interval,contig,contig_starts,contig_ends=genome_positions.intervals2chrintervals([0],[genome_length],chr_starts,genome_length)
+    assert np.array_equal(interval,np.zeros(len(lengths),dtype=int))
+    assert np.array_equal(contig,contigs)
+    assert np.array_equal(contig_starts,np.zeros(len(lengths),dtype=int))
+    assert np.array_equal(contig_ends,lengths)
+    # each contig as one interval: one piece, round trips
+    chr_ends=chr_starts+np.asarray(lengths)
+    interval,contig,contig_starts,contig_ends=genome_positions.intervals2chrintervals(chr_starts,chr_ends,chr_starts,genome_length)
+    assert np.array_equal(interval,contigs-1) and np.array_equal(contig,contigs)
+    starts,ends=genome_positions.chrintervals2intervals(contig,contig_starts,contig_ends,chr_starts)
+    assert np.array_equal(starts,chr_starts) and np.array_equal(ends,chr_ends)
+    # single base intervals at the first and last base of each contig
+    for start in (chr_starts,chr_ends-1):
+        interval,contig,contig_starts,contig_ends=genome_positions.intervals2chrintervals(start,start+1,chr_starts,genome_length)
+        assert np.array_equal(contig,contigs) and np.array_equal(contig_ends-contig_starts,np.ones(len(lengths),dtype=int))
+
+def check_empty(lengths):
+    '''Empty position and interval arrays give empty results'''
+    chr_starts,genome_length,scaf_names=genome(lengths)
+    p=np.array([],dtype=int)
+    assert len(genome_positions.p2contig(p,chr_starts)) == 0
+    chrpos=genome_positions.p2chrpos(p,chr_starts)
+    assert chrpos.shape == (0,2)
+    assert len(genome_positions.chrpos2index(chrpos,chr_starts)) == 0
+    names,positions=genome_positions.p2names(p,chr_starts,scaf_names)
+    assert len(names) == 0 and len(positions) == 0
+    contig_index=ghf.ContigIndex(scaf_names,chr_starts)
+    assert len(genome_positions.names2p(names.astype(str),positions,contig_index)) == 0
+
+    pieces=genome_positions.intervals2chrintervals(p,p,chr_starts,genome_length)
+    assert all(len(piece) == 0 for piece in pieces)
+    # empty intervals give no pieces
+    pieces=genome_positions.intervals2chrintervals(chr_starts,chr_starts,chr_starts,genome_length)
+    assert all(len(piece) == 0 for piece in pieces)
+    starts,ends=genome_positions.chrintervals2intervals(p,p,p,chr_starts)
+    assert len(starts) == 0 and len(ends) == 0
+
+def check_outside(lengths):
+    '''Intervals outside of the genome raise ValueError'''
+    chr_starts,genome_length,scaf_names=genome(lengths)
+    for starts,ends in (([-1],[1]),([0],[genome_length+1])):
+        try:
+            genome_positions.intervals2chrintervals(starts,ends,chr_starts,genome_length)
+        except ValueError:
+            continue
+        raise AssertionError(f'interval [{starts[0]}, {ends[0]}) outside of genome accepted')
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-n', dest='positions', type=int, help='Number of random positions per genome', default=10000)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    rng=np.random.default_rng(args.seed)
+    for lengths in ([1],[5000],[1,1,1],[3,1,4,1,5,9,2,6],list(rng.integers(1,10000,size=100))):
+        check_contig_ends(lengths)
+        check_empty(lengths)
+        check_outside(lengths)
+        chr_starts,genome_length,scaf_names=genome(lengths)
+        p=np.sort(rng.integers(1,genome_length+1,size=args.positions))
+        check_conversions(p,chr_starts,genome_length,scaf_names,rng)
+    print("OK")
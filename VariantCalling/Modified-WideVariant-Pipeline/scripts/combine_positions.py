@@ -8,8 +8,8 @@ Created on Mon Feb  7 20:00:41 2022
 import numpy as np
 import pickle
 import argparse
-import gzip
 import gus_helper_functions as ghf
+import genome_positions
 
 #%%
 def chrpos2index(chrpos,chr_starts):
@@ -27,13 +27,58 @@ def chrpos2index(chrpos,chr_starts):
         chrpos=chrpos.T
         print('Reversed orientation of chrpos')
         
-    if len(chr_starts) == 1:
-        p=chrpos[:,1]
-    else:
-        p=chr_starts[chrpos[:,0]-1]+chrpos[:,1]
+    p=genome_positions.chrpos2index(chrpos,chr_starts)
 
     return p
 
+MERGE_CHUNK=1000000 # positions read from each sample file per merge step
+
+def load_sample_positions(path_to_positions_file, chr_starts):
+    '''Sorted positions (1-indexed) of one sample positions file
+
+    .npy files (sorted uint32) are memory-mapped; pickled px2 chrpos arrays
+    (as saved by p2chrpos) are converted to positions.
+    '''
+    positions=ghf.load_positions(path_to_positions_file)
+    if positions.ndim==2:
+        # not chrpos2index, which guesses orientation (wrong for <=2 positions)
+        positions=np.unique(genome_positions.chrpos2index(positions,chr_starts))
+    return positions
+
+def merge_sorted_positions(positions_list, chunk=MERGE_CHUNK):
+    '''Union of sorted position vectors, by a k-way merge in chunks
+
+    Only chunk positions of each vector are read per step, so memory-mapped
+    vectors are streamed from disk. Every step takes, from each vector, the
+    positions up to the smallest last position among the current chunks; these
+    are all the positions up to that bound, as positions are unique in each vector.
+
+    Args:
+        positions_list (list): Sorted vectors of unique positions.
+        chunk (int): Number of positions read from each vector per step.
+
+    Returns:
+        combined_pos (arr): Sorted vector of positions in any of the vectors.
+
+    '''
+    cursors=[0]*len(positions_list)
+    merged=[]
+    while True:
+        active=[i for i in range(len(positions_list)) if cursors[i]<len(positions_list[i])]
+        if not active:
+            break
+        bound=min(positions_list[i][min(cursors[i]+chunk,len(positions_list[i]))-1] for i in active)
+        step=[]
+        for i in active:
+            block=np.asarray(positions_list[i][cursors[i]:cursors[i]+chunk])
+            n=np.searchsorted(block,bound,side='right')
+            step.append(block[:n])
+            cursors[i]+=n
+        merged.append(np.unique(np.concatenate(step)).astype(np.int64))
+    if not merged:
+        return np.zeros(0,dtype=np.int64)
+    return np.concatenate(merged)
+
 def generate_positions_snakemake(positions_files_list, REFGENOMEDIRECTORY):
     '''Python version of generate_positions_snakemake.m
     
@@ -46,26 +91,19 @@ def generate_positions_snakemake(positions_files_list, REFGENOMEDIRECTORY):
 
     '''
     
-    [chr_starts,genome_length,scaf_names] = ghf.genomestats(REFGENOMEDIRECTORY)
-    
-    # initialize vector to count occurrances of variants across samples
-    timesvariant = np.zeros((genome_length,1))
+    [chr_starts,genome_length,scaf_names,_] = ghf.genomestats(REFGENOMEDIRECTORY)
     
+    positions_list=[]
     for i in range(len(positions_files_list)):
-        #load in positions array for sample
-        with gzip.open(positions_files_list[i].rstrip('\n'),"rb") as f:
-            positions=pickle.load(f)
+        #load in (memory-mapped if .npy) positions of sample
+        positions=load_sample_positions(positions_files_list[i].rstrip('\n'),chr_starts)
         
         if len(positions)>2:
-            x=chrpos2index(positions,chr_starts)
-            
-            timesvariant[x]=timesvariant[x]+1
-    
+            positions_list.append(positions)
     
-    #Keep positions that vary from the reference in at least one sample but
-    #that don't vary from the reference in ALL samples
-    # combined_pos = np.where((timesvariant > 0) & (timesvariant < len(positions_files_list)))[0]
-    combined_pos = np.where((timesvariant > 0))[0]
+    #Keep positions that vary from the reference in at least one sample
+    #(no genome_length x samples or genome_length vector is allocated)
+    combined_pos = merge_sorted_positions(positions_list)
     
     return combined_pos
     
@@ -82,7 +120,7 @@ def combine_positions(path_to_positions_files, path_to_output_p_file, path_to_ou
     include = [not i for i in in_outgroup]
     
     #Get positions on reference genome
-    [chr_starts,genome_length,scaf_names] = ghf.genomestats(REFGENOMEDIRECTORY)
+    [chr_starts,genome_length,scaf_names,_] = ghf.genomestats(REFGENOMEDIRECTORY)
     
     #Find positions with at least 1 fixed mutation relative to reference genome
     print('\n\nFinding positions with at least 1 fixed mutation...\n')
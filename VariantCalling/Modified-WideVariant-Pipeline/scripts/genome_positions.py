@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized conversions between positions on the concatenated reference genome
+and positions on its contigs, for arrays of positions at once.
+
+Conventions (as returned by gus_helper_functions.genomestats):
+    chr_starts: start of each contig on the concatenated genome (begins at 0).
+    p: 1-indexed positions on the concatenated genome.
+    chrpos: px2 array of contig number (1-indexed) and 1-indexed position on contig.
+    Intervals are half-open [start, end) of 0-based indices, on the genome or on a contig.
+
+Contigs are found with np.searchsorted, so converting n positions costs
+O(n log(number of contigs)).
+"""
+import numpy as np
+
+#%%
+def p2contig(p, chr_starts):
+    '''Contig number (1-indexed) of each 1-indexed genome position'''
+    # position chr_starts[i] is the last base of contig i (1-indexed positions)
+    return np.maximum(np.searchsorted(chr_starts, p, side='left'), 1)
+
+def p2chrpos(p, chr_starts):
+    '''Convert 1col vector of positions to 2col array with contig and position on contig
+
+    Args:
+        p (arr): 1-indexed positions on genome.
+        chr_starts (arr): Start of each contig on genome (begins at 0).
+
+    Returns:
+        chrpos (arr): px2 array of contig (1-indexed) and position on contig.
+
+    '''
+    p = np.asarray(p)
+    chromo = p2contig(p, chr_starts)
+    return np.column_stack((chromo, p - np.asarray(chr_starts)[chromo-1]))
+
+def chrpos2index(chrpos, chr_starts):
+    '''Convert px2 array of contig and position on contig to 1-indexed positions on genome'''
+    chrpos = np.asarray(chrpos)
+    return np.asarray(chr_starts)[chrpos[:,0].astype(np.int64)-1] + chrpos[:,1]
+
+def p2names(p, chr_starts, scaf_names):
+    '''Contig names and positions on contig of 1-indexed genome positions
+
+    Returns:
+        names (arr): Contig name of each position.
+        positions (arr): 1-indexed position on contig.
+
+    '''
+    chrpos = p2chrpos(p, chr_starts)
+    return np.asarray(scaf_names)[chrpos[:,0]-1], chrpos[:,1]
+
+def names2p(names, positions, contig_index):
+    '''1-indexed genome positions of contig names and positions on contig
+
+    Each distinct name is looked up once.
+
+    Args:
+        names (arr): Contig names (str or bytes).
+        positions (arr): 1-indexed positions on contig.
+        contig_index (ContigIndex): Contig name -> chr_start (see gus_helper_functions).
+
+    Returns:
+        p (arr): 1-indexed positions on genome.
+
+    Raises:
+        KeyError: If a name is not a contig of the reference.
+
+    '''
+    unique_names, contig = np.unique(np.asarray(names), return_inverse=True)
+    offsets = np.fromiter((contig_index[name] for name in unique_names), dtype=np.int64, count=len(unique_names))
+    return offsets[contig.reshape(-1)] + np.asarray(positions, dtype=np.int64)
+
+def intervals2chrintervals(starts, ends, chr_starts, genome_length):
+    '''Split half-open genome intervals into half-open intervals on contigs
+
+    Intervals spanning contig boundaries are split into one piece per contig;
+    empty intervals give no pieces.
+
+    Args:
+        starts (arr): 0-based start of each interval on genome.
+        ends (arr): 0-based end (exclusive) of each interval on genome.
+        chr_starts (arr): Start of each contig on genome (begins at 0).
+        genome_length (int): Length of genome.
+
+    Returns:
+        interval (arr): Index of the genome interval of each piece.
+        contig (arr): Contig (1-indexed) of each piece.
+        contig_starts (arr): 0-based start of each piece on its contig.
+        contig_ends (arr): 0-based end (exclusive) of each piece on its contig.
+
+    '''
+    chr_starts = np.asarray(chr_starts, dtype=np.int64)
+    chr_ends = np.append(chr_starts[1:], genome_length)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if np.any((starts < 0) | (ends > genome_length)):
+        raise ValueError('Interval outside of reference genome')
+    first = np.searchsorted(chr_starts, starts, side='right')  # contig of index start
+    last = np.searchsorted(chr_starts, ends-1, side='right')   # contig of index end-1
+    num_pieces = np.where(ends > starts, last-first+1, 0)
+    interval = np.repeat(np.arange(len(starts)), num_pieces)
+    piece_of_interval = np.arange(len(interval)) - np.repeat(np.cumsum(num_pieces)-num_pieces, num_pieces)
+    contig = first[interval] + piece_of_interval
+    offset = chr_starts[contig-1]
+    contig_starts = np.maximum(starts[interval], offset) - offset
+    contig_ends = np.minimum(ends[interval], chr_ends[contig-1]) - offset
+    return interval, contig, contig_starts, contig_ends
+
+def chrintervals2intervals(contig, contig_starts, contig_ends, chr_starts):
+    '''Half-open intervals on contigs (contig 1-indexed) to half-open intervals on genome'''
+    offset = np.asarray(chr_starts, dtype=np.int64)[np.asarray(contig, dtype=np.int64)-1]
+    return offset + contig_starts, offset + contig_ends
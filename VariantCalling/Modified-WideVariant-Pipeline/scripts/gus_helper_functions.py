@@ -12,6 +12,7 @@ import csv
 import glob
 import subprocess
 import gzip
+import genome_positions
 
 def read_samples_CSV(spls):
     hdr_check = ['Path','Sample','FileName','Reference','Group','Outgroup']
@@ -226,6 +227,16 @@ def cp_append_files(paths,sample,filename,output_dir):
     subprocess.run("zcat " + rev_list + ' | gzip > ' + output_dir + '/' +  sample + '/R2.fq.gz', shell=True)
     
 
+def genome_fasta_path(REFGENOME_DIR):
+    '''Path of dir/genome.fasta, or dir/genome.fasta.gz if there is no genome.fasta'''
+    fasta_file = glob.glob(REFGENOME_DIR + '/genome.fasta')
+    if len(fasta_file) != 1:
+        fasta_file_gz = glob.glob(REFGENOME_DIR + '/genome.fasta.gz')
+        if len(fasta_file_gz) != 1:
+            raise ValueError('Either no genome.fasta(.gz) or more than 1 genome.fasta(.gz) file found in ' + REFGENOME_DIR)
+        return fasta_file_gz[0]
+    return fasta_file[0]
+
 def read_fasta(REFGENOME_DIR): 
     '''Reads in fasta file. If directory is given, reads in dir/genome.fasta
     Args:
@@ -233,70 +244,279 @@ def read_fasta(REFGENOME_DIR):
 
     Returns: SeqIO object for reference genome.
     '''
-    fasta_file = glob.glob(REFGENOME_DIR + '/genome.fasta')
-    if len(fasta_file) != 1:
-        fasta_file_gz = glob.glob(REFGENOME_DIR + '/genome.fasta.gz')
-        if len(fasta_file_gz) != 1:
-            raise ValueError('Either no genome.fasta(.gz) or more than 1 genome.fasta(.gz) file found in ' + REFGENOME_DIR)
-        else: # genome.fasta.gz
-            refgenome = SeqIO.parse(gzip.open(fasta_file_gz[0], "rt"),'fasta')
-    else: # genome.fasta
-        refgenome = SeqIO.parse(fasta_file[0],'fasta')
+    fasta_file = genome_fasta_path(REFGENOME_DIR)
+    if fasta_file.endswith('.gz'):
+        refgenome = SeqIO.parse(gzip.open(fasta_file, "rt"),'fasta')
+    else:
+        refgenome = SeqIO.parse(fasta_file,'fasta')
     
     return refgenome
 
+class ContigIndex:
+    '''Scaffold name -> chr_start lookup in O(1), regardless of number of contigs
+
+    Replaces chr_starts[np.where(chromo==scaf_names)], which scans all contigs
+    for every line of a pileup/vcf. Accepts names as str or bytes.
+
+    Args:
+        ScafNames (arr): Scaffold names, in genome order.
+        ChrStarts (arr): Start of each scaffold on the concatenated genome (begins at 0).
+
+    '''
+    def __init__(self, ScafNames, ChrStarts):
+        self.offsets = {}
+        for name,start in zip(ScafNames, ChrStarts):
+            self.offsets[name] = int(start)
+            self.offsets[name.encode()] = int(start)
+        self.single_contig = (len(ChrStarts) == 1)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def __getitem__(self, name):
+        return self.offsets[name]
+
+    def __len__(self):
+        return len(self.offsets) // 2
+
+GENOMESTATS_INDEX_SUFFIX = '.genomestats.npz'
+_genomestats_cache = {}
+
+def _read_fai(fai_file):
+    '''Scaffold names and lengths from a samtools faidx .fai file'''
+    ScafNames = []
+    ScafLengths = []
+    with open(fai_file) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            ScafNames.append(fields[0])
+            ScafLengths.append(int(fields[1]))
+    return ScafNames,ScafLengths
+
+def _read_genomestats_index(index_file, fasta_stat):
+    '''Scaffold names and lengths from a genomestats index, or None if missing or made from another version of the fasta'''
+    try:
+        with np.load(index_file) as f:
+            if int(f['fasta_mtime_ns']) != fasta_stat.st_mtime_ns or int(f['fasta_size']) != fasta_stat.st_size:
+                return None
+            return f['names'].tolist(),f['lengths'].tolist()
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _write_genomestats_index(index_file, fasta_stat, ScafNames, ScafLengths):
+    '''Save genomestats index next to the fasta; skipped if the directory is not writable'''
+    tmp_file = index_file + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, names=np.array(ScafNames, dtype=str), lengths=np.asarray(ScafLengths, dtype=np.int64),
+                     fasta_mtime_ns=np.int64(fasta_stat.st_mtime_ns), fasta_size=np.int64(fasta_stat.st_size))
+        os.replace(tmp_file, index_file) # atomic, so parallel jobs never read a partial index
+    except OSError:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def _scaffold_lengths(REFGENOMEFOLDER, fasta_file, fasta_stat):
+    '''Scaffold names and lengths of the reference genome, without parsing the fasta if possible
+
+    Uses, in order: genome.fasta.fai (made by samtools faidx) if it is not older
+    than the fasta; genome.fasta.genomestats.npz if it was made from a fasta of
+    the same mtime and size; otherwise parses the fasta and saves
+    genome.fasta.genomestats.npz for the next call.
+    '''
+    fai_file = fasta_file + '.fai'
+    if not fasta_file.endswith('.gz') and os.path.isfile(fai_file) and os.stat(fai_file).st_mtime_ns >= fasta_stat.st_mtime_ns:
+        return _read_fai(fai_file)
+    index_file = fasta_file + GENOMESTATS_INDEX_SUFFIX
+    index = _read_genomestats_index(index_file, fasta_stat)
+    if index is not None:
+        return index
+    ScafNames = []
+    ScafLengths = []
+    for record in read_fasta(REFGENOMEFOLDER):
+        ScafNames.append(record.id)
+        ScafLengths.append(len(record))
+    _write_genomestats_index(index_file, fasta_stat, ScafNames, ScafLengths)
+    return ScafNames,ScafLengths
+
 def genomestats(REFGENOMEFOLDER):
     '''Parse genome to extract relevant stats
 
+    Scaffold names and lengths are read from genome.fasta.fai or from a cached
+    index next to the fasta when available (see _scaffold_lengths), and are
+    kept in memory for repeated calls within one process.
+
     Args:
         REFGENOMEFOLDER (str): Directory containing reference genome file.
 
     Returns:
-        ChrStarts (arr): DESCRIPTION.
-        Genomelength (arr): DESCRIPTION.
-        ScafNames (arr): DESCRIPTION.
+        ChrStarts (arr): Start of each scaffold on the concatenated genome (begins at 0).
+        Genomelength (arr): Total length of genome.
+        ScafNames (arr): Scaffold names.
+        ContigIdx (ContigIndex): Scaffold name -> ChrStarts lookup.
 
     '''
+    fasta_file = genome_fasta_path(REFGENOMEFOLDER)
+    fasta_stat = os.stat(fasta_file)
+    cache_key = (os.path.abspath(fasta_file), fasta_stat.st_mtime_ns, fasta_stat.st_size)
+    if cache_key not in _genomestats_cache:
+        _genomestats_cache[cache_key] = _scaffold_lengths(REFGENOMEFOLDER, fasta_file, fasta_stat)
+    ScafNames,ScafLengths = _genomestats_cache[cache_key]
 
-    refgenome = read_fasta(REFGENOMEFOLDER)
-    
-    Genomelength = 0
-    ChrStarts = []
-    ScafNames = []
-    for record in refgenome:
-        ChrStarts.append(Genomelength) # chr1 starts at 0 in analysis.m
-        Genomelength = Genomelength + len(record)
-        ScafNames.append(record.id)
-    # close file
-    #refgenome.close() # biopy update SeqIO has no close attribute anymore.
-    # turn to np.arrys!
-    ChrStarts = np.asarray(ChrStarts,dtype=int)
-    Genomelength = np.asarray(Genomelength,dtype=int)
+    ScafLengths = np.asarray(ScafLengths,dtype=int)
+    ChrStarts = np.cumsum(ScafLengths) - ScafLengths # chr1 starts at 0 in analysis.m
+    Genomelength = np.asarray(ScafLengths.sum(),dtype=int)
     ScafNames = np.asarray(ScafNames,dtype=object)
-    return ChrStarts,Genomelength,ScafNames
+    ContigIdx = ContigIndex(ScafNames,ChrStarts)
+    return ChrStarts,Genomelength,ScafNames,ContigIdx
 
 def p2chrpos(p, ChrStarts):
     '''Convert 1col list of pos to 2col array with chromosome and pos on chromosome
 
     Args:
-        p (TYPE): DESCRIPTION.
-        ChrStarts (TYPE): DESCRIPTION.
+        p (arr): 1-indexed positions on genome.
+        ChrStarts (arr): Start of each scaffold on the concatenated genome (begins at 0).
 
     Returns:
-        chrpos (TYPE): DESCRIPTION.
+        chrpos (arr): px2 array of chromosome (1-indexed) and position on chromosome.
 
     '''
-        
-    # get chr and pos-on-chr
-    chromo = np.ones(len(p),dtype=int)
-    if len(ChrStarts) > 1:
-        for i in ChrStarts[1:]:
-            chromo = chromo + (p > i) # when (p > i) evaluates 'true' lead to plus 1 in summation. > bcs ChrStarts start with 0...genomestats()
-        positions = p - ChrStarts[chromo-1] # [chr-1] -1 due to 0based index
-        chrpos = np.column_stack((chromo,positions))
+    return genome_positions.p2chrpos(p, ChrStarts)
+
+
+# Compact diversity format: the 40 statistics of pileup2diversity.py stored with
+# per-statistic dtypes (56 bytes instead of 320 bytes per position); statistics
+# 32-37 are never computed and are not stored.
+# (field name, dtype, first column, last column+1 in the 40 column diversity array)
+DIVERSITY_FIELDS = [('counts', np.uint16, 0, 8),  # A T C G a t c g
+                    ('bq', np.uint8, 8, 16),      # average base quality
+                    ('mq', np.uint8, 16, 24),     # average mapping quality
+                    ('td', np.uint16, 24, 32),    # average tail distance
+                    ('indels', np.uint32, 38, 40)]  # reads supporting insertions, deletions
+DIVERSITY_DTYPE = np.dtype([(name, dtype, (stop-start,)) for name,dtype,start,stop in DIVERSITY_FIELDS])
+
+def diversity_to_compact(data):
+    '''Convert Nx40 float diversity array into compact structured array
+
+    Args:
+        data (arr): Nx40 diversity array (as made by pileup2diversity).
+
+    Returns:
+        compact (arr): Length N array of dtype DIVERSITY_DTYPE.
+
+    '''
+    compact = np.zeros(len(data), dtype=DIVERSITY_DTYPE)
+    for name,dtype,start,stop in DIVERSITY_FIELDS:
+        values = data[:,start:stop]
+        if values.size and (values.min() < 0 or values.max() > np.iinfo(dtype).max):
+            raise ValueError(f"Diversity statistic '{name}' out of range for {np.dtype(dtype).name}")
+        compact[name] = values
+    return compact
+
+def compact_to_diversity(compact):
+    '''Convert compact structured diversity array back to Nx40 float array'''
+    data = np.zeros((len(compact),40))
+    for name,dtype,start,stop in DIVERSITY_FIELDS:
+        data[:,start:stop] = compact[name]
+    return data
+
+def compact_coverage(compact):
+    '''Sum of all 40 statistics per position, as saved in the coverage file of pileup2diversity'''
+    coverage = np.zeros(len(compact))
+    for name,_,_,_ in DIVERSITY_FIELDS:
+        coverage += compact[name].sum(axis=1)
+    return coverage
+
+def save_diversity(path, data):
+    '''Save diversity array in format given by extension of path
+
+    .npy: compact format, uncompressed; memory-mapped by load_diversity so
+          that only the rows that are used are read from disk
+    .npz: compact format, compressed
+    otherwise: gzipped pickle of Nx40 float array
+    '''
+    if path.endswith('.npy') or path.endswith('.npz'):
+        if data.dtype != DIVERSITY_DTYPE:
+            data = diversity_to_compact(data)
+        if path.endswith('.npy'):
+            np.save(path, data)
+        else:
+            np.savez_compressed(path, diversity=data)
+    else:
+        if data.dtype == DIVERSITY_DTYPE:
+            data = compact_to_diversity(data)
+        with gzip.open(path, 'wb') as f:
+            pickle.dump(data, f)
+
+def _file_type(path):
+    '''npy, npz or gzip, from the first bytes of a file'''
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if magic == b'\x93NUMPY':
+        return 'npy'
+    if magic[:2] == b'\x1f\x8b':
+        return 'gzip'
+    return 'npz'
+
+def load_diversity(path):
+    '''Load diversity file as compact structured array
+
+    .npy files are memory-mapped (read-only): indexing rows only reads those
+    rows from disk. .npz and gzipped pickles are read into memory. File type
+    is detected from its contents, so links with any file extension work.
+    '''
+    file_type = _file_type(path)
+    if file_type == 'npy':
+        return np.load(path, mmap_mode='r')
+    if file_type == 'gzip': # pickled Nx40 float array
+        with gzip.open(path, 'rb') as f:
+            return diversity_to_compact(np.array(pickle.load(f)))
+    with np.load(path) as f:
+        return f['diversity']
+
+def save_quals(path, quals):
+    '''Save quals vector; uncompressed int32 .npy (memory-mappable) if path ends with .npy, otherwise gzipped pickle'''
+    if path.endswith('.npy'):
+        np.save(path, np.asarray(quals, dtype=np.int32).flatten())
     else:
-        chrpos = np.column_stack((chromo,p))
-    return chrpos
+        with gzip.open(path, 'wb') as f:
+            pickle.dump(quals, f)
+
+def load_quals(path):
+    '''Load quals vector (length genome_length); .npy files are memory-mapped (read-only)'''
+    if _file_type(path) == 'npy':
+        return np.load(path, mmap_mode='r')
+    with gzip.open(path, 'rb') as f:
+        return pickle.load(f).flatten()
+
+def save_positions(path, positions, ChrStarts):
+    '''Save candidate positions (1-indexed, on concatenated genome) of a sample
+
+    .npy: sorted uint32 positions (memory-mappable, 4 bytes per position)
+    otherwise: gzipped pickle of 2col chromosome/position array (see p2chrpos)
+    '''
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    if path.endswith('.npy'):
+        if len(positions) and positions[-1] > np.iinfo(np.uint32).max:
+            raise ValueError('Positions out of range for uint32')
+        np.save(path, positions.astype(np.uint32))
+    else:
+        with gzip.open(path, 'wb') as f:
+            pickle.dump(p2chrpos(positions, ChrStarts), f)
+
+def load_positions(path):
+    '''Load candidate positions file of a sample
+
+    .npy files are memory-mapped sorted uint32 positions (1-indexed). Pickles
+    (gzipped or not) are returned as saved: 2col chromosome/position arrays.
+    '''
+    file_type = _file_type(path)
+    if file_type == 'npy':
+        return np.load(path, mmap_mode='r')
+    if file_type == 'gzip':
+        with gzip.open(path, 'rb') as f:
+            return pickle.load(f)
+    with open(path, 'rb') as f: # older outgroup positions files were not gzipped
+        return pickle.load(f)
 
 
 # def get_clade_wildcards(cladeID):
@@ -11,12 +11,20 @@ import sys
 import gzip
 import argparse
 import gus_helper_functions as ghf
+import genome_positions
 import pickle
+import os
+from multiprocessing import Pool, shared_memory
 
 #%% Version history
 #2022.02.08: Evan: Direct translation from pileup_to_diversity_matrix_snakemake.m
 #2022.10.18, Arolyn: Now works when reference genome has lowercase letters or ambiguous letters
 #2022.10.23, Arolyn: Updated comments on 40 statistics to have python indexing (0-39) as opposed to matlab indexing (1-40)
+#2026.10.18: Added block engine (pileup2diversity_blocks) that parses thousands of lines at once with numpy; output identical to line engine
+#2026.10.18: Input pileup can be '-' to read from stdin (e.g. piped straight from samtools mpileup)
+#2026.10.18: Block engine can parse regions of the genome in parallel (--threads) into a shared-memory array
+#2026.10.18: Block engine stores statistics in compact format (ghf.DIVERSITY_DTYPE); output saved as .npz if output path ends with .npz
+#2026.10.18: Output saved as memory-mappable .npy if output path ends with .npy
 
 #%%Some notes
 
@@ -50,12 +58,37 @@ import pickle
 # ChrStarts: is an array holding the indices in the position dimension
 # corresponding to the start of a new chromsome.
 
+#%% Parameters shared by the block engine (the line engine keeps its own copies)
+PHRED_OFFSET=33 # mpileup output is always Phred+33
+NUM_FIELDS=40
+INDELREGION=3 # region surrounding each p where indels recorded
+BLOCK_BYTES=16*1024*1024 # approximate size of each block of pileup text read by the block engine
+
+REF_CODES={b'A':0,b'T':1,b'C':2,b'G':3,b'a':0,b't':1,b'c':2,b'g':3} # reference allele -> 0123 (-1 if ambiguous)
+REF_UPPER=np.frombuffer(b'ATCG',dtype=np.int8) # replacement for '.' (forward match to reference)
+REF_LOWER=np.frombuffer(b'atcg',dtype=np.int8) # replacement for ',' (reverse match to reference)
+NT_INDEX=np.full(256,-1,dtype=np.int64) # ASCII code -> column 0-7 of ATCGatcg
+for _i,_nt in enumerate(b'ATCGatcg'):
+    NT_INDEX[_nt]=_i
+
 #%%
+def open_pileup(input_pileup, mode='r'):
+    """Opens pileup file, or returns stdin if input_pileup is '-'
+
+    Args:
+        input_pileup (str): Path to input pileup file, or '-' for stdin.
+        mode (str): 'r' for text or 'rb' for bytes.
+
+    """
+    if input_pileup == '-':
+        return sys.stdin.buffer if 'b' in mode else sys.stdin
+    return open(input_pileup,mode)
+
 def pileup2diversity(input_pileup, path_to_ref):
     """Grabs relevant allele info from mpileupfile and stores as a nice array 
 
     Args:
-        input_pileup (str): Path to input pileup file.
+        input_pileup (str): Path to input pileup file, or '-' for stdin.
         path_to_ref (str): Path to reference genome file
         
     """
@@ -67,14 +100,14 @@ def pileup2diversity(input_pileup, path_to_ref):
     num_fields=40
     indelregion=3 #region surrounding each p where indels recorded 
     #get reference genome + position information
-    chr_starts,genome_length,scaf_names = ghf.genomestats(path_to_ref)
+    chr_starts,genome_length,scaf_names,contig_index = ghf.genomestats(path_to_ref)
     
     #init
     data = np.zeros((genome_length,num_fields)) #format [[A T C G  a t c g],[...]]
         
     #Read in mpileup file
     print(f"Reading input file: {input_pileup}")
-    mpileup = open(input_pileup)
+    mpileup = open_pileup(input_pileup)
     
     #####
     loading_bar=0
@@ -95,9 +128,9 @@ def pileup2diversity(input_pileup, path_to_ref):
         if len(chr_starts) == 1:
             position=int(lineinfo[1])
         else:
-            if chromo not in scaf_names:
+            if chromo not in contig_index:
                 raise ValueError("Scaffold name in pileup file not found in reference")
-            position=int(chr_starts[np.where(chromo==scaf_names)]) + int(lineinfo[1])
+            position=contig_index[chromo] + int(lineinfo[1])
             #chr_starts starts at 0
         
         #ref allele
@@ -193,6 +226,337 @@ def pileup2diversity(input_pileup, path_to_ref):
     
     return data, coverage
 
+#%%
+def _indel_regions(positions, indelsizes, is_deletion, genome_length):
+    """Start/stop indices of the rows whose indel statistics (38/39) each indel increments
+
+    Vectorized version of the slicing in pileup2diversity(), including its
+    handling of indels near the start and end of the genome.
+
+    Args:
+        positions (arr): Absolute 1-indexed positions of the calls carrying the indels.
+        indelsizes (arr): Size of each indel.
+        is_deletion (arr): True for deletions ('-'), False for insertions ('+').
+        genome_length (int): Length of reference genome.
+
+    Returns:
+        start (arr): First row incremented by each indel.
+        stop (arr): Row after the last row incremented by each indel.
+
+    """
+    extent=np.where(is_deletion,indelsizes,0) # insertions are not indexed on the chromosome
+    start=positions-INDELREGION-1
+    stop=positions+extent+INDELREGION-1
+    middle=(start >= 0) & (stop < genome_length) # if in middle of contig
+    end=~middle & (positions-INDELREGION >= 0) # if at end of contig
+    beginning=~middle & ~end # if at beginning of contig
+    start=np.where(end & (start < 0),start+genome_length,start) # matches data[-1:] slicing of line engine
+    start[beginning]=0
+    stop[end]=genome_length
+    stop=np.minimum(stop,genome_length)
+    return start, stop
+
+def _parse_pileup_block(lines, data, indel_diff, genome_length, contig_offsets):
+    """Parses a block of mpileup lines at once and stores stats in data
+
+    Args:
+        lines (list): Lines of the mpileup file (bytes).
+        data (arr): Compact diversity array (ghf.DIVERSITY_DTYPE) of length
+            genome_length to store statistics into.
+        indel_diff (arr): 2 x (genome_length+1) difference array for the
+            insertion (38) and deletion (39) counts; turned into counts with
+            a cumulative sum once all blocks are parsed, as indels affect
+            lines earlier and later (possibly in other blocks).
+        genome_length (int): Length of reference genome.
+        contig_offsets (ContigIndex): Scaffold name -> chr_start, or None
+            if the reference has a single contig.
+
+    """
+    rows=[line.strip().split(b'\t') for line in lines]
+    if any(len(row) < 8 for row in rows):
+        raise ValueError("Pileup line with fewer than 8 columns found")
+    #skip depth 0 lines (all bases failed -Q; '*' in calls and quals): their row of data stays 0
+    if any(row[3] == b'0' for row in rows):
+        kept=[i for i,row in enumerate(rows) if row[3] != b'0']
+        rows=[rows[i] for i in kept]
+        lines=[lines[i] for i in kept]
+        if not rows:
+            return
+    chromos,positions,refs,_,calls_ls,bq_ls,mq_ls,td_ls=list(zip(*rows))[:8]
+    num_lines=len(rows)
+
+    #position (absolute)
+    positions=np.fromiter(map(int,positions),dtype=np.int64,count=num_lines)
+    if contig_offsets is not None:
+        try:
+            positions=genome_positions.names2p(chromos,positions,contig_offsets)
+        except KeyError:
+            raise ValueError("Scaffold name in pileup file not found in reference")
+
+    #ref allele (-1 for cases where reference base is ambiguous)
+    ref=np.fromiter((REF_CODES.get(r,-1) for r in refs),dtype=np.int64,count=num_lines)
+
+    #calls info for all lines, concatenated; line_of gives the line of each character
+    calls_len=np.fromiter(map(len,calls_ls),dtype=np.int64,count=num_lines)
+    calls=np.frombuffer(b''.join(calls_ls),dtype=np.int8).copy() #to ASCII
+    line_end=np.cumsum(calls_len)
+    line_of=np.repeat(np.arange(num_lines,dtype=np.int32),calls_len)
+    removed=np.zeros(len(calls),dtype=bool)
+
+    #find starts of reads ('^' in mpileup) and remove mapping character after them
+    startsk=np.flatnonzero(calls==94)
+    removed[startsk]=True
+    mapk=startsk+1
+    removed[mapk[mapk < line_end[line_of[startsk]]]]=True
+
+    #find ends of reads ('$' in mpileup)
+    removed|=(calls==36)
+
+    #find indels + calls from reads supporting indels ('+-')
+    indelk=np.flatnonzero(((calls==43) | (calls==45)) & ~removed)
+    if len(indelk):
+        indel_line=line_of[indelk]
+        digit1=calls[indelk+1].astype(np.int64)-48
+        k2=np.minimum(indelk+2,len(calls)-1)
+        digit2=np.where((indelk+2 < line_end[indel_line]) & ~removed[k2],calls[k2],-1).astype(np.int64)
+        two_digits=(digit2 >= 48) & (digit2 < 58) #2 digit indel (size > 9 and < 100)
+        indelsize=np.where(two_digits,digit1*10+digit2-48,digit1)
+        indeld=np.where(two_digits,2,1)
+
+        #record that indel was found in +/- indelregion nearby
+        is_deletion=(calls[indelk]==45)
+        start,stop=_indel_regions(positions[indel_line],indelsize,is_deletion,genome_length)
+        col=np.where(is_deletion,1,0)
+        np.add.at(indel_diff,(col,start),1)
+        np.add.at(indel_diff,(col,stop),-1)
+
+        #remove indel info from counting (don't remove base that precedes an indel)
+        stopk=np.minimum(indelk+1+indeld+indelsize,line_end[indel_line])
+        covered=np.bincount(indelk,minlength=len(calls)+1)-np.bincount(stopk,minlength=len(calls)+1)
+        removed|=(np.cumsum(covered[:-1]) > 0)
+
+    #replace reference matches (.,) with their actual calls
+    matchk=np.flatnonzero(((calls==46) | (calls==44)) & ~removed)
+    match_ref=ref[line_of[matchk]]
+    if np.any(match_ref < 0):
+        bad_line=lines[line_of[matchk[np.argmax(match_ref < 0)]]]
+        print( 'Line from mpileup: ' + bad_line.decode() )
+        raise ValueError('Error! Calls at this position allegedly match reference allele even though reference allele was ambiguous.')
+    calls[matchk]=np.where(calls[matchk]==46,REF_UPPER[match_ref],REF_LOWER[match_ref])
+
+    #index reads for finding scores
+    simplek=np.flatnonzero(~removed & (calls > 0))
+    simplecalls=calls[simplek]
+    simple_line=line_of[simplek]
+    #simplecalls is a tform of calls where each calls position
+    #corresponds to its position in bq, mq, td
+
+    #qual info
+    bq=np.frombuffer(b''.join(bq_ls),dtype=np.int8) # base quality, BAQ corrected, ASCII
+    mq=np.frombuffer(b''.join(mq_ls),dtype=np.int8) # mapping quality, ASCII
+    td=np.fromstring(b','.join(t for t in td_ls if t),dtype=np.int64,sep=',') # distance from tail, comma sep
+    reads_per_line=np.bincount(simple_line,minlength=num_lines)
+    td_len=np.fromiter((t.count(b',')+1 if t else 0 for t in td_ls),dtype=np.int64,count=num_lines)
+    for qual_ls,qual_len in ((bq_ls,None),(mq_ls,None),(td_ls,td_len)):
+        if qual_len is None:
+            qual_len=np.fromiter(map(len,qual_ls),dtype=np.int64,count=num_lines)
+        if not np.array_equal(qual_len,reads_per_line):
+            bad_line=lines[np.argmax(qual_len!=reads_per_line)]
+            print( 'Line from mpileup: ' + bad_line.decode() )
+            raise ValueError('Error! Number of calls does not match number of quality scores.')
+
+    #count how many of each nt and average scores
+    ntk=NT_INDEX[simplecalls.view(np.uint8)]
+    is_nt=(ntk >= 0)
+    key=simple_line[is_nt]*8+ntk[is_nt]
+    nt_count=np.bincount(key,minlength=num_lines*8).reshape(num_lines,8).astype(float)
+    has_nt=(nt_count > 0)
+    temp=np.zeros((num_lines,NUM_FIELDS))
+    temp[:,0:8]=nt_count
+    for offset,qual,qual_offset in ((8,bq,PHRED_OFFSET),(16,mq,33),(24,td,0)):
+        qual_sum=np.bincount(key,weights=qual[is_nt],minlength=num_lines*8).reshape(num_lines,8)
+        qual_mean=np.divide(qual_sum,nt_count,out=np.zeros_like(qual_sum),where=has_nt)
+        temp[:,offset:offset+8]=np.where(has_nt,np.round(qual_mean)-qual_offset,0)
+
+    #-1 is needed to turn 1-indexed positions to python 0-indexed
+    #(indel statistics 38/39 are stored from indel_diff once all blocks are parsed)
+    data[positions-1]=ghf.diversity_to_compact(temp)
+
+def _pileup_line_position(line, contig_offsets):
+    """Absolute 1-indexed position of a pileup line"""
+    chromo,position,_=line.split(b'\t',2)
+    if contig_offsets is None:
+        return int(position)
+    if chromo not in contig_offsets:
+        raise ValueError("Scaffold name in pileup file not found in reference")
+    return contig_offsets[chromo]+int(position)
+
+def _region_byte_offset(mpileup, file_size, region_start, contig_offsets):
+    """Byte offset of the first line of a sorted pileup file at or after absolute position region_start+1
+
+    Binary search over byte offsets; the pileup must be sorted in reference
+    order (as output by samtools mpileup on a sorted bam).
+
+    """
+    def next_line_start(offset):
+        if offset == 0:
+            return 0
+        mpileup.seek(offset-1)
+        mpileup.readline()
+        return mpileup.tell()
+    lo,hi=0,file_size
+    while lo < hi:
+        mid=(lo+hi)//2
+        line_start=next_line_start(mid)
+        mpileup.seek(line_start)
+        line=mpileup.readline()
+        if line and _pileup_line_position(line,contig_offsets) <= region_start:
+            lo=mid+1
+        else:
+            hi=mid
+    return next_line_start(lo)
+
+def _pileup_regions(input_pileup, chr_starts, genome_length, contig_offsets, num_regions):
+    """Splits a pileup file into byte ranges covering disjoint regions of the genome
+
+    Region boundaries are the chromosome starts plus evenly spaced positions,
+    so that long contigs are also split.
+
+    Returns:
+        regions (list): (start, end) byte offsets of each non-empty region.
+
+    """
+    boundaries=np.union1d(chr_starts,np.linspace(0,genome_length,num_regions+1).astype(int)[:-1])
+    file_size=os.path.getsize(input_pileup)
+    with open(input_pileup,'rb') as mpileup:
+        offsets=[_region_byte_offset(mpileup,file_size,int(b),contig_offsets) for b in boundaries[1:]]
+    offsets=[0]+offsets+[file_size]
+    return [(start,end) for start,end in zip(offsets[:-1],offsets[1:]) if end > start]
+
+def _iter_line_blocks(mpileup, start, end, block_bytes):
+    """Yields lists of lines from byte range [start, end) of a file, about block_bytes at a time"""
+    mpileup.seek(start)
+    remaining=end-start
+    carry=b''
+    while remaining > 0:
+        chunk=mpileup.read(min(block_bytes,remaining))
+        if not chunk:
+            break
+        remaining-=len(chunk)
+        chunk=carry+chunk
+        cut=chunk.rfind(b'\n')+1 if remaining > 0 else len(chunk)
+        carry=chunk[cut:]
+        lines=chunk[:cut].split(b'\n')
+        if lines[-1] == b'':
+            lines.pop()
+        if lines:
+            yield lines
+
+_worker={} # state of each parallel worker process, set by _init_region_worker
+
+def _init_region_worker(input_pileup, shm_name, genome_length, contig_offsets, block_bytes):
+    """Attaches a pool worker to the shared-memory diversity array"""
+    shm=shared_memory.SharedMemory(name=shm_name)
+    _worker['shm']=shm
+    _worker['data']=np.ndarray((genome_length,),dtype=ghf.DIVERSITY_DTYPE,buffer=shm.buf)
+    _worker['input_pileup']=input_pileup
+    _worker['genome_length']=genome_length
+    _worker['contig_offsets']=contig_offsets
+    _worker['block_bytes']=block_bytes
+
+def _parse_pileup_region(region):
+    """Parses one byte range of the pileup into the shared-memory array
+
+    Rows of a region's positions are only written by its own worker.
+    Indel counts (38/39) can reach into neighbouring regions, so they are
+    returned as a sparse difference array and summed by the parent.
+
+    Returns:
+        indel_idx (arr): Flat indices into the 2 x (genome_length+1) indel difference array.
+        indel_val (arr): Values at indel_idx.
+        num_lines (int): Number of pileup lines parsed.
+
+    """
+    genome_length=_worker['genome_length']
+    indel_diff=np.zeros((2,genome_length+1),dtype=np.int64)
+    num_lines=0
+    with open(_worker['input_pileup'],'rb') as mpileup:
+        for lines in _iter_line_blocks(mpileup,region[0],region[1],_worker['block_bytes']):
+            _parse_pileup_block(lines,_worker['data'],indel_diff,genome_length,_worker['contig_offsets'])
+            num_lines+=len(lines)
+    indel_idx=np.flatnonzero(indel_diff)
+    return indel_idx, indel_diff.ravel()[indel_idx], num_lines
+
+def _pileup2diversity_parallel(input_pileup, chr_starts, genome_length, contig_offsets, block_bytes, threads):
+    """Parses regions of the pileup in a process pool; returns diversity array and indel difference array"""
+    regions=_pileup_regions(input_pileup,chr_starts,genome_length,contig_offsets,threads*4)
+    print(f"Parsing {len(regions)} regions with {threads} processes")
+    indel_diff=np.zeros((2,genome_length+1),dtype=np.int64)
+    shm=shared_memory.SharedMemory(create=True,size=genome_length*ghf.DIVERSITY_DTYPE.itemsize)
+    try:
+        shared_data=np.ndarray((genome_length,),dtype=ghf.DIVERSITY_DTYPE,buffer=shm.buf)
+        shared_data[:]=0
+        with Pool(threads,initializer=_init_region_worker,
+                  initargs=(input_pileup,shm.name,genome_length,contig_offsets,block_bytes)) as pool:
+            for indel_idx,indel_val,num_lines in pool.imap_unordered(_parse_pileup_region,regions):
+                np.add.at(indel_diff.ravel(),indel_idx,indel_val)
+                print('.')
+        data=np.array(shared_data)
+        del shared_data
+    finally:
+        shm.close()
+        shm.unlink()
+    return data, indel_diff
+
+def pileup2diversity_blocks(input_pileup, path_to_ref, block_bytes=BLOCK_BYTES, threads=1):
+    """Block engine for pileup2diversity: same statistics, parsed in large blocks with numpy
+
+    Statistics are returned in compact format (ghf.DIVERSITY_DTYPE); use
+    ghf.compact_to_diversity() for the genome_length x 40 array of pileup2diversity().
+
+    Args:
+        input_pileup (str): Path to input pileup file, or '-' for stdin.
+        path_to_ref (str): Path to reference genome file
+        block_bytes (int): Approximate size of pileup text parsed at once.
+        threads (int): Number of processes; >1 parses regions of the genome
+            in parallel (requires a sorted pileup file, not stdin).
+
+    """
+    #get reference genome + position information
+    chr_starts,genome_length,scaf_names,contig_index = ghf.genomestats(path_to_ref)
+    genome_length=int(genome_length)
+    contig_offsets=None if len(chr_starts) == 1 else contig_index
+
+    #Read in mpileup file
+    print(f"Reading input file: {input_pileup}")
+    if threads > 1:
+        if input_pileup == '-':
+            raise ValueError("Parallel parsing (threads > 1) needs a pileup file, not stdin")
+        data,indel_diff=_pileup2diversity_parallel(input_pileup,chr_starts,genome_length,contig_offsets,block_bytes,threads)
+    else:
+        #init
+        data = np.zeros(genome_length,dtype=ghf.DIVERSITY_DTYPE)
+        indel_diff = np.zeros((2,genome_length+1),dtype=np.int64)
+
+        loading_bar=0
+        with open_pileup(input_pileup,'rb') as mpileup:
+            while True:
+                lines=mpileup.readlines(block_bytes)
+                if not lines:
+                    break
+                _parse_pileup_block(lines,data,indel_diff,genome_length,contig_offsets)
+                for _ in range((loading_bar+len(lines))//50000 - loading_bar//50000):
+                    print('.')
+                loading_bar+=len(lines)
+
+    #indels affect positions earlier and later, possibly in other blocks
+    data['indels']=np.cumsum(indel_diff[:,:-1],axis=1).T
+
+    #calc coverage
+    coverage=ghf.compact_coverage(data)
+
+    return data, coverage
+
 #%%
 if __name__ == "__main__":
     
@@ -201,17 +565,21 @@ if __name__ == "__main__":
         
     parser = argparse.ArgumentParser()
     
-    parser.add_argument('-i', dest='input', type=str, help='Path to input pileup',required=True)
+    parser.add_argument('-i', dest='input', type=str, help="Path to input pileup ('-' for stdin)",required=True)
     parser.add_argument('-r', dest='ref', type=str, help='Path to reference genome',required=True)
-    parser.add_argument('-o', dest='output', type=str, help='Path to output diversity file', required=True)
+    parser.add_argument('-o', dest='output', type=str, help='Path to output diversity file (.npy for memory-mappable compact format, .npz for compressed compact format, otherwise .pickle.gz)', required=True)
     parser.add_argument('-c', dest='coverage', type=str, help='Path to coverage file', required=True)
+    parser.add_argument('--engine', dest='engine', choices=['block','line'], default='block', help='Parse pileup in numpy blocks (default) or line by line')
+    parser.add_argument('--threads', dest='threads', type=int, default=1, help='Number of processes for block engine (default 1)')
     
     args = parser.parse_args()
     
-    diversity_arr, coverage_arr = pileup2diversity(args.input,args.ref)
+    if args.engine == 'block':
+        diversity_arr, coverage_arr = pileup2diversity_blocks(args.input,args.ref,threads=args.threads)
+    else:
+        diversity_arr, coverage_arr = pileup2diversity(args.input,args.ref)
     
-    with gzip.open(args.output, 'wb') as f:
-        pickle.dump(diversity_arr,f)
+    ghf.save_diversity(args.output,diversity_arr)
     
     if args.coverage:
         with gzip.open(args.coverage, 'wb') as f:
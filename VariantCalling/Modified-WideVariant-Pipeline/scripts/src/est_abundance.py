@@ -49,15 +49,36 @@
 #   - Number of reads estimated for that species
 #   - Fraction of total reads in the sample estimated for this species
 #
+#Kmer distribution index:
+#   - A binary index of the kmer distribution file (sorted mapped taxonomy IDs
+#     with the offset/length of their lines) is saved next to it as
+#     <kmer distribution file>.taxidx, and rebuilt when the file changes.
+#     Only the lines of taxonomy IDs in the Kraken report are read and parsed.
+#
+#Batch mode (--batch, --threads):
+#   - Estimates abundances for many Kraken reports (same level/threshold) 
+#     against one loaded kmer distribution, in a pool of processes. 
+#
 #Methods:
 #   - main
+#   - estimate_abundance
+#   - run_batch
 #   - process_kmer_distribution  
+#   - parse_kmer_distribution
+#   - filter_kmer_distribution
+#   - load_kmer_index
 #   - process_kraken_report 
+#   - report_taxids
 #   - check_report_file
 #
 #####################################################################
 import os, sys, argparse
 import operator
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from multiprocessing import Pool
 from time import gmtime
 from time import strftime
 
@@ -83,6 +104,11 @@ class Tree(object):
         assert isinstance(node,Tree)
         self.children.append(node) 
 
+#BrackenError
+#usage: error in the abundance estimation of a Kraken report 
+class BrackenError(Exception):
+    pass
+
 #process_kmer_distribution
 #usage: parses a single line in the kmer distribution file and extracts
 #relevant information for the genomes in this sample
@@ -92,26 +118,171 @@ class Tree(object):
 #   - classification taxonomy ID for this line
 #   - dictionary of genomes/fractions of the genomes mapping to this classification
 def process_kmer_distribution(curr_str, lvl_taxids, map2lvl_taxids):
+    [mapped_taxid, genomes] = parse_kmer_distribution(curr_str)
+    temp_dict = filter_kmer_distribution(genomes, lvl_taxids, map2lvl_taxids)
+    #Error check for relevant classifications 
+    if len(temp_dict) == 0:
+        return [-1,{}]
+    #Return dictionary 
+    return [mapped_taxid, temp_dict]
+
+#parse_kmer_distribution
+#usage: parses a single line in the kmer distribution file (all genomes)
+#returns:
+#   - classification taxonomy ID for this line
+#   - list of (genome taxid, fraction of the genome's kmers mapping to this classification)
+def parse_kmer_distribution(curr_str):
     split_str = curr_str.strip().split('\t')
-    #Parse each genome taxid mapping to m_taxid -- create dictionary instance
-    temp_dict = {}
     mapped_taxid = split_str[0]
+    genomes = []
     for genome_str in split_str[1].split(' '):
         [g_taxid,mkmers,tkmers] = genome_str.split(':')
         mkmers = float(mkmers)
         tkmers = float(tkmers)
-        fraction = mkmers/tkmers
-        #Only include mappings for genomes within this sample
+        genomes.append((g_taxid, mkmers/tkmers))
+    return [mapped_taxid, genomes]
+
+#filter_kmer_distribution
+#usage: dictionary of genomes/fractions of a parsed line, only including
+#mappings for genomes within this sample
+def filter_kmer_distribution(genomes, lvl_taxids, map2lvl_taxids):
+    temp_dict = {}
+    for g_taxid, fraction in genomes:
         if g_taxid in lvl_taxids or g_taxid in map2lvl_taxids:
             if g_taxid not in temp_dict:
                 temp_dict[g_taxid] = [fraction]
             else:
                 temp_dict[g_taxid].append(fraction)
-    #Error check for relevant classifications 
-    if len(temp_dict) == 0:
-        return [-1,{}]
-    #Return dictionary 
-    return [mapped_taxid, temp_dict]
+    return temp_dict
+
+#Kmer distribution index file: header (magic, size and mtime of the kmer
+#distribution file, number of lines) followed by the arrays of mapped taxids
+#(sorted), line offsets and line lengths
+KMER_INDEX_SUFFIX = '.taxidx'
+KMER_INDEX_MAGIC = b'BRKNIDX1'
+KMER_INDEX_HEADER = struct.Struct('<8sQQQ')
+
+#build_kmer_index
+#usage: reads the kmer distribution file once and returns its index
+#   (mapped taxids sorted; lines of a taxid stay in file order)
+def build_kmer_index(kmer_distr):
+    taxids = array('Q')
+    offsets = array('Q')
+    lengths = array('Q')
+    k_file = open(kmer_distr, 'rb')
+    #Skip header line
+    offset = len(k_file.readline())
+    for line in k_file:
+        tab = line.find(b'\t')
+        try:
+            taxid = int(line[:tab])
+        except ValueError:
+            tab = -1
+        if tab > 0:
+            taxids.append(taxid)
+            offsets.append(offset)
+            lengths.append(len(line))
+        offset += len(line)
+    k_file.close()
+    order = sorted(range(len(taxids)), key=taxids.__getitem__)
+    return [array('Q', (taxids[i] for i in order)),
+        array('Q', (offsets[i] for i in order)),
+        array('Q', (lengths[i] for i in order))]
+
+#read_kmer_index
+#usage: returns the saved index of the kmer distribution file, or None if
+#missing, unreadable or made from a different version of the file
+def read_kmer_index(index_file, source_stat):
+    try:
+        i_file = open(index_file, 'rb')
+        try:
+            [magic, size, mtime_ns, n] = KMER_INDEX_HEADER.unpack(i_file.read(KMER_INDEX_HEADER.size))
+            if magic != KMER_INDEX_MAGIC or size != source_stat.st_size or mtime_ns != source_stat.st_mtime_ns:
+                return None
+            index = [array('Q'), array('Q'), array('Q')]
+            for values in index:
+                values.fromfile(i_file, n)
+            return index
+        finally:
+            i_file.close()
+    except (OSError, EOFError, struct.error):
+        return None
+
+#write_kmer_index
+#usage: saves the index under a temporary name and renames it; the index is
+#only a cache, so it is not saved if the directory is not writable
+def write_kmer_index(index_file, source_stat, index):
+    tmp_file = index_file + '.%i.tmp' % os.getpid()
+    try:
+        i_file = open(tmp_file, 'wb')
+        i_file.write(KMER_INDEX_HEADER.pack(KMER_INDEX_MAGIC, source_stat.st_size, source_stat.st_mtime_ns, len(index[0])))
+        for values in index:
+            values.tofile(i_file)
+        i_file.close()
+        os.replace(tmp_file, index_file)
+    except OSError:
+        sys.stderr.write("\tWARNING: could not save kmer distribution index %s\n" % index_file)
+
+#load_kmer_index
+#usage: returns index of the kmer distribution file: saved index if up to date,
+#otherwise built (and saved)
+def load_kmer_index(kmer_distr):
+    index_file = kmer_distr + KMER_INDEX_SUFFIX
+    source_stat = os.stat(kmer_distr)
+    index = read_kmer_index(index_file, source_stat)
+    if index is None:
+        sys.stderr.write(">> Indexing kmer distribution file: %s\n" % kmer_distr)
+        index = build_kmer_index(kmer_distr)
+        write_kmer_index(index_file, source_stat, index)
+    return index
+
+#KmerDistribution class
+#usage: kmer distribution file read through its taxid index; parsed lines
+#   are kept, so that several reports can use the same loaded distribution
+class KmerDistribution(object):
+    'Indexed kmer distribution file.'
+    def __init__(self, kmer_distr):
+        self.kmer_distr = kmer_distr
+        [self.taxids, self.offsets, self.lengths] = load_kmer_index(kmer_distr)
+        self.lines = {}
+
+    def load(self, taxids):
+        'Reads and parses the lines of the given mapped taxids not loaded yet.'
+        positions = []
+        for taxid in taxids:
+            try:
+                key = int(taxid)
+            except ValueError:
+                continue
+            if key in self.lines:
+                continue
+            self.lines[key] = []
+            positions.extend(range(bisect_left(self.taxids, key), bisect_right(self.taxids, key)))
+        #Read lines in file order
+        positions.sort(key=self.offsets.__getitem__)
+        k_file = open(self.kmer_distr, 'rb')
+        for i in positions:
+            k_file.seek(self.offsets[i])
+            line = k_file.read(self.lengths[i]).decode()
+            self.lines[self.taxids[i]].append(parse_kmer_distribution(line))
+        k_file.close()
+
+    def mapping(self, taxids, lvl_taxids, map2lvl_taxids):
+        'Dictionary of mapped taxid -> genomes/fractions within this sample, for the given taxids.'
+        taxids = list(dict.fromkeys(taxids))
+        self.load(taxids)
+        kmer_distr_dict = {}
+        for taxid in taxids:
+            try:
+                key = int(taxid)
+            except ValueError:
+                continue
+            for [mapped_taxid, genomes] in self.lines[key]:
+                mapped_taxid_dict = filter_kmer_distribution(genomes, lvl_taxids, map2lvl_taxids)
+                if len(mapped_taxid_dict) == 0:
+                    continue
+                kmer_distr_dict[mapped_taxid] = mapped_taxid_dict
+        return kmer_distr_dict
 
 #process_kraken_report
 #usage: parses a single line in the kraken report and extracts relevant information
@@ -153,6 +324,19 @@ def process_kraken_report(curr_str):
     #Determine which level based on number of spaces
     level_num = int(spaces/2)
     return [name, taxid, level_num, level_type, all_reads, level_reads]
+
+#report_taxids
+#usage: taxonomy IDs of all classifications in a kraken report file
+def report_taxids(in_file):
+    taxids = []
+    i_file = open(in_file, 'r')
+    for line in i_file:
+        report_vals = process_kraken_report(line)
+        if len(report_vals) < 5:
+            continue
+        taxids.append(report_vals[1])
+    i_file.close()
+    return taxids
     
 #check_report_file
 #usage: checks the format of the report file. 
@@ -178,31 +362,14 @@ def check_report_file(in_file):
     r_file.close() 
     return(0)
     
-#Main method 
-def main():
-    #Parse arguments
-    parser = argparse.ArgumentParser() 
-    parser.add_argument('-i' ,'--input', dest='in_file', required=True,
-        help='Input kraken report file.')
-    parser.add_argument('-k', '--kmer_distr', dest='kmer_distr', required=True,
-        help='Kmer distribution file.')
-    parser.add_argument('-o', '--output', dest='output', required=True,
-        help='Output modified kraken report file with abundance estimates')
-    parser.add_argument('-l', '--level', dest='level', required=False,
-        default='S',
-        #choices=['D','P','C','O','F','G','S'],
-        help='Level to push all reads to [default: S].')
-    parser.add_argument('--out-report', dest='report_new', required=False,
-        default='',
-        help='Name of new kraken report [default: same as input report with \
-        _bracken added to filename]')
-    parser.add_argument('-t', '--thresh','--threshold',dest='thresh', 
-        required=False,default=10,
-        help='Threshold for the minimum number of reads kraken must assign\
-        to a classification for that classification to be considered in the\
-        final abundance estimation.') 
-    args=parser.parse_args()
-    
+#estimate_abundance
+#usage: estimates abundances for one kraken report and writes the abundance
+#output and the new kraken report
+#input: 
+#   - args: in_file, output, level, thresh and report_new (as parsed by main)
+#   - kmer_distribution: KmerDistribution of the kmer distribution file
+#   - check: check the format of the report file first
+def estimate_abundance(args, kmer_distribution, check=True):
     #Start program 
     time = strftime("%m-%d-%Y %H:%M:%S", gmtime())
     sys.stdout.write("PROGRAM START TIME: " + time + '\n')
@@ -238,7 +405,8 @@ def main():
     leaf_nodes = []
 
     #Error Check
-    check_report_file(args.in_file) 
+    if check:
+        check_report_file(args.in_file) 
 
     #Parse kraken report file /and create tree 
     i_file = open(args.in_file, 'r')
@@ -246,13 +414,14 @@ def main():
     lvl_taxids = {} 
     last_taxid = -1
     u_reads = 0
+    taxids = []
     for line in i_file:
-        print(line)
         report_vals = process_kraken_report(line)
         if len(report_vals) < 5:
             continue
         [name, taxid, level_num, level_id, all_reads, level_reads] = report_vals
         total_reads += level_reads
+        taxids.append(taxid)
         #Skip unclassified 
         if level_id == 'U':
             unclassified_line = line
@@ -312,23 +481,16 @@ def main():
     #Add last node
     leaf_nodes.append(prev_node)
     
-    #Read in kmer distribution file
-    k_file = open(args.kmer_distr,'r')
-    kmer_distr_dict = {}
-    for line in k_file.readlines()[1:]:
-        [mapped_taxid, mapped_taxid_dict] = process_kmer_distribution(line,lvl_taxids,map2lvl_taxids)
-        if len(mapped_taxid_dict) == 0:
-            continue
-        kmer_distr_dict[mapped_taxid] = mapped_taxid_dict
-    k_file.close() 
+    #Read in kmer distribution of the classifications in this report
+    kmer_distr_dict = kmer_distribution.mapping(taxids, lvl_taxids, map2lvl_taxids)
 
     #For each node, distribute level reads to genomes
-    curr_nodes = [root_node]
+    curr_nodes = deque([root_node])
     nondistributed_reads = 0
     distributed_reads = 0
     lvl_reads = 0
     while len(curr_nodes) > 0:
-        curr_node = curr_nodes.pop(0)
+        curr_node = curr_nodes.popleft()
         #For each child node, add to list of nodes to evaluate 
         if not isinstance(curr_node,Tree):
             continue 
@@ -402,8 +564,7 @@ def main():
         sum_all_reads += new_all_reads
 
     if sum_all_reads == 0:
-        sys.stderr.write("Error: no reads found. Please check your Kraken report\n")
-        exit(1) 
+        raise BrackenError("no reads found. Please check your Kraken report %s" % args.in_file)
     #Print for each classification level: 
     #   - name, taxonomy ID, taxonomy level
     #   - kraken assigned reads, added reads, estimated reads, and fraction total reads 
@@ -496,15 +657,15 @@ def main():
     #r_file.write("%i\t" % u_reads)
     #r_file.write("U\t0\tunclassified\n")
     #For each current parent node, print to file 
-    curr_nodes = [root_node]
+    curr_nodes = deque([root_node])
     while len(curr_nodes) > 0:
-        curr_node = curr_nodes.pop(0)
+        curr_node = curr_nodes.popleft()
         #For each child node, add to list of nodes to evaluate 
         children = 0
         for child_node in sorted(curr_node.children, key=operator.attrgetter('all_reads')):
             #Add if at level or above 
             if child_node.level_id[0] != args.level or child_node.level_id == args.level:
-                curr_nodes.insert(0,child_node) 
+                curr_nodes.appendleft(child_node) 
                 children += 1
         #Print information for this level 
         #For level where estimate is made
@@ -526,5 +687,108 @@ def main():
     r_file.close() 
     ###########################################################################
 
+#Main method 
+def main():
+    #Parse arguments
+    parser = argparse.ArgumentParser() 
+    parser.add_argument('-i' ,'--input', dest='in_file', required=False,
+        help='Input kraken report file.')
+    parser.add_argument('-k', '--kmer_distr', dest='kmer_distr', required=True,
+        help='Kmer distribution file.')
+    parser.add_argument('-o', '--output', dest='output', required=False,
+        help='Output modified kraken report file with abundance estimates')
+    parser.add_argument('-l', '--level', dest='level', required=False,
+        default='S',
+        #choices=['D','P','C','O','F','G','S'],
+        help='Level to push all reads to [default: S].')
+    parser.add_argument('--out-report', dest='report_new', required=False,
+        default='',
+        help='Name of new kraken report [default: same as input report with \
+        _bracken added to filename]')
+    parser.add_argument('-t', '--thresh','--threshold',dest='thresh', 
+        required=False,default=10,
+        help='Threshold for the minimum number of reads kraken must assign\
+        to a classification for that classification to be considered in the\
+        final abundance estimation.') 
+    parser.add_argument('--batch', dest='batch', required=False,
+        default='',
+        help='Tab-delimited file of kraken reports to estimate against the same\
+        kmer distribution, one per line: input report, output file and\
+        (optional) new kraken report. Replaces -i/-o/--out-report.')
+    parser.add_argument('--threads', dest='threads', required=False,
+        default=1, type=int,
+        help='Number of processes for --batch [default: 1].')
+    args=parser.parse_args()
+    if args.batch == '' and (args.in_file is None or args.output is None):
+        parser.error('-i/--input and -o/--output are required (or --batch)')
+
+    #Batch of kraken reports
+    if args.batch != '':
+        exit(run_batch(args))
+
+    #Single kraken report
+    kmer_distribution = KmerDistribution(args.kmer_distr)
+    try:
+        estimate_abundance(args, kmer_distribution)
+    except BrackenError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        exit(1)
+
+#run_batch
+#usage: estimates abundances for all kraken reports of the batch file in a
+#pool of processes, all using one loaded kmer distribution
+#returns: 0 if all reports were processed, 1 otherwise
+def run_batch(args):
+    entries = []
+    b_file = open(args.batch, 'r')
+    for line in b_file:
+        split_str = line.strip().split('\t')
+        if len(split_str) < 2 or split_str[0] == '':
+            continue
+        report_new = split_str[2] if len(split_str) > 2 else ''
+        entries.append(argparse.Namespace(in_file=split_str[0], output=split_str[1],
+            report_new=report_new, level=args.level, thresh=args.thresh))
+    b_file.close()
+
+    #Error Check (before starting workers)
+    taxids = []
+    for entry in entries:
+        check_report_file(entry.in_file)
+        taxids.extend(report_taxids(entry.in_file))
+
+    #Load kmer distribution of all classifications in the batch once
+    kmer_distribution = KmerDistribution(args.kmer_distr)
+    kmer_distribution.load(dict.fromkeys(taxids))
+
+    pool = Pool(args.threads, initializer=init_batch_worker, initargs=(kmer_distribution,))
+    errors = pool.map(run_batch_entry, entries, chunksize=1)
+    pool.close()
+    pool.join()
+
+    failed = 0
+    for error in errors:
+        if error is not None:
+            sys.stderr.write("Error: %s\n" % error)
+            failed += 1
+    sys.stdout.write("BRACKEN BATCH: %i of %i reports processed\n" % (len(entries)-failed, len(entries)))
+    return 1 if failed > 0 else 0
+
+_kmer_distribution = None
+
+def init_batch_worker(kmer_distribution):
+    global _kmer_distribution
+    _kmer_distribution = kmer_distribution
+
+def run_batch_entry(entry):
+    try:
+        estimate_abundance(entry, _kmer_distribution, check=False)
+    except BrackenError as e:
+        return str(e)
+    except Exception as e:
+        #any other error (e.g. unwritable output) only fails this report
+        return "%s: %s: %s" % (entry.in_file, type(e).__name__, e)
+    return None
+    
+
 if __name__ == "__main__":
     main()
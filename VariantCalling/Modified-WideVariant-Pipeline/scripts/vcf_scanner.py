@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Block-wise VCF scanner shared by vcf2quals_snakemake.py and variants2positions.py
+
+Decodes a (gzipped) single-sample bcftools VCF in blocks of lines and finds
+the columns of all records of a block at once with numpy (tab and newline
+positions), so simple SNP calls (REF and ALT a single base) are filtered and
+their FQ scores parsed without a python loop over lines.
+
+Run as a script, it writes both the quals vector and the candidate positions
+of a sample from a single read of its strain VCF.
+"""
+import numpy as np
+import gzip
+import argparse
+import gus_helper_functions as ghf
+import genome_positions
+
+BLOCK_BYTES=16*1024**2 # approximate size of blocks of lines (bytes)
+NUM_COLUMNS=10 # CHROM POS ID REF ALT QUAL FILTER INFO FORMAT sample
+
+#%%
+def iter_vcf_blocks(path_to_vcf, block_bytes=BLOCK_BYTES):
+    '''Yields blocks of complete record lines (uint8 arrays ending in a newline), header lines skipped'''
+    opener = gzip.open if path_to_vcf.endswith('.gz') else open
+    with opener(path_to_vcf,'rb') as f:
+        line=f.readline()
+        while line.startswith(b'#'):
+            line=f.readline()
+        remainder=line
+        while True:
+            chunk=f.read(block_bytes)
+            block=remainder+chunk
+            if not chunk:
+                if block and not block.endswith(b'\n'):
+                    block+=b'\n'
+                if block:
+                    yield np.frombuffer(block,dtype=np.uint8)
+                return
+            end=block.rfind(b'\n')+1
+            remainder=block[end:]
+            if end:
+                yield np.frombuffer(block[:end],dtype=np.uint8)
+
+def _field_strings(buf, start, end):
+    '''Bytes buf[start[i]:end[i]] of every record as a fixed-width bytes array'''
+    width=max(int(np.max(end-start)),1)
+    idx=start[:,None]+np.arange(width)
+    inside=idx<end[:,None]
+    chars=np.where(inside,buf[np.minimum(idx,len(buf)-1)],0).astype(np.uint8)
+    return np.ascontiguousarray(chars).view(f'S{width}').ravel()
+
+def _info_value(buf, line_start, info_start, info_end, key):
+    '''Value of key (e.g. b'FQ') in the INFO field of every record as bytes; b'' where absent'''
+    pattern=np.frombuffer(key+b'=',dtype=np.uint8)
+    hits=np.ones(len(buf)-len(pattern)+1,dtype=bool)
+    for k,c in enumerate(pattern):
+        hits&=buf[k:len(buf)-len(pattern)+1+k]==c
+    hits=np.flatnonzero(hits)
+    # key must start an INFO entry
+    hits=hits[(buf[hits-1]==ord(';'))|(buf[hits-1]==ord('\t'))]
+    record=np.searchsorted(line_start,hits,side='right')-1
+    hits,record=hits[record>=0],record[record>=0]
+    in_info=(hits>=info_start[record])&(hits<info_end[record])
+    hits,record=hits[in_info],record[in_info]
+    first=np.unique(record,return_index=True)[1] # first entry with key in each record
+    hits,record=hits[first],record[first]
+    value_start=np.array(info_end) # empty value where key is absent
+    value_start[record]=hits+len(pattern)
+    # value ends at next ';' or end of INFO field
+    semicolons=np.flatnonzero(buf==ord(';'))
+    next_semicolon=np.searchsorted(semicolons,value_start)
+    value_end=np.where(next_semicolon<len(semicolons),semicolons[np.minimum(next_semicolon,len(semicolons)-1)],info_end)
+    value_end=np.minimum(value_end,info_end)
+    return _field_strings(buf,value_start,value_end)
+
+def _nonref_genotype(buf, gt_start, line_end):
+    '''Whether the genotype (first FORMAT field of the sample) of every record has a non-reference allele'''
+    width=8
+    idx=gt_start[:,None]+np.arange(width)
+    chars=np.where(idx<line_end[:,None],buf[np.minimum(idx,len(buf)-1)],0)
+    in_gt=np.cumsum((chars==ord(':'))|(chars==ord('\t'))|(chars==0),axis=1)==0
+    return np.any(in_gt&(chars>=ord('1'))&(chars<=ord('9')),axis=1)
+
+def scan_vcf_block(buf, contig_index, genome_length, variants_only=False):
+    '''Genome positions and FQ scores of the simple calls in one block of VCF records
+
+    Args:
+        buf (arr): uint8 array of complete VCF record lines.
+        contig_index (ghf.ContigIndex): Offsets of contigs in genome.
+        genome_length (int): Length of genome.
+        variants_only (bool): Also flag SNPs with a non-reference genotype, the
+            calls bcftools view -v snps -q .1 keeps from a single-sample VCF.
+
+    Returns:
+        positions (arr): 1-indexed positions on genome of simple calls.
+        fq (arr): FQ scores of simple calls.
+        variant (arr): Whether each simple call is a variant (None if not variants_only).
+    '''
+    newlines=np.flatnonzero(buf==ord('\n'))
+    line_start=np.concatenate(([0],newlines[:-1]+1))
+    tabs=np.flatnonzero(buf==ord('\t'))
+    first_tab=np.searchsorted(tabs,line_start)
+    column_tab=first_tab[:,None]+np.arange(NUM_COLUMNS-1)
+    if len(tabs)==0 or np.any(column_tab>=len(tabs)) or np.any(tabs[np.minimum(column_tab[:,-1],len(tabs)-1)]>newlines):
+        raise ValueError("VCF records with fewer than 10 columns found")
+    col_end=tabs[column_tab] # end of CHROM, POS, ... FORMAT
+    # only consider simple calls (not indel, not ambiguous)
+    simple=((col_end[:,3]-col_end[:,2])==2)&((col_end[:,4]-col_end[:,3])==2)
+    line_start,newlines,col_end=line_start[simple],newlines[simple],col_end[simple]
+    variant=None
+    if variants_only:
+        variant=(buf[col_end[:,3]+1]!=ord('.'))&_nonref_genotype(buf,col_end[:,8]+1,newlines)
+    if not len(line_start):
+        return np.zeros(0,dtype=np.int64),np.zeros(0),variant
+
+    position_on_chr=_field_strings(buf,col_end[:,0]+1,col_end[:,1]).astype(np.int64)
+    if contig_index.single_contig:
+        positions=position_on_chr
+    else:
+        try:
+            positions=genome_positions.names2p(_field_strings(buf,line_start,col_end[:,0]),position_on_chr,contig_index)
+        except KeyError:
+            raise ValueError("Scaffold name in vcf file not found in reference")
+    if np.any((positions<1)|(positions>genome_length)):
+        raise ValueError("Position in vcf file outside of reference genome")
+
+    fq=_info_value(buf,line_start,col_end[:,6]+1,col_end[:,7],b'FQ')
+    if np.any(fq==b''):
+        raise ValueError("Simple call without FQ score in vcf file")
+    return positions,fq.astype(np.float64),variant
+
+def scan_vcf(path_to_vcf, contig_index, genome_length, maxFQ=None, variants_only=False, block_bytes=BLOCK_BYTES, collect_quals=True):
+    '''Quals and positions passing an FQ threshold from one read of a vcf file
+
+    Args:
+        path_to_vcf (str): Path to .vcf(.gz) file.
+        contig_index (ghf.ContigIndex): Offsets of contigs in genome.
+        genome_length (int): Length of genome.
+        maxFQ (float): Purity threshold for including position. If None, no positions are collected.
+        variants_only (bool): Only collect positions of SNPs with a non-reference genotype.
+            Needed when scanning a strain vcf instead of the .variant.vcf.gz.
+        block_bytes (int): Approximate number of bytes decoded at once.
+        collect_quals (bool): Whether to build the quals vector.
+
+    Returns:
+        quals (arr): genome_length x 1 FQ score of each position (most negative, rounded; 0 if none). None if not collect_quals.
+        include (arr): Sorted 1-indexed positions with a simple call better than maxFQ (None if maxFQ is None).
+    '''
+    quals=np.zeros((genome_length,1),dtype=int) if collect_quals else None
+    include=[] if maxFQ is not None else None
+    for buf in iter_vcf_blocks(path_to_vcf,block_bytes):
+        positions,fq,variant=scan_vcf_block(buf,contig_index,genome_length,variants_only)
+        if collect_quals:
+            scored=~np.isnan(fq)
+            # more negative is stronger; np.round matches python round (and matlab behavior)
+            np.minimum.at(quals[:,0],positions[scored]-1,np.round(fq[scored]).astype(int))
+        if maxFQ is not None:
+            passing=(fq<maxFQ)&variant if variants_only else fq<maxFQ
+            include.append(positions[passing])
+    if maxFQ is not None:
+        # only passing positions are kept, not a genome_length vector
+        include=np.unique(np.concatenate(include)) if include else np.zeros(0,dtype=np.int64)
+    return quals,include
+
+#%%
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Quals file and candidate positions file of a sample from a single read of its strain vcf')
+
+    parser.add_argument('-i', type=str, help='Path to input strain vcf file (all sites)',required=True)
+    parser.add_argument('-r', type=str, help='Path to reference genome directory',required=True)
+    parser.add_argument('-o', type=str, help='Path to output quals file (.npy for memory-mappable file, otherwise .pickle.gz)', required=True)
+    parser.add_argument('-p', type=str, help='Path to output positions file (.npy for sorted uint32 positions, otherwise .pickle.gz)', required=True)
+    parser.add_argument('-b', type=int, help='Outgroup boolean', required=True)
+    parser.add_argument('-q', type=int, help='MaxFQ threshold', required=True)
+
+    args = parser.parse_args()
+
+    [chr_starts,genome_length,scaf_names,contig_index] = ghf.genomestats(args.r)
+    print(f"Loaded: {args.i}")
+    print(f"FQ threshold: {int(args.q)}")
+    quals,include=scan_vcf(args.i,contig_index,genome_length,maxFQ=args.q,variants_only=True)
+
+    ghf.save_quals(args.o,quals)
+    print(f"Saved: {args.o}")
+
+    if args.b:
+        # outgroup samples contribute no positions
+        include=np.zeros(0,dtype=np.int64)
+        print("Outgroup sample - no positions collected")
+    ghf.save_positions(args.p,include,chr_starts)
+    if not args.b:
+        print(f"{len(include)} variable positions found passing quality threshold")
@@ -18,16 +18,17 @@ def get_base_at_position(fasta_file, position):
 
 def obtain_ref(cmtfile, ref_dir):
     """
-    Obtain reference genome as string. 
+    Obtain reference genome as uint8 array (ASCII bases). 
     For mapping with SNP pos in cmt df later to obtain ref base. 
+        - Contigs are concatenated in fasta order, as positions in cmt are 
+          on the concatenated genome. 
     """
     group = cmtfile.stem.split('_')[1]
     group_ref_path = f'{ref_dir}/{group}/genome.fasta'
 
-    for record in SeqIO.parse(group_ref_path, "fasta"):
-        ref_genome_sequence = record.seq
+    ref_genome_sequence = b''.join(bytes(record.seq) for record in SeqIO.parse(group_ref_path, "fasta"))
 
-    return ref_genome_sequence 
+    return np.frombuffer(ref_genome_sequence, dtype=np.uint8)
 
 
 
@@ -35,46 +36,58 @@ def import_cmt(fpath, ref_genome):
     """
     Import unfiltered cmt data from WideVariant pipeline. 
     Add ref base to cmt. 
+        - One row per sample and position (sample-major), built with numpy 
+          from counts (samples x positions x 8) without per-sample DataFrames. 
     """
     data = {}
     # obtain data from npx cmy file 
-    f = np.load(fpath)  # load np file
-    data_groups = list(f.keys())  # list of names of files 
-    for data_group in data_groups:
-        data[data_group] = f[data_group]
-    f.close()
+    with np.load(fpath) as f:  # load np file
+        for data_group in ['sample_names', 'p', 'quals', 'counts']:
+            data[data_group] = f[data_group]
+
+    num_samples, num_pos, num_nts = data['counts'].shape
+    counts = data['counts'].reshape(num_samples * num_pos, num_nts)  # A,T,C,G,a,t,c,g
+    positions = np.tile(data['p'], num_samples)
 
     # load data into pandas df
-    dfs = []
-    for index, sname in enumerate(data['sample_names']):
-        A,T,C,G,a,t,c,g = data['counts'][index].T
-        cov = data['counts'][index].sum(axis=1)
-        df = pd.DataFrame(data=[
-            data['p'],
-            abs(data['quals'][index]),
-            cov,
-            A,T,C,G,a,t,c,g,
-        ]).T
-        df.columns = ['position', 'qual','coverage', 'A','T','C','G','a','t','c','g']
-        df['sample'] = sname
-        dfs.append(df)
-
-    df = pd.concat(dfs)
-
-    # maps reference to position 
-    def get_base_at_position(position):
-        return ref_genome[position - 1]  # Convert 1-based to 0-based index
-
-    df['ref'] = df['position'].apply(get_base_at_position)
+    df = pd.DataFrame({
+        'position': positions, 
+        'qual': np.abs(data['quals']).reshape(-1), 
+        'coverage': counts.sum(axis=1), 
+    })
+    for index, nt in enumerate(['A','T','C','G','a','t','c','g']):
+        df[nt] = counts[:, index]
+    df['sample'] = np.repeat(data['sample_names'], num_pos)
+
+    # maps reference to position: 1-based to 0-based index into genome array 
+    df['ref'] = ref_genome[positions - 1].view('S1').astype(str)
 
     return df
 
 
+def write_cmt_df(df, out_prefix, formats):
+    """
+    Write long-form cmt df as {out_prefix}.tsv / .parquet / .feather. 
+        - parquet and feather need pyarrow. 
+    """
+    for fmt in formats:
+        df_out = f"{out_prefix}.{fmt}"
+        if fmt == 'tsv':
+            df.to_csv(df_out, sep='\t', index=False)
+        elif fmt == 'parquet':
+            df.to_parquet(df_out, index=False)
+        elif fmt == 'feather':
+            df.to_feather(df_out)
+        else:
+            raise ValueError(f"Unknown output format: {fmt}")
+
+
 def main():
     ### Paths ### 
     cmt_dir = Path("../Modified-WideVariant-Pipeline/2-Case/candidate_mutation_table")  # path to snakemake cmt result 
     ref_dir = "../1-run-WV/ref_genome"
     outdir = Path("output")
+    out_formats = ['tsv']  # any of 'tsv', 'parquet', 'feather'
     outdir.mkdir(parents=True, exist_ok=True)
 
     ### Process cmt file ### 
@@ -86,8 +99,7 @@ def main():
 
         df = import_cmt(cmtfile, ref_genome)
 
-        df_out = f"{outdir}/{fname}_all_calls_cmt.tsv"
-        df.to_csv(df_out, sep='\t', index=False)
+        write_cmt_df(df, f"{outdir}/{fname}_all_calls_cmt", out_formats)
 
 
 if __name__ == "__main__":
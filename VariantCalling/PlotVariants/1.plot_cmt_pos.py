@@ -3,9 +3,16 @@ Purpose: plot all positions in cmt table.
     - Note: these positions are from variant calling, have not been filtered. 
 """
 import yaml
+import numpy as np
 import pandas as pd 
 from pathlib import Path 
+from multiprocessing import Pool
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+PNG_OUTDIR = 'data/1.position_barplots/png'
+SVG_OUTDIR = 'data/1.position_barplots/svg'
+BATCH_SIZE = 16  # positions per task sent to a plotting process
 
 def load_yaml(yaml_path):
     """
@@ -80,57 +87,102 @@ def import_cmt_df(fpath):
 
     return df 
 
-def plot_bar_position(df, position):
+def make_bar_template(samples):
     """
-    For position df (base count for 1 position), plot count of each base 
-    in the forward and reverse direction, then save plot. 
+    Build figure with empty stacked bars (fwd A C G T, rev a c g t) for samples. 
+        - Same layout as pandas df.plot(kind='bar', stacked=True, width=0.4) 
+          with position=1 (fwd) and position=0 (rev). 
+        - Reused for every position with these samples: only bar heights, 
+          title and legend change. 
     """
-    # split into 2 df - fwd and rev count 
-    fwd_counts = df[['sample', 'A', 'C', 'G', 'T']].set_index('sample').fillna(0)
-    rev_counts = df[['sample', 'a', 'c', 'g', 't']].set_index('sample').fillna(0)
+    num_samples = len(samples)
+    ticks = np.arange(num_samples)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color'][:4]
+
+    fig = Figure(figsize=(7, 5))
+    ax = fig.add_subplot()
+    fwd_bars = [ax.bar(ticks - 0.2, np.zeros(num_samples), width=0.4, color=color) for color in colors]
+    rev_bars = [ax.bar(ticks + 0.2, np.zeros(num_samples), width=0.4, color=color) for color in colors]
 
-    # plotting 
-    fig, ax = plt.subplots(figsize=(7, 5))
-    fwd_counts.plot(kind='bar', stacked=True, width=0.4, ax=ax, position=1)
-    rev_counts.plot(kind='bar', stacked=True, width=0.4, ax=ax, position=0, legend=None)
+    # x axis as set by pandas for the last (rev) bar plot
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(samples, rotation=90)
+    ax.set_xlim(-0.25, num_samples - 1 + 0.65)
 
     # axes labels
-    ax.set_title(f'Base count per sample for position {position}')
     ax.set_ylabel('Read Count')
     ax.set_xlabel('Sample')
 
-    # bold reference on legend 
-    ref_base = str(df['ref'].iloc[0])
-    legend_dict={'A':'A', 'C':'C', 'G':'G', 'T':'T'}
-    legend_list=[]  # list of legend texts to be plotted 
-    legend_dict[ref_base]=r'$\bf{{letter}}$'.replace('letter', ref_base)  # latex formatting for bolded reference 
-    for key, value in legend_dict.items():
-        legend_list.append(value)
-    ax.legend(legend_list, loc='upper left')
+    return {'fig': fig, 'ax': ax, 'fwd': fwd_bars, 'rev': rev_bars}
 
-    # save plot 
-    plt.tight_layout()
-    png_outdir = f'data/1.position_barplots/png'
-    svg_outdir = f'data/1.position_barplots/svg'
+def set_stacked_heights(bars, counts):
+    """
+    Set heights of stacked bars (one container per base) to counts (samples x bases). 
+    """
+    bottoms = np.cumsum(counts, axis=1) - counts
+    for base, container in enumerate(bars):
+        for rect, height, bottom in zip(container.patches, counts[:, base], bottoms[:, base]):
+            rect.set_y(bottom)
+            rect.set_height(height)
+
+def plot_bar_position(template, position, ref_base, fwd_counts, rev_counts):
+    """
+    For one position, plot count of each base (samples x 4 arrays) 
+    in the forward and reverse direction on template, then save plot. 
+    """
+    ax = template['ax']
+    set_stacked_heights(template['fwd'], fwd_counts)
+    set_stacked_heights(template['rev'], rev_counts)
+    ax.relim()
+    ax.autoscale_view(scalex=False)
+
+    ax.set_title(f'Base count per sample for position {position}')
 
-    Path(png_outdir).mkdir(parents=True, exist_ok=True)
-    Path(svg_outdir).mkdir(parents=True, exist_ok=True)
+    # bold reference on legend 
+    legend_list = [r'$\bf{{letter}}$'.replace('letter', base) if base == ref_base else base for base in 'ACGT']
+    ax.legend(template['fwd'], legend_list, loc='upper left')
 
-    plt.savefig(f'{png_outdir}/{position}.png')
-    plt.savefig(f'{svg_outdir}/{position}.svg')
+    # save plot 
+    template['fig'].tight_layout()
+    template['fig'].savefig(f'{PNG_OUTDIR}/{position}.png')
+    template['fig'].savefig(f'{SVG_OUTDIR}/{position}.svg')
 
-    plt.close()   # clear plot 
+_templates = {}  # bar plot template per tuple of samples, in each worker process
 
+def plot_position_batch(batch):
+    """
+    Plot a batch of positions, reusing one template per set of samples. 
+    """
+    for position, samples, ref_base, fwd_counts, rev_counts in batch:
+        if samples not in _templates:
+            _templates[samples] = make_bar_template(samples)
+        plot_bar_position(_templates[samples], position, ref_base, fwd_counts, rev_counts)
+    return len(batch)
 
-def plot_bars(df):
+def plot_bars(df, processes=None, batch_size=BATCH_SIZE):
     """
     For each position in each dataset, plot base calls for all samples. 
+        - Positions are plotted in batches across a pool of processes 
+          (processes=None uses all cores). 
     """
-    # group by position and plot base call at that pos for all samples
-    pos_groups = df.groupby(['position'])
-    for index, pos_df in pos_groups:
-        position = index[0]
-        plot_bar_position(pos_df, position)
+    Path(PNG_OUTDIR).mkdir(parents=True, exist_ok=True)
+    Path(SVG_OUTDIR).mkdir(parents=True, exist_ok=True)
+
+    # group by position: counts of all samples at that pos
+    positions = []
+    for index, pos_df in df.groupby(['position']):
+        positions.append((
+            index[0], 
+            tuple(pos_df['sample']), 
+            str(pos_df['ref'].iloc[0]), 
+            pos_df[['A', 'C', 'G', 'T']].fillna(0).to_numpy(dtype=float), 
+            pos_df[['a', 'c', 'g', 't']].fillna(0).to_numpy(dtype=float), 
+        ))
+    batches = [positions[i:i + batch_size] for i in range(0, len(positions), batch_size)]
+
+    with Pool(processes) as pool:
+        for _ in pool.imap_unordered(plot_position_batch, batches):
+            pass
 
 def main():
     # prep cmt file 
@@ -0,0 +1,122 @@
+"""
+To obtain per-base and binned depth straight from the indexed BAM files,
+without samtools depth text output (replaces 1.samtools_depth.sbatch + 2.parse_cov.py step 1).
+
+Per-base depth of each sample is written into the binary depth cache
+(see depth_cache.py), where all other QC scripts read it from; binned depth
+and z-score are written to data/2.parsed_depth as by 2.parse_cov.py.
+
+Depth is counted as samtools depth does by default: reads that are unmapped,
+secondary, QC-failed or duplicates are skipped, no base/mapping quality
+threshold, every aligned base counts (N bases included), deletions and
+reference skips do not. Depth of a region is built from the aligned blocks
+of its reads with a difference array. Regions of each contig are processed
+in parallel. Requires pysam.
+"""
+import os
+import sys
+from pathlib import Path
+from multiprocessing import Pool
+import numpy as np
+import pysam
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import depth_cache
+
+BAM_DIR = depth_cache.QC_DIR.parent / 'Modified-WideVariant-Pipeline' / '1-Mapping' / 'bowtie2'
+REGION_SIZE = 1_000_000  # positions per parallel task
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400  # unmapped, secondary, QC-failed, duplicate (samtools depth default)
+
+_worker = {}  # open BAM and depth array of each worker process, set by init_worker
+
+def init_worker(bam_path, depth_path, genome_length):
+    """
+    Open BAM and the (temporary) depth array of a sample in a pool worker.
+    """
+    _worker['bam'] = pysam.AlignmentFile(bam_path, 'rb')
+    _worker['depth'] = np.memmap(depth_path, dtype=np.uint32, mode='r+', shape=(genome_length,))
+
+def region_depth(region):
+    """
+    Depth of region (contig, start, end, offset on concatenated genome) into
+    the depth array; returns number of positions with depth > 0.
+    """
+    contig, start, end, offset = region
+    # +1 at the start and -1 at the end of each aligned block (M/=/X; not D/N), clipped to region
+    block_starts, block_ends = [], []
+    for read in _worker['bam'].fetch(contig, start, end):
+        if read.flag & SKIP_FLAGS:
+            continue
+        for block_start, block_end in read.get_blocks():
+            block_start, block_end = max(block_start, start), min(block_end, end)
+            if block_start < block_end:
+                block_starts.append(block_start - start)
+                block_ends.append(block_end - start)
+    size = end - start + 1
+    diff = np.bincount(np.asarray(block_starts, dtype=np.int64), minlength=size) - \
+        np.bincount(np.asarray(block_ends, dtype=np.int64), minlength=size)
+    depth = np.cumsum(diff[:-1]).astype(np.uint32)
+    _worker['depth'][offset + start:offset + end] = depth
+    _worker['depth'].flush()
+    return int(np.count_nonzero(depth))
+
+def bam_to_cache(bam_path, cache_dir=depth_cache.CACHE_DIR, processes=None, all_positions=False):
+    """
+    Compute per-base depth of a BAM file into the depth cache.
+        - Contig lengths are those of the BAM header (reference lengths).
+        - all_positions: as samtools depth -a (all positions count as listed).
+    """
+    bam_path = Path(bam_path)
+    if not Path(f'{bam_path}.bai').exists() and not bam_path.with_suffix('.bai').exists():
+        print(f'Indexing {bam_path}')
+        pysam.index(str(bam_path))
+
+    sname = depth_cache.sample_name(bam_path)
+    depth_path, meta_path = depth_cache.cache_paths(sname, cache_dir)
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    # cache already computed from this BAM
+    meta = depth_cache.read_meta(meta_path)
+    source = os.stat(bam_path)
+    if meta is not None and meta['source'] == str(bam_path.resolve()) and \
+            meta['source_size'] == source.st_size and meta['source_mtime_ns'] == source.st_mtime_ns:
+        return meta
+    print(f'Computing depth of {bam_path.name}')
+
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        contigs = list(bam.references)
+        lengths = list(bam.lengths)
+    genome_length = int(sum(lengths))
+    offsets = np.cumsum(lengths) - lengths
+
+    regions = []
+    for contig, length, offset in zip(contigs, lengths, offsets):
+        for start in range(0, length, REGION_SIZE):
+            regions.append((contig, start, min(start + REGION_SIZE, length), int(offset)))
+
+    tmp_depth_path = depth_path.with_name(depth_path.name + f'.{os.getpid()}.tmp')
+    np.memmap(tmp_depth_path, dtype=np.uint32, mode='w+', shape=(genome_length,)).flush()
+    with Pool(processes, initializer=init_worker, initargs=(str(bam_path), tmp_depth_path, genome_length)) as pool:
+        num_nonzero = sum(pool.imap_unordered(region_depth, regions))
+    os.replace(tmp_depth_path, depth_path)
+
+    num_rows = genome_length if all_positions else num_nonzero
+    return depth_cache.write_meta(sname, contigs, lengths, num_rows, bam_path, cache_dir)
+
+
+def main():
+    outdir = 'data/2.parsed_depth'
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+
+    for bam_path in sorted(BAM_DIR.glob("9301*_aligned.sorted.bam")):
+        ### 1. Per-base depth of BAM into depth cache ###
+        meta = bam_to_cache(bam_path)
+
+        ### 2. Obtain binned depth: raw and zscore normalized ###
+        depth, meta = depth_cache.load_cached(meta['sample'])
+        df = depth_cache.bin_depth(depth, meta)
+        df.to_csv(f'{outdir}/{meta["sample"]}.tsv', sep='\t', index=False)
+
+
+if __name__ == "__main__":
+    main()
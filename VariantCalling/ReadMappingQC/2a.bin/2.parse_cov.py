@@ -4,82 +4,54 @@ To obtain binned depth and z-score.
 Based on Konnor's genome depth scripts: 
     - https://github.com/konnorve/Variant-finding-workflow/blob/main/workflow/scripts/gen_genome_depth_variant_data.py
 """
+import sys
 from pathlib import Path 
+from multiprocessing import Pool
 import pandas as pd 
-import numpy as np
 
-def process_cov_file(fpath, outdir):
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import depth_cache
+
+def process_cov_file(fpath, outdir, bin_size=1000):
     """
-    Import output from samtools depth (cov across all positions).
+    Import output from samtools depth (cov across all positions), through 
+    the binary depth cache (converted on first use; see depth_cache.py). 
+        - Mean depth in bin_size windows of each contig; positions missing from 
+          the file (samtools depth without -a) count as depth 0. 
     """
-    fname = fpath.name.split('.')[0].split('_ref')[0]
-
-    df = pd.read_table(fpath, names=['contig', 'pos', 'depth'])
-    depth_arr = df.depth.to_numpy()
-
-    bin_size = 1000
-
-    genome_size = len(depth_arr)
-
-    bins = np.linspace(0, genome_size, int(genome_size/bin_size), dtype=int)
-
-    bin_info = []
-    # for each bin (1000bp windows)
-    for i in range(len(bins)-1):
-        bin_start = bins[i]
-        bin_end = bins[i+1]
-        bin_size = bin_end - bin_start
-        bin_midpoint = (bin_end + bin_start) / 2
-        mean_bin_depth = np.mean(depth_arr[bin_start:bin_end])
-
-        bin_info.append([bin_start, bin_end, bin_size, bin_midpoint, mean_bin_depth])
-
-    df = pd.DataFrame(bin_info, columns=["bin_start", "bin_end", "bin_size", "bin_midpoint", "mean_bin_depth"])
-    
-    # assign unique ID to bin 
-    df['bin_id'] = range(1, (len(df) + 1))
+    fname = depth_cache.sample_name(fpath)
 
-    # calculate z-score
-    df['mean_bin_depth_zscore'] = (df['mean_bin_depth'] - df['mean_bin_depth'].mean()) / df['mean_bin_depth'].std()
+    depth, meta = depth_cache.load_depth(fpath)
+    df = depth_cache.bin_depth(depth, meta, bin_size)
     
     df.to_csv(f'{outdir}/{fname}.tsv', sep='\t', index=False)
 
 
 def main():
     # input path 
-    samtools_depth_dir = Path("../data/1.samtools_depth_output")
+    samtools_depth_dir = depth_cache.DEPTH_DIR
 
     ### 1. Obtain binned depth: raw and zscore normalized ### 
     outdir = 'data/2.parsed_depth'
     Path(outdir).mkdir(parents=True, exist_ok=True)
 
-    for fpath in samtools_depth_dir.glob("9301*.cov"):
-        # process_cov_file(fpath, outdir)
-        pass
+    parse_depth = False  # set True to write binned depth tsv of each sample 
+    if parse_depth:
+        # all samples in parallel (one process per file, up to number of cores)
+        with Pool() as pool:
+            pool.starmap(process_cov_file, [(fpath, outdir) for fpath in samtools_depth_dir.glob("9301*.cov")])
 
-    ### 2. Aggregate all 9301 results by treatment for plotting ### 
-    dfs = []
-    for fpath in Path(outdir).glob('9301*tsv'):
-        sname = fpath.stem
-        treatment = sname[:-3]
-        rep = sname[-1]
-
-        df = pd.read_table(fpath)[['bin_id', 'mean_bin_depth_zscore', 'mean_bin_depth']]
-        df['treatment'] = treatment
-        df['rep'] = rep
-
-        dfs.append(df)
+    # binned depth of all 9301 samples, from depth cache 
+    binned_df = depth_cache.binned_depth_table('9301*')
 
-    df = pd.concat(dfs)
+    ### 2. Aggregate all 9301 results by treatment for plotting ### 
+    df = binned_df[['bin_id', 'mean_bin_depth_zscore', 'mean_bin_depth', 'treatment', 'rep']]
     df.to_csv('data/aggregate_cov.tsv', sep='\t', index=False)
 
     ### 3. obtain pos where std > 2
     dfs = []
-    for fpath in Path(outdir).glob('9301*tsv'):
-        sname = fpath.stem
-
-        df = pd.read_table(fpath)[['bin_id', 'mean_bin_depth']]
-        df['sname'] = sname
+    for sname, df in binned_df.groupby('sname'):
+        df = df[['bin_id', 'mean_bin_depth', 'sname']].copy()
 
         mean = df['mean_bin_depth'].mean()
         std = df['mean_bin_depth'].std()
@@ -112,4 +84,5 @@ def main():
 
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,14 @@ Based on Konnor's genome depth scripts:
 
 Nhi Vo - 06/10/24
 """
+import sys
 from pathlib import Path 
-import pandas as pd 
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import depth_cache
+
 def depth_histogram(fpath, df):
     """
     Plot mapping coverage. 
@@ -58,7 +61,8 @@ def main():
     #     depth_genome(fpath, df)
 
     ### 2. Plot aggreagte treatment line plot ###
-    df = pd.read_table('data/2.parsed_depth/aggregate_cov.tsv')
+    # binned depth of all 9301 samples, from depth cache (as in data/aggregate_cov.tsv)
+    df = depth_cache.binned_depth_table('9301*')
     treatment_groups = df.groupby(['treatment'])
     for index, tdf in treatment_groups:
         treatment = index[0]
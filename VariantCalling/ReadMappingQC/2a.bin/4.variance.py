@@ -1,7 +1,12 @@
-import pandas as pd 
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import depth_cache
 
 def main():
-    df = pd.read_table('data/2.parsed_depth/aggregate_cov.tsv')
+    # binned depth of all 9301 samples, from depth cache (as in data/aggregate_cov.tsv)
+    df = depth_cache.binned_depth_table('9301*')
 
     # groupby treatment and obtain variance
     # treatment_groups = df.groupby(['treatment'])
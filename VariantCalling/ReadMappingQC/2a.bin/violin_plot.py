@@ -1,18 +1,23 @@
+import sys
 import pandas as pd 
 from pathlib import Path 
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import depth_cache
+
 def main():
-    HTseq_dir = "data/2.parsed_depth/"
+    # binned depth of all 9301 samples, from depth cache
+    binned_df = depth_cache.binned_depth_table('9301*')
 
     dfs = [] 
-    for fpath in Path(HTseq_dir).glob("9301*"):
-        df = pd.read_table(fpath)
+    for sname, df in binned_df.groupby('sname'):
+        df = df.drop(columns=['treatment', 'rep'])
 
         # add exp name, treatment, timepoint
-        df['sname'] = fpath.stem.replace('9301-', '')
+        df['sname'] = sname.replace('9301-', '')
         df['treatment'] = df['sname'].str.split('-').str[0].str[:-1]
         df['timepoint'] = df['sname'].str.split('-').str[0].str[-1]
         df['rep'] = df['sname'].str.split('-').str[1].str[-1].astype(int)
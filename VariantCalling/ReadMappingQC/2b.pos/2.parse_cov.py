@@ -1,44 +1,93 @@
 """
-Purpose: 
+Purpose: count, for each position, the number of samples in which its depth
+is an outlier (> 2 standard deviations from the sample's mean depth).
 
+Streams the depth of each sample twice from the binary depth cache (see
+depth_cache.py), so memory does not grow with the number of samples:
+    - pass 1: mean and std of depth of each sample
+    - pass 2: per-position outlier counts in a single genome_length array
+As with the .cov files, only positions listed by samtools depth are used.
 """
-from pathlib import Path 
-import pandas as pd 
+import sys
+from pathlib import Path
+import pandas as pd
 import numpy as np
 
-def main():
-    samtools_depth_dir = "../data/1.samtools_depth_output/"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import depth_cache
+
+def depth_stats(depth, meta):
+    """
+    Pass 1: mean and std (ddof=1, as pandas) of depth of one sample.
+        - Chunk statistics are combined with Chan et al.'s pairwise update.
+    """
+    n = 0
+    mean = 0.0
+    m2 = 0.0  # sum of squared deviations from mean
+    for _, _, values in depth_cache.iter_contig_chunks(depth, meta):
+        values = values[depth_cache.listed(values, meta)]
+        chunk_n = len(values)
+        if chunk_n == 0:
+            continue
+        chunk_mean = values.mean()
+        chunk_m2 = np.square(values - chunk_mean).sum()
 
-    dfs = []
-    for fpath in Path(samtools_depth_dir).glob('9301*cov'):
-        df = pd.read_table(fpath, names=['contig', 'position', 'count'])
-        
-        sname = fpath.name.split('.')[0].split('_ref')[0]
-        treatment = sname[:-3]
-        rep = sname[-1]
-        df['treatment'] = treatment
-        df['rep'] = rep        
+        delta = chunk_mean - mean
+        total = n + chunk_n
+        mean += delta * chunk_n / total
+        m2 += chunk_m2 + delta ** 2 * n * chunk_n / total
+        n = total
 
-        mean = df['count'].mean()
-        std = df['count'].std()
+    std = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+    return mean, std
 
-        # obtain positions with coverage of >2 standard deviation 
-        df['> 2std'] = (df['count'] > mean + 2 * std) | (df['count'] < mean - 2 * std)
+def count_outliers(depth, meta, mean, std, contig_offsets, outlier_counts):
+    """
+    Pass 2: add 1 to outlier_counts at the positions of one sample with
+    depth > 2 std from its mean.
+    """
+    for contig, start, values in depth_cache.iter_contig_chunks(depth, meta):
+        outlier = depth_cache.listed(values, meta) & ((values > mean + 2 * std) | (values < mean - 2 * std))
+        outlier_counts[contig_offsets[contig] + start + np.flatnonzero(outlier)] += 1
+
+def main():
+    snames = depth_cache.sample_names('9301*')
 
-        # filter for outliers 
-        df = df[df['> 2std'] == True]
+    ### pass 1: per-sample mean/std ###
+    contig_lengths = {}
+    stats = []
+    for sname in snames:
+        depth, meta = depth_cache.load_sample(sname)
+        stats.append(depth_stats(depth, meta))
+        for contig, length in zip(meta['contigs'], meta['lengths']):
+            contig_lengths[contig] = max(contig_lengths.get(contig, 0), length)
 
-        dfs.append(df)
+    # contigs concatenated in order of appearance
+    lengths = np.array(list(contig_lengths.values()), dtype=np.int64)
+    contig_offsets = dict(zip(contig_lengths.keys(), np.cumsum(lengths) - lengths))
+    genome_length = int(lengths.sum())
 
-    df = pd.concat(dfs)
+    ### pass 2: per-position outlier counts ###
+    outlier_counts = np.zeros(genome_length, dtype=np.int32)
+    for sname, (mean, std) in zip(snames, stats):
+        depth, meta = depth_cache.load_sample(sname)
+        count_outliers(depth, meta, mean, std, contig_offsets, outlier_counts)
 
-    # count number of times position is present in df 
-    pos_count_df = df['position'].value_counts().reset_index()
-    pos_count_df.columns = ['position', 'sample_count']
+    # number of samples in which each position is an outlier (as value_counts: most frequent first)
+    index = np.flatnonzero(outlier_counts)
+    order = np.argsort(-outlier_counts[index], kind='stable')
+    index = index[order]
+    contig_of = np.searchsorted(np.cumsum(lengths), index, side='right')
+    pos_count_df = pd.DataFrame({
+        'contig': np.array(list(contig_lengths.keys()), dtype=object)[contig_of],
+        'position': index - (np.cumsum(lengths) - lengths)[contig_of] + 1,
+        'sample_count': outlier_counts[index],
+    })
 
-    # filter for pos where >2std is not in all samples (sample count=53)
-    print(pos_count_df[pos_count_df['sample_count'] < 53])
-    print(len(pos_count_df[pos_count_df['sample_count'] < 53]))
+    # filter for pos where >2std is not in all samples
+    sample_count = len(snames)
+    print(pos_count_df[pos_count_df['sample_count'] < sample_count])
+    print(len(pos_count_df[pos_count_df['sample_count'] < sample_count]))
 
     # count sample_count
     sample_count_df = pos_count_df['sample_count'].value_counts().reset_index()
@@ -47,4 +96,5 @@ def main():
     sample_count_df.to_excel('data/std_count.xlsx', index=False)
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Binary cache of samtools depth output, shared by the ReadMappingQC scripts.
+
+Each data/1.samtools_depth_output/<sample>.cov text file is converted once into
+    data/depth_cache/<sample>.depth.u32   raw uint32 depth of every position (contigs concatenated)
+    data/depth_cache/<sample>.depth.json  contig names and lengths, rows in .cov file, source size/mtime
+and is read back as a memory-mapped array, so QC scripts never re-parse the
+text depth files. The cache is rebuilt when its .cov file changes.
+
+Positions missing from the .cov file (zero depth; samtools depth without -a)
+are 0. A contig ends at its last position in the .cov file.
+
+Caches can also be computed straight from the BAM files with
+2a.bin/2.bam_depth.py (contigs then have their reference lengths). Where a
+.cov file exists, the cache is rebuilt from it when it is loaded by sample name.
+"""
+import os
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+QC_DIR = Path(__file__).resolve().parent
+DEPTH_DIR = QC_DIR / 'data' / '1.samtools_depth_output'
+CACHE_DIR = QC_DIR / 'data' / 'depth_cache'
+
+COV_COLUMNS = ['contig', 'pos', 'depth']
+COV_DTYPES = {'contig': 'category', 'pos': np.uint32, 'depth': np.uint32}
+CHUNK_ROWS = 5_000_000  # rows of a .cov file (or positions of a cache) processed at once
+
+def sample_name(fpath):
+    """
+    Sample name of a samtools depth file: '9301-adh1-R1' from '9301-adh1-R1_ref_MIT9301.cov'.
+    """
+    return Path(fpath).name.split('.')[0].split('_ref')[0]
+
+def cache_paths(sname, cache_dir=CACHE_DIR):
+    """
+    Paths of the depth array and metadata sidecar of a sample.
+    """
+    return Path(cache_dir) / f'{sname}.depth.u32', Path(cache_dir) / f'{sname}.depth.json'
+
+def convert_cov(cov_path, cache_dir=CACHE_DIR, chunk_rows=CHUNK_ROWS):
+    """
+    Convert a samtools depth file into the cache, reading it in chunks.
+        - Rows of a contig must be contiguous and sorted by position
+          (as written by samtools depth).
+        - Files are written under temporary names and renamed, the sidecar
+          last, so an interrupted conversion leaves no valid cache.
+    """
+    cov_path = Path(cov_path)
+    sname = sample_name(cov_path)
+    depth_path, _ = cache_paths(sname, cache_dir)
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    contigs = []
+    lengths = []
+    num_rows = 0
+    tmp_depth_path = depth_path.with_name(depth_path.name + f'.{os.getpid()}.tmp')
+    with open(tmp_depth_path, 'wb') as out:
+        for chunk in pd.read_table(cov_path, names=COV_COLUMNS, dtype=COV_DTYPES, chunksize=chunk_rows):
+            codes = chunk['contig'].cat.codes.to_numpy()
+            names = chunk['contig'].cat.categories
+            pos = chunk['pos'].to_numpy().astype(np.int64)
+            depth = chunk['depth'].to_numpy()
+            num_rows += len(pos)
+
+            # runs of rows from the same contig
+            run_starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+            run_ends = np.append(run_starts[1:], len(codes))
+            for start, end in zip(run_starts, run_ends):
+                contig = names[codes[start]]
+                if not contigs or contigs[-1] != contig:
+                    if contig in contigs:
+                        raise ValueError(f'Rows of contig {contig} are not contiguous in {cov_path}')
+                    contigs.append(contig)
+                    lengths.append(0)
+                run_pos = pos[start:end]
+                if run_pos[0] <= lengths[-1] or np.any(np.diff(run_pos) <= 0):
+                    raise ValueError(f'Positions of contig {contig} are not sorted in {cov_path}')
+
+                # dense segment from next position to write up to last position of run (gaps = 0)
+                segment = np.zeros(run_pos[-1] - lengths[-1], dtype=np.uint32)
+                segment[run_pos - lengths[-1] - 1] = depth[start:end]
+                out.write(segment.tobytes())
+                lengths[-1] = int(run_pos[-1])
+    os.replace(tmp_depth_path, depth_path)
+
+    return write_meta(sname, contigs, lengths, num_rows, cov_path, cache_dir)
+
+def write_meta(sname, contigs, lengths, num_rows, source_path, cache_dir=CACHE_DIR):
+    """
+    Write metadata sidecar of a sample whose depth array is in place, which
+    makes its cache valid.
+        - num_rows: positions samtools depth would list (all positions with -a).
+        - source_path: file the depth was computed from (.cov or .bam).
+    """
+    _, meta_path = cache_paths(sname, cache_dir)
+    source = os.stat(source_path)
+    meta = {
+        'sample': sname,
+        'contigs': [str(contig) for contig in contigs],
+        'lengths': [int(length) for length in lengths],
+        'num_rows': int(num_rows),
+        'source': str(Path(source_path).resolve()),
+        'source_size': source.st_size,
+        'source_mtime_ns': source.st_mtime_ns,
+    }
+    tmp_meta_path = meta_path.with_name(meta_path.name + f'.{os.getpid()}.tmp')
+    with open(tmp_meta_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta_path, meta_path)
+
+    return meta
+
+def read_meta(meta_path):
+    """
+    Metadata sidecar as dict, or None if missing or incomplete.
+    """
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_cached(sname, cache_dir=CACHE_DIR):
+    """
+    Depth array (read-only memmap) and metadata of a cached sample.
+    """
+    depth_path, meta_path = cache_paths(sname, cache_dir)
+    meta = read_meta(meta_path)
+    if meta is None:
+        raise FileNotFoundError(f'No depth cache for {sname} in {cache_dir}')
+    depth = np.memmap(depth_path, dtype=np.uint32, mode='r', shape=(sum(meta['lengths']),))
+    return depth, meta
+
+def update_cache(cov_path, cache_dir=CACHE_DIR):
+    """
+    Convert a samtools depth file if it has no cache or changed since; returns metadata.
+    """
+    _, meta_path = cache_paths(sample_name(cov_path), cache_dir)
+    meta = read_meta(meta_path)
+    source = os.stat(cov_path)
+    if meta is None or meta['source_size'] != source.st_size or meta['source_mtime_ns'] != source.st_mtime_ns:
+        meta = convert_cov(cov_path, cache_dir)
+    return meta
+
+def load_depth(cov_path, cache_dir=CACHE_DIR):
+    """
+    Depth array (read-only memmap) and metadata of a samtools depth file,
+    converting it first if needed (see update_cache).
+    """
+    update_cache(cov_path, cache_dir)
+    return load_cached(sample_name(cov_path), cache_dir)
+
+def sample_names(pattern='9301*', depth_dir=DEPTH_DIR, cache_dir=CACHE_DIR):
+    """
+    Sorted names of samples matching pattern, from .cov files or (if those
+    were removed) from the cache.
+    """
+    snames = {sample_name(fpath) for fpath in Path(depth_dir).glob(f'{pattern}.cov')}
+    snames.update(Path(fpath).name[:-len('.depth.json')] for fpath in Path(cache_dir).glob(f'{pattern}.depth.json'))
+    return sorted(snames)
+
+def load_sample(sname, depth_dir=DEPTH_DIR, cache_dir=CACHE_DIR):
+    """
+    Depth array and metadata of a sample by name; the cache is (re)built
+    from its .cov file if there is one.
+    """
+    cov_paths = sorted(Path(depth_dir).glob(f'{sname}_ref*.cov')) + sorted(Path(depth_dir).glob(f'{sname}.cov'))
+    if cov_paths:
+        return load_depth(cov_paths[0], cache_dir)
+    return load_cached(sname, cache_dir)
+
+def listed(values, meta):
+    """
+    Boolean mask of depth values (of a sample's cache, or a chunk of it) that
+    were rows of the .cov file: all if it was made with samtools depth -a,
+    otherwise those with depth > 0.
+    """
+    if meta['num_rows'] == sum(meta['lengths']):
+        return np.ones(len(values), dtype=bool)
+    return values > 0
+
+def iter_contig_chunks(depth, meta, chunk_size=CHUNK_ROWS):
+    """
+    Yields (contig, 0-based start on contig, depth values) in chunks of at
+    most chunk_size positions.
+    """
+    offset = 0
+    for contig, length in zip(meta['contigs'], meta['lengths']):
+        for start in range(0, length, chunk_size):
+            yield contig, start, depth[offset + start:offset + min(start + chunk_size, length)]
+        offset += length
+
+def bin_depth(depth, meta, bin_size=1000):
+    """
+    Mean depth in bin_size windows of each contig, and its z-score across bins.
+        - Bins are [k*bin_size, (k+1)*bin_size) of 0-based positions on each
+          contig; the last bin of a contig is shorter.
+    """
+    dfs = []
+    offset = 0
+    for contig, length in zip(meta['contigs'], meta['lengths']):
+        bin_start = np.arange(0, length, bin_size)
+        bin_end = np.minimum(bin_start + bin_size, length)
+        sums = np.add.reduceat(depth[offset:offset + length], bin_start, dtype=np.uint64)
+        offset += length
+
+        dfs.append(pd.DataFrame({
+            'contig': contig,
+            'bin_start': bin_start,
+            'bin_end': bin_end,
+            'bin_size': bin_end - bin_start,
+            'bin_midpoint': (bin_end + bin_start) / 2,
+            'mean_bin_depth': sums / (bin_end - bin_start),
+        }))
+
+    df = pd.concat(dfs, ignore_index=True)
+
+    # assign unique ID to bin
+    df['bin_id'] = range(1, (len(df) + 1))
+
+    # calculate z-score
+    df['mean_bin_depth_zscore'] = (df['mean_bin_depth'] - df['mean_bin_depth'].mean()) / df['mean_bin_depth'].std()
+
+    return df
+
+def binned_depth_table(pattern='9301*', bin_size=1000, depth_dir=DEPTH_DIR, cache_dir=CACHE_DIR):
+    """
+    Binned depth (see bin_depth) of all samples matching pattern, with
+    sample name (sname), treatment and replicate (rep) columns.
+    """
+    dfs = []
+    for sname in sample_names(pattern, depth_dir, cache_dir):
+        depth, meta = load_sample(sname, depth_dir, cache_dir)
+        df = bin_depth(depth, meta, bin_size)
+        df['sname'] = sname
+        df['treatment'] = sname[:-3]
+        df['rep'] = sname[-1]
+        dfs.append(df)
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+if __name__ == "__main__":
+    # convert all samtools depth files (once; up to date caches are kept)
+    from multiprocessing import Pool
+    with Pool() as pool:
+        pool.map(update_cache, sorted(DEPTH_DIR.glob('*.cov')))